@@ -2,6 +2,7 @@
 Flask application initialization and configuration
 """
 import os
+import multiprocessing
 from flask import Flask, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
@@ -67,14 +68,23 @@ db = SQLAlchemy(app)
 # Import routes after app initialization to avoid circular imports
 from app import routes, auth, storage, models, coloring_routes
 
-# Initialize database tables - with error handling for missing database
-try:
-    with app.app_context():
-        db.create_all()
-        print("Database tables created successfully")
-except Exception as e:
-    print(f"Warning: Could not initialize database: {e}")
-    print("Database operations will fail until a database is configured")
+# Canvas pool worker processes import this package too - they only compute,
+# so skip table creation in them. Job workers are started by the serving
+# entrypoints (run.py, gunicorn.conf.py), not on import
+_is_main_process = multiprocessing.current_process().name == 'MainProcess'
+
+if _is_main_process:
+    # Initialize database tables - with error handling for missing database
+    try:
+        with app.app_context():
+            db.create_all()
+            print("Database tables created successfully")
+            from app.schema import upgrade_schema
+            upgrade_schema()
+    except Exception as e:
+        print(f"Warning: Could not initialize database: {e}")
+        print("Database operations will fail until a database is configured")
+
 
 # Health check endpoint
 @app.route('/health', methods=['GET'])
@@ -0,0 +1,138 @@
+"""
+Admission control for processing jobs
+
+Before a new job is queued, the wait it would have is estimated from the
+current queue depth, the number of workers serving the queue and recent
+per-job service times (all read from the jobs table, so the estimate covers
+every instance). Uploads are turned away with a Retry-After instead of
+queueing behind a backlog nobody will wait for:
+
+- 503 when the estimated wait exceeds ADMISSION_MAX_WAIT (service overloaded)
+- 429 when the user already has ADMISSION_MAX_USER_JOBS jobs pending
+
+Configuration (env):
+    ADMISSION_MAX_WAIT          Max estimated queue wait in seconds (default 900, 0 = no limit)
+    ADMISSION_MAX_USER_JOBS     Max queued/running jobs per user (default 20, 0 = no limit)
+    ADMISSION_WORKERS           Workers serving the queue (default 0 = workers seen recently)
+    ADMISSION_DEFAULT_SERVICE   Seconds per job until there is history (default 30)
+"""
+
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Job
+from app import metrics
+
+
+# Completed jobs used to estimate service time, and how recently a worker
+# must have run a job to count towards capacity
+SERVICE_SAMPLE = 50
+WORKER_WINDOW = timedelta(minutes=10)
+
+# Service time and capacity change slowly - don't query them on every upload
+STATS_TTL = 5.0
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _service_stats(kind):
+    """
+    Recent mean service time and worker count for a job kind (cached for STATS_TTL)
+
+    Returns:
+        tuple: (seconds per job, workers)
+    """
+    now = time.monotonic()
+    with _stats_lock:
+        cached = _stats.get(kind)
+        if cached and now - cached[0] < STATS_TTL:
+            return cached[1], cached[2]
+
+    recent = db.session.query(Job.started_at, Job.finished_at)\
+                       .filter(Job.kind == kind, Job.status == 'completed')\
+                       .order_by(Job.created_at.desc())\
+                       .limit(SERVICE_SAMPLE)\
+                       .all()
+    durations = [(finished - started).total_seconds() for started, finished in recent if started and finished]
+    service = sum(durations) / len(durations) if durations else float(os.getenv('ADMISSION_DEFAULT_SERVICE', 30))
+
+    workers = int(os.getenv('ADMISSION_WORKERS', 0))
+    if workers <= 0:
+        since = datetime.utcnow() - WORKER_WINDOW
+        workers = db.session.query(db.func.count(db.distinct(Job.worker_id)))\
+                            .filter(Job.kind == kind, Job.worker_id.isnot(None), Job.started_at >= since)\
+                            .scalar() or 0
+        workers = max(1, workers)
+
+    with _stats_lock:
+        _stats[kind] = (now, service, workers)
+
+    return service, workers
+
+
+def estimate_wait(kind='canvas'):
+    """
+    Estimate how long a job queued now would take
+
+    Returns:
+        dict: queued, workers, service_seconds, wait_seconds (until a worker
+              picks it up) and completion_seconds (until it is done)
+    """
+    service, workers = _service_stats(kind)
+    queued = Job.query.filter(Job.kind == kind, Job.status == 'queued').count()
+
+    wait = queued / workers * service
+    return {
+        'queued': queued,
+        'workers': workers,
+        'service_seconds': round(service, 1),
+        'wait_seconds': round(wait, 1),
+        'completion_seconds': round(wait + service, 1)
+    }
+
+
+def check_admission(user_id, kind='canvas'):
+    """
+    Decide whether a new job for user_id may be queued
+
+    Returns:
+        dict: estimate_wait() plus 'admitted'; rejected requests also carry
+              'status_code' (429/503), 'retry_after' (seconds) and 'error'
+    """
+    estimate = estimate_wait(kind)
+    estimate['admitted'] = True
+    metrics.observe('admission_estimated_wait_seconds', estimate['wait_seconds'], kind=kind)
+
+    max_user_jobs = int(os.getenv('ADMISSION_MAX_USER_JOBS', 20))
+    if max_user_jobs and user_id:
+        pending = Job.query.filter(Job.user_id == user_id, Job.kind == kind,
+                                   Job.status.in_(('queued', 'running'))).count()
+        if pending >= max_user_jobs:
+            # Until enough of the user's own jobs have finished
+            excess = pending - max_user_jobs + 1
+            estimate.update({
+                'admitted': False,
+                'status_code': 429,
+                'retry_after': max(1, math.ceil(excess * estimate['service_seconds'])),
+                'error': f'Too many images processing ({pending}). Wait for some to finish before uploading more.'
+            })
+            metrics.inc('admission_rejected_total', kind=kind, reason='user_backlog')
+            return estimate
+
+    max_wait = float(os.getenv('ADMISSION_MAX_WAIT', 900))
+    if max_wait and estimate['wait_seconds'] > max_wait:
+        # Until the queue has drained back below the limit
+        estimate.update({
+            'admitted': False,
+            'status_code': 503,
+            'retry_after': max(1, math.ceil(estimate['wait_seconds'] - max_wait)),
+            'error': 'Processing is at capacity right now. Please try again later.'
+        })
+        metrics.inc('admission_rejected_total', kind=kind, reason='queue_full')
+
+    return estimate
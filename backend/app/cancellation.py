@@ -0,0 +1,104 @@
+"""
+Cooperative cancellation of running jobs
+
+A running job gets a CancelToken. Long-running code calls token.check()
+between steps and stops with JobCancelled once the job has been cancelled
+(project deleted, or cancelled by the user).
+
+Cancel requests are recorded on the job row (Job.cancel_requested_at), so any
+instance can cancel a job running on another one: the owning worker pool
+polls for them and cancels the local token. Tokens also work across the
+canvas process pool - cancelling one creates a marker file that the worker
+process checks, since a threading.Event can't be shared with it.
+"""
+
+import os
+import tempfile
+import threading
+
+
+# Marker files for tokens used in other processes
+CANCEL_DIR = os.path.join(tempfile.gettempdir(), 'cloud-gallery-cancel')
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """The job was cancelled - stop work and clean up"""
+
+
+class CancelToken:
+    """Cancellation flag for one job, usable in this process and in pool workers"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.path = os.path.join(CANCEL_DIR, job_id)
+        self._event = threading.Event()
+
+    def __getstate__(self):
+        # Pickled into worker processes: only the marker file path travels
+        return {'job_id': self.job_id, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Flag the job as cancelled (here and in any worker process)"""
+        self._event.set()
+        try:
+            os.makedirs(CANCEL_DIR, exist_ok=True)
+            with open(self.path, 'w'):
+                pass
+        except OSError as e:
+            print(f"⚠️  Could not write cancel marker for {self.job_id}: {e}")
+
+    def is_cancelled(self):
+        """True once cancel() was called for this job"""
+        if self._event.is_set():
+            return True
+        if os.path.exists(self.path):
+            self._event.set()
+            return True
+        return False
+
+    def check(self):
+        """Raise JobCancelled if the job was cancelled"""
+        if self.is_cancelled():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+
+def open_token(job_id):
+    """Create (or get) the token for a job starting in this process"""
+    with _tokens_lock:
+        token = _tokens.get(job_id)
+        if token is None:
+            token = _tokens[job_id] = CancelToken(job_id)
+        return token
+
+
+def get_token(job_id):
+    """Token of a job running in this process, or None"""
+    with _tokens_lock:
+        return _tokens.get(job_id)
+
+
+def cancel_local(job_id):
+    """Cancel a job if it runs in this process; returns True if it did"""
+    token = get_token(job_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+
+def close_token(job_id):
+    """Forget a finished job's token and remove its marker file"""
+    with _tokens_lock:
+        token = _tokens.pop(job_id, None)
+    if token is not None:
+        try:
+            os.remove(token.path)
+        except OSError:
+            pass
@@ -0,0 +1,211 @@
+"""
+Canvas result cache
+
+Uploading the same photo twice (re-uploads, client retries) used to rerun the
+whole canvas pipeline. Results are now stored in `canvas_results` under a key
+derived from the decoded image as the pipeline sees it plus every setting that
+affects the output (colors, region size, canvas size, stylization, engine
+version):
+
+- ready row:   new projects get the stored template immediately
+- pending row: a job for the same input is in flight, so the new project just
+               waits for it (result_key) instead of queueing another job
+- no row:      the project's job becomes the producer for that key
+"""
+
+import os
+import hashlib
+from datetime import datetime
+
+from app import db
+from app.models import CanvasResult, ColoringProject, Job
+from app.image_loader import load_image_bytes
+from app.canvas_pipeline import CANVAS_ENGINE_VERSION
+from app.remote_stylizer import get_remote_stylizer
+from app.storage import copy_images
+
+
+def canvas_params(num_colors):
+    """Generation settings for a project (env defaults shared with the job)"""
+    return {
+        'num_colors': int(num_colors),
+        'max_size': int(os.getenv('MAX_CANVAS_SIZE', 800)),
+        'min_region_size': int(os.getenv('MIN_REGION_SIZE', 200))
+    }
+
+
+def stylization_id():
+    """Which preprocessing the pipeline will apply ('local' or the remote service)"""
+    stylizer = get_remote_stylizer()
+    if stylizer is None:
+        return 'local'
+    return f"remote:{stylizer.backend}:{stylizer.model_name if stylizer.backend == 'gemini' else stylizer.url}"
+
+
+def result_key(image_bytes, params):
+    """
+    Cache key for an upload
+
+    Hashes the decoded pixels at canvas scale, so re-encoded copies of the
+    same picture (stripped EXIF, different container) share a result.
+
+    Args:
+        image_bytes: Encoded upload
+        params: canvas_params() dict
+
+    Returns:
+        str: Hex key, or None if the image can't be decoded
+    """
+    try:
+        image = load_image_bytes(image_bytes, target_size=params['max_size'])
+    except ValueError:
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(f"{image.shape}".encode())
+    digest.update(image.tobytes())
+    digest.update(
+        f"|{params['num_colors']}|{params['min_region_size']}|{params['max_size']}"
+        f"|{stylization_id()}|v{CANVAS_ENGINE_VERSION}".encode()
+    )
+    return digest.hexdigest()
+
+
+def template_blob_path(key):
+    """Cloud path of a cached result's template preview (shared by all projects using it)"""
+    return f"coloring/results/{key}_template.png"
+
+
+def project_template_path(user_id, project_id):
+    """Cloud path of a template preview owned by one project"""
+    return f"coloring/{user_id}/{project_id}_canvas_template.png"
+
+
+def is_reusable(template_data):
+    """
+    Whether a result may be kept for reuse
+
+    Results produced with a different stylization than the key asked for
+    (remote service failed, local fallback was used) or with degraded
+    settings (time budget ran out) are not: the next upload of the same image
+    should get a full result.
+    """
+    wanted = 'local' if stylization_id() == 'local' else 'remote'
+    metadata = template_data['metadata']
+    return metadata.get('stylization') == wanted and not metadata.get('processing', {}).get('degraded')
+
+
+def find_ready_result(key):
+    """Get a finished result and count the hit, or None"""
+    result = CanvasResult.query.filter_by(key=key, status='ready').first()
+    if result:
+        result.hit_count += 1
+        result.last_used_at = datetime.utcnow()
+    return result
+
+
+def in_flight_job_id(key):
+    """Id of the live job producing key, or None (no row, or its job died)"""
+    result = db.session.get(CanvasResult, key)
+    if result is None or result.status != 'pending':
+        return None
+
+    job = db.session.get(Job, result.job_id) if result.job_id else None
+    if job is None or job.status not in ('queued', 'running') or job.cancel_requested_at:
+        return None
+
+    return job.id
+
+
+def claim_result(key, job_id):
+    """Make job_id the producer of key (adds the pending row, or takes over a stale one)"""
+    result = db.session.get(CanvasResult, key)
+    if result is None:
+        db.session.add(CanvasResult(key=key, status='pending', job_id=job_id))
+    else:
+        result.status = 'pending'
+        result.job_id = job_id
+
+
+def store_result(key, template_data, template_image_url):
+    """
+    Save a finished result and complete every project waiting for it
+
+    Results that aren't reusable (see is_reusable) complete the waiting
+    projects but are not kept. Their template isn't at the shared path then,
+    so each waiting project gets its own copy of it - a later run for the same
+    key must not change a template these projects' region data describes.
+    Caller commits.
+
+    Args:
+        key: Result key
+        template_data: Canvas data
+        template_image_url: Uploaded template - template_blob_path(key) if
+                            the result is reusable
+
+    Returns:
+        list: Ids of the projects completed
+    """
+    waiting = ColoringProject.query.filter_by(result_key=key, status='processing').all()
+    now = datetime.utcnow()
+    reusable = is_reusable(template_data)
+
+    copies = []
+    for project in waiting:
+        project.template_data = template_data
+        project.template_image_url = template_image_url
+        if not reusable:
+            project.template_image_url = project_template_path(project.user_id, project.id)
+            copies.append((template_image_url, project.template_image_url))
+        project.status = 'completed'
+        project.updated_at = now
+
+    if copies:
+        copy_images(copies)
+
+    result = db.session.get(CanvasResult, key)
+
+    if not reusable:
+        if result:
+            db.session.delete(result)
+    elif result is None:
+        db.session.add(CanvasResult(key=key, status='ready', template_data=template_data,
+                                    template_image_url=template_image_url))
+    else:
+        result.status = 'ready'
+        result.job_id = None
+        result.template_data = template_data
+        result.template_image_url = template_image_url
+        result.last_used_at = now
+
+    return [project.id for project in waiting]
+
+
+def fail_result(key, error):
+    """
+    Drop a pending result whose job failed and fail the projects waiting for it
+
+    Caller commits.
+
+    Returns:
+        list: Ids of the projects failed
+    """
+    result = db.session.get(CanvasResult, key)
+    if result is not None and result.status == 'pending':
+        db.session.delete(result)
+
+    waiting = ColoringProject.query.filter_by(result_key=key, status='processing').all()
+    for project in waiting:
+        project.status = 'failed'
+        project.error_message = error
+        project.updated_at = datetime.utcnow()
+
+    return [project.id for project in waiting]
+
+
+def has_waiting_projects(key, exclude=None):
+    """True if any project (other than exclude) is still waiting for key"""
+    query = ColoringProject.query.filter_by(result_key=key, status='processing')
+    if exclude:
+        query = query.filter(ColoringProject.id != exclude)
+    return query.first() is not None
@@ -0,0 +1,267 @@
+"""
+Canvas generation pipeline (CPU-bound part only)
+
+Everything here is pure computation on local files - no database, no cloud
+storage - so it can run in a separate worker process. Inputs are passed by
+path and results come back as compact numpy arrays (see pack_canvas_data)
+instead of deeply nested lists, which keeps pickling between processes cheap.
+"""
+
+import os
+import time
+import numpy as np
+
+from app.neural_cartoon_processor import NeuralCartoonProcessor
+from app.canvas_processor import InteractiveCanvasGenerator, CanvasDeadlineExceeded
+from app.remote_stylizer import get_remote_stylizer
+from app.cpu_budget import apply_thread_budget
+
+
+# Bump whenever a change to preprocessing or canvas generation changes its
+# output, so cached canvas results (app.canvas_cache) are not reused
+CANVAS_ENGINE_VERSION = 2
+
+
+# Settings ladder for deadline-bounded generation. Each level may run until
+# `until` x time budget; if it is still busy then, generation restarts one
+# level down. The last level is cheap and always runs to completion.
+DEGRADATION_LADDER = (
+    {'until': 0.5, 'max_size': None, 'max_colors': None, 'region_scale': 1.0,
+     'kmeans_sample': None, 'kmeans_n_init': 10},
+    {'until': 0.7, 'max_size': None, 'max_colors': None, 'region_scale': 1.0,
+     'kmeans_sample': 50000, 'kmeans_n_init': 3},
+    {'until': 0.85, 'max_size': 600, 'max_colors': 20, 'region_scale': 1.5,
+     'kmeans_sample': 30000, 'kmeans_n_init': 2},
+    {'until': None, 'max_size': 400, 'max_colors': 12, 'region_scale': 2.0,
+     'kmeans_sample': 20000, 'kmeans_n_init': 1},
+)
+
+
+def estimate_cost(width, height, num_colors, max_size):
+    """
+    Relative cost of generating a canvas (scheduling hint, not a time)
+
+    K-means and the per-color passes scale with canvas pixels x colors.
+
+    Returns:
+        int: Cost units (~720 for an 800x600, 15-color canvas)
+    """
+    scale = min(1.0, max_size / max(width, height, 1))
+    pixels = width * scale * height * scale
+    return max(1, int(pixels / 1000 * num_colors / 10))
+
+
+def ladder_settings(level, num_colors, max_size, min_region_size):
+    """Generation settings actually used at a degradation level"""
+    step = DEGRADATION_LADDER[level]
+    return {
+        'level': level,
+        'num_colors': min(num_colors, step['max_colors']) if step['max_colors'] else num_colors,
+        'max_size': min(max_size, step['max_size']) if step['max_size'] else max_size,
+        'min_region_size': int(min_region_size * step['region_scale']),
+        'kmeans_sample': step['kmeans_sample'],
+        'kmeans_n_init': step['kmeans_n_init']
+    }
+
+
+def generate_canvas(project_id, image_path, num_colors, output_dir, max_size=800, min_region_size=200,
+                    progress_callback=None, time_budget=None, cancel_token=None):
+    """
+    Run preprocessing + canvas generation for one project
+
+    Args:
+        project_id: Project id (used for output file names)
+        image_path: Path to the original photo
+        num_colors: Number of palette colors
+        output_dir: Directory for the template preview
+        max_size: Maximum canvas dimension (pixels)
+        min_region_size: Minimum pixels per region
+        progress_callback: Optional callable(stage) invoked as each stage starts
+                           ('decode', 'stylize', 'quantize', 'simplify', 'merge', 'extract')
+        time_budget: Seconds the job should take at most (None/0 = unbounded). When
+                     a level of DEGRADATION_LADDER runs out of time, generation is
+                     retried with cheaper settings.
+        cancel_token: Optional app.cancellation.CancelToken - checked at every stage
+                      and inside the per-region loops; raises JobCancelled
+
+    Returns:
+        tuple: (canvas_data, template_path) - canvas_data['metadata']['processing']
+               records the settings actually used
+    """
+    started = time.monotonic()
+
+    def report(stage):
+        if cancel_token is not None:
+            cancel_token.check()
+        if progress_callback:
+            progress_callback(stage)
+
+    # Step 1: Apply neural cartoon preprocessing to simplify image
+    print("🎨 Preprocessing image for better segmentation...")
+
+    report('decode')
+
+    neural_processor = NeuralCartoonProcessor(
+        image_path=image_path,
+        max_size=max_size  # Canvas is capped, so skip full-res decode
+    )
+
+    # Remote stylization when configured, local preprocessing otherwise.
+    # The remote call may use at most a third of the budget.
+    report('stylize')
+    remote_timeout = None
+    stylizer = get_remote_stylizer()
+    if stylizer is not None and time_budget:
+        remote_timeout = min(stylizer.timeout, time_budget / 3)
+    neural_processor.process(use_neural=True, timeout=remote_timeout)
+
+    # Save preprocessed image to temp file
+    temp_stylized_path = os.path.join(output_dir, f"{project_id}_preprocessed.png")
+    try:
+        neural_processor.save(temp_stylized_path)
+
+        # Step 2: Run canvas processor on preprocessed image, stepping down
+        # the ladder while the budget is at risk. Start at the first level
+        # whose slot hasn't already been used up by preprocessing.
+        level = 0
+        if time_budget:
+            while (DEGRADATION_LADDER[level]['until'] is not None and
+                   time.monotonic() - started >= DEGRADATION_LADDER[level]['until'] * time_budget):
+                level += 1
+
+        while True:
+            settings = ladder_settings(level, num_colors, max_size, min_region_size)
+            until = DEGRADATION_LADDER[level]['until']
+            deadline = started + until * time_budget if time_budget and until is not None else None
+
+            try:
+                report('quantize')
+                generator = InteractiveCanvasGenerator(
+                    image_path=temp_stylized_path,  # Use preprocessed image
+                    num_colors=settings['num_colors'],
+                    max_size=settings['max_size'],
+                    min_region_size=settings['min_region_size'],
+                    progress_callback=progress_callback,
+                    kmeans_sample=settings['kmeans_sample'],
+                    kmeans_n_init=settings['kmeans_n_init'],
+                    deadline=deadline,
+                    cancel_token=cancel_token
+                )
+
+                generator.resize_image()
+                generator.quantize_colors()
+                generator.create_regions()
+                break
+            except CanvasDeadlineExceeded:
+                level += 1
+                print(f"⏱️  {project_id}: over time budget, retrying at degradation level {level}")
+
+        canvas_data = generator.generate_canvas_data()
+        canvas_data['metadata']['engine_version'] = CANVAS_ENGINE_VERSION
+        canvas_data['metadata']['stylization'] = 'remote' if neural_processor.used_remote else 'local'
+        canvas_data['metadata']['processing'] = dict(
+            settings,
+            degraded=level > 0,
+            time_budget=time_budget or None,
+            elapsed_ms=int((time.monotonic() - started) * 1000)
+        )
+
+        # Save template preview
+        template_path = os.path.join(output_dir, f"{project_id}_canvas_template.png")
+        generator.save_template_preview(template_path)
+    finally:
+        # Clean up temp preprocessed file
+        if os.path.exists(temp_stylized_path):
+            os.remove(temp_stylized_path)
+
+    return canvas_data, template_path
+
+
+def pack_canvas_data(canvas_data):
+    """
+    Convert canvas data to flat numpy arrays for cheap inter-process transfer
+
+    Region boundaries are concatenated into one (N, 2) int32 array with an
+    offsets array, instead of one small Python list per point.
+    """
+    regions = canvas_data['regions']
+
+    lengths = [len(r['boundary']) for r in regions]
+    offsets = np.zeros(len(regions) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    points = [pt for r in regions for pt in r['boundary']]
+
+    return {
+        'color_num': np.array([r['color_num'] for r in regions], dtype=np.int16),
+        'centroid': np.array([r['centroid'] for r in regions], dtype=np.int32).reshape(-1, 2),
+        'pixel_count': np.array([r['pixel_count'] for r in regions], dtype=np.int32),
+        'boundary_points': np.array(points, dtype=np.int32).reshape(-1, 2),
+        'boundary_offsets': offsets,
+        'palette': np.array([c['rgb'] for c in canvas_data['colors']], dtype=np.uint8).reshape(-1, 3),
+        'dimensions': canvas_data['dimensions'],
+        'metadata': canvas_data['metadata']
+    }
+
+
+def unpack_canvas_data(packed):
+    """Rebuild the JSON canvas data produced by InteractiveCanvasGenerator from pack_canvas_data output"""
+    offsets = packed['boundary_offsets'].tolist()
+    points = packed['boundary_points'].tolist()
+    color_nums = packed['color_num'].tolist()
+    centroids = packed['centroid'].tolist()
+    pixel_counts = packed['pixel_count'].tolist()
+
+    regions = []
+    for i in range(len(color_nums)):
+        regions.append({
+            "id": f"region_{i}",
+            "color_num": color_nums[i],
+            "boundary": points[offsets[i]:offsets[i + 1]],
+            "centroid": centroids[i],
+            "pixel_count": pixel_counts[i],
+            "filled": False
+        })
+
+    colors = []
+    for i, rgb in enumerate(packed['palette'].tolist()):
+        colors.append({
+            "num": i + 1,
+            "rgb": rgb,
+            "hex": "#{:02x}{:02x}{:02x}".format(*rgb)
+        })
+
+    return {
+        "regions": regions,
+        "colors": colors,
+        "dimensions": packed['dimensions'],
+        "metadata": packed['metadata']
+    }
+
+
+# Set in pool worker processes (see canvas_pool._init_worker)
+_progress_queue = None
+
+
+def set_progress_queue(queue):
+    """Route progress from generate_canvas_packed to the parent process"""
+    global _progress_queue
+    _progress_queue = queue
+
+
+def generate_canvas_packed(progress_token, *args, cpu_threads=None, **kwargs):
+    """
+    generate_canvas for process pools - returns (packed_canvas_data, template_path)
+
+    Stage changes are sent to the parent as (progress_token, stage) on the
+    pool's progress queue. cpu_threads is the job's thread budget (see
+    app.cpu_budget), applied to this worker process before it starts.
+    """
+    apply_thread_budget(cpu_threads)
+
+    callback = None
+    if progress_token and _progress_queue is not None:
+        callback = lambda stage: _progress_queue.put((progress_token, stage))
+
+    canvas_data, template_path = generate_canvas(*args, progress_callback=callback, **kwargs)
+    return pack_canvas_data(canvas_data), template_path
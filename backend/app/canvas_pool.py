@@ -0,0 +1,161 @@
+"""
+Process pool for CPU-bound canvas generation
+
+Canvas generation has long pure-Python stretches (per-region loops) that hold
+the GIL. Running it in worker threads slows down every Flask request thread
+in the same process, so by default the job workers hand the computation to a
+separate pool of processes and just wait on the result.
+
+Worker processes import cv2, scikit-learn and scipy once at startup, so jobs
+don't pay the import cost.
+
+Configuration (env):
+    CANVAS_EXECUTOR           'process' (default) or 'thread' (run inline on the job worker)
+    CANVAS_PROCESSES          Pool size (default: JOB_WORKERS)
+    CANVAS_POOL_START_METHOD  multiprocessing start method (default 'spawn')
+
+Each job's thread budget (app.cpu_budget) is computed here from the number of
+jobs running when it is submitted and applied inside the worker process.
+Inline jobs share one budget, set from JOB_WORKERS.
+"""
+
+import os
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.cpu_budget import job_slot, apply_process_budget
+
+
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+# Stage reports from worker processes: (token, stage) -> _progress_callbacks[token](stage)
+_progress_queue = None
+_progress_callbacks = {}
+
+
+def _init_worker(progress_queue):
+    """Preload heavy modules once per worker process"""
+    import cv2  # noqa: F401
+    import sklearn.cluster  # noqa: F401
+    import scipy.ndimage  # noqa: F401
+    import app.canvas_pipeline
+
+    app.canvas_pipeline.set_progress_queue(progress_queue)
+
+
+def _progress_listener(queue):
+    """Forward stage reports from worker processes to the registered callbacks"""
+    while True:
+        token, stage = queue.get()
+        callback = _progress_callbacks.get(token)
+        if callback:
+            try:
+                callback(stage)
+            except Exception as e:
+                print(f"⚠️  Progress callback failed: {e}")
+
+
+def _warmup():
+    return os.getpid()
+
+
+def use_process_pool():
+    """True when canvas jobs should run in the process pool"""
+    return os.getenv('CANVAS_EXECUTOR', 'process').strip().lower() == 'process'
+
+
+def get_canvas_pool():
+    """Get (or lazily start) the shared canvas process pool"""
+    global _pool, _pool_size, _progress_queue
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                num_processes = int(os.getenv('CANVAS_PROCESSES', os.getenv('JOB_WORKERS', 2)))
+                context = multiprocessing.get_context(os.getenv('CANVAS_POOL_START_METHOD', 'spawn'))
+
+                if _progress_queue is None:
+                    _progress_queue = context.SimpleQueue()
+                    threading.Thread(target=_progress_listener, args=(_progress_queue,),
+                                     name='canvas-progress', daemon=True).start()
+
+                pool = ProcessPoolExecutor(
+                    max_workers=max(1, num_processes),
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(_progress_queue,)
+                )
+
+                # Start every worker now so the first jobs don't pay for spawning
+                for _ in range(max(1, num_processes)):
+                    pool.submit(_warmup)
+
+                print(f"Canvas process pool started ({num_processes} processes)")
+                _pool_size = max(1, num_processes)
+                _pool = pool
+
+    return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def run_canvas_pipeline(*args, progress_callback=None, **kwargs):
+    """
+    Run app.canvas_pipeline.generate_canvas in the process pool (or inline)
+
+    Args:
+        progress_callback: Optional callable(stage), called in this process
+
+    Returns:
+        tuple: (canvas_data, template_path)
+    """
+    from app.canvas_pipeline import generate_canvas, generate_canvas_packed, unpack_canvas_data
+
+    # Split the cores between the jobs running instead of every job's
+    # OpenCV/OpenMP/BLAS pools each assuming they have all of them. Limits
+    # are process-wide, so inline jobs share one budget for the most jobs
+    # this process runs at once
+    if not use_process_pool():
+        apply_process_budget(int(os.getenv('JOB_WORKERS', 2)))
+        with job_slot():
+            return generate_canvas(*args, progress_callback=progress_callback, **kwargs)
+
+    pool = get_canvas_pool()
+
+    with job_slot(max_concurrent=_pool_size) as cpu_threads:
+        token = None
+        if progress_callback:
+            token = uuid.uuid4().hex
+            _progress_callbacks[token] = progress_callback
+
+        try:
+            packed, template_path = pool.submit(generate_canvas_packed, token, *args,
+                                                cpu_threads=cpu_threads, **kwargs).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed) - replace the pool for later jobs
+            _reset_pool(pool)
+            raise RuntimeError("Canvas worker process crashed")
+        finally:
+            _progress_callbacks.pop(token, None)
+
+    return unpack_canvas_data(packed), template_path
+
+
+def shutdown_canvas_pool():
+    """Stop worker processes (e.g. on app shutdown)"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
@@ -13,10 +13,21 @@ from sklearn.cluster import KMeans
 from PIL import Image, ImageDraw
 import json
 import sys
+import time
 from pathlib import Path
 from scipy import ndimage
 from typing import Dict, List, Tuple
 
+try:
+    from app.image_loader import load_image
+except ImportError:
+    # Running as a standalone script (python app/<module>.py)
+    from image_loader import load_image
+
+
+class CanvasDeadlineExceeded(Exception):
+    """Canvas generation ran past its deadline (caller retries with cheaper settings)"""
+
 
 class InteractiveCanvasGenerator:
     """
@@ -40,7 +51,9 @@ class InteractiveCanvasGenerator:
     }
     """
     
-    def __init__(self, image_path, num_colors=15, max_size=800, min_region_size=200):
+    def __init__(self, image_path, num_colors=15, max_size=800, min_region_size=200,
+                 progress_callback=None, kmeans_sample=None, kmeans_n_init=10, deadline=None,
+                 cancel_token=None):
         """
         Initialize canvas generator
         
@@ -50,19 +63,28 @@ class InteractiveCanvasGenerator:
             max_size: Maximum dimension for canvas (pixels)
             min_region_size: Minimum pixels per region (smaller regions get merged)
                             Default 200 for better UX (easier to tap on mobile)
+            progress_callback: Optional callable(stage) invoked as each stage starts
+                               ('simplify', 'merge', 'extract')
+            kmeans_sample: Fit K-means on at most this many random pixels (None = all)
+            kmeans_n_init: K-means restarts
+            deadline: time.monotonic() value; the per-color/per-region loops raise
+                      CanvasDeadlineExceeded once it has passed (None = no limit)
+            cancel_token: Optional object whose check() raises to abort (checked
+                          wherever the deadline is)
         """
         self.image_path = image_path
         self.num_colors = num_colors
         self.max_size = max_size
         self.min_region_size = min_region_size
+        self.progress_callback = progress_callback
+        self.kmeans_sample = kmeans_sample
+        self.kmeans_n_init = kmeans_n_init
+        self.deadline = deadline
+        self.cancel_token = cancel_token
         
-        # Load image
-        self.original = cv2.imread(image_path)
-        if self.original is None:
-            raise ValueError(f"Could not load image: {image_path}")
-        
-        # Convert BGR to RGB
-        self.original = cv2.cvtColor(self.original, cv2.COLOR_BGR2RGB)
+        # Load image (RGB) - large JPEGs are decoded at reduced scale,
+        # never below max_size
+        self.original = load_image(image_path, target_size=max_size)
         
         # Processed data
         self.resized = None
@@ -98,9 +120,27 @@ class InteractiveCanvasGenerator:
         height, width = self.resized.shape[:2]
         pixels = self.resized.reshape(-1, 3).astype(np.float32)
         
-        # K-means clustering
-        kmeans = KMeans(n_clusters=self.num_colors, random_state=42, n_init=10)
-        labels = kmeans.fit_predict(pixels)
+        # Optionally fit on a random pixel sample, then label every pixel
+        fit_pixels = pixels
+        if self.kmeans_sample and len(pixels) > self.kmeans_sample:
+            rng = np.random.default_rng(42)
+            fit_pixels = pixels[rng.choice(len(pixels), self.kmeans_sample, replace=False)]
+        
+        # K-means clustering. With a deadline, restarts run one at a time
+        # (instead of n_init) so it is checked between them; without one, a
+        # single call keeps the palettes of earlier versions
+        if self.deadline is None:
+            self._check_deadline()
+            kmeans = KMeans(n_clusters=self.num_colors, random_state=42, n_init=self.kmeans_n_init).fit(fit_pixels)
+        else:
+            kmeans = None
+            for run in range(self.kmeans_n_init):
+                self._check_deadline()
+                candidate = KMeans(n_clusters=self.num_colors, random_state=42 + run, n_init=1).fit(fit_pixels)
+                if kmeans is None or candidate.inertia_ < kmeans.inertia_:
+                    kmeans = candidate
+        
+        labels = kmeans.predict(pixels) if fit_pixels is not pixels else kmeans.labels_
         
         # Store palette and labels
         self.color_palette = kmeans.cluster_centers_.astype(int)
@@ -117,10 +157,14 @@ class InteractiveCanvasGenerator:
         """
         # First, apply morphological operations to merge small regions
         if self.min_region_size > 0:
+            self._report_progress('simplify')
             self.color_labels = self._simplify_labels()
             # SECOND PASS: Eliminate tiny regions by reassigning to dominant neighbor
+            self._report_progress('merge')
             self.color_labels = self._merge_tiny_regions()
 
+        self._report_progress('extract')
+
         regions = []
         region_id = 0
         
@@ -139,6 +183,8 @@ class InteractiveCanvasGenerator:
             
             # Extract each region
             for region_label in range(1, num_features + 1):
+                if region_label % 64 == 0:
+                    self._check_deadline()
                 region_mask = labeled_mask == region_label
                 
                 # Get region size
@@ -183,6 +229,19 @@ class InteractiveCanvasGenerator:
         self.regions_data = regions
         return self.regions_data
     
+    def _report_progress(self, stage):
+        """Notify the progress callback (if any) that a stage is starting"""
+        if self.progress_callback:
+            self.progress_callback(stage)
+        self._check_deadline()
+    
+    def _check_deadline(self):
+        """Raise CanvasDeadlineExceeded if the deadline has passed (or abort if cancelled)"""
+        if self.cancel_token is not None:
+            self.cancel_token.check()
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise CanvasDeadlineExceeded("Canvas generation exceeded its deadline")
+    
     def _simplify_labels(self):
         """
         Apply morphological operations to merge small regions.
@@ -204,6 +263,8 @@ class InteractiveCanvasGenerator:
         simplified_labels = blurred.copy()
 
         for color_num in range(self.num_colors):
+            self._check_deadline()
+            
             # Create binary mask for this color
             mask = (blurred == color_num).astype(np.uint8)
 
@@ -232,6 +293,7 @@ class InteractiveCanvasGenerator:
 
         # For each color, find and merge tiny regions
         for color_num in range(self.num_colors):
+            self._check_deadline()
             color_mask = (self.color_labels == color_num).astype(np.uint8)
 
             # Find connected components
@@ -239,6 +301,8 @@ class InteractiveCanvasGenerator:
 
             # Check each region
             for region_label in range(1, num_features + 1):
+                if region_label % 64 == 0:
+                    self._check_deadline()
                 region_mask = (labeled_mask == region_label)
                 region_size = np.sum(region_mask)
 
@@ -422,13 +486,8 @@ class InteractiveCanvasGenerator:
         
         # Create image directly from quantized color labels
         # This ensures 100% coverage with no gaps
-        colored_array = np.zeros((height, width, 3), dtype=np.uint8)
-        
-        # Fill each pixel with its quantized color
-        for y in range(height):
-            for x in range(width):
-                color_idx = self.color_labels[y, x]
-                colored_array[y, x] = self.color_palette[color_idx]
+        # (palette lookup for every pixel at once - no per-pixel Python loop)
+        colored_array = self.color_palette[self.color_labels].astype(np.uint8)
         
         # Convert to PIL Image
         colored = Image.fromarray(colored_array)
@@ -453,11 +512,7 @@ class InteractiveCanvasGenerator:
         height, width = self.resized.shape[:2]
         
         # Create colored version
-        colored_array = np.zeros((height, width, 3), dtype=np.uint8)
-        for y in range(height):
-            for x in range(width):
-                color_idx = self.color_labels[y, x]
-                colored_array[y, x] = self.color_palette[color_idx]
+        colored_array = self.color_palette[self.color_labels].astype(np.uint8)
         
         # Create side-by-side image
         comparison = np.zeros((height, width * 2, 3), dtype=np.uint8)
@@ -1,18 +1,35 @@
 """
 Coloring API routes for paint-by-numbers functionality
 """
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 from app import app, db
 from app.models import ColoringProject, ColoringSession
 from app.auth import require_auth, get_user_from_token
-from app.storage import upload_image, generate_signed_url
-from app.canvas_processor import InteractiveCanvasGenerator
+from app.storage import upload_image, upload_bytes, upload_async, download_image, delete_image, generate_signed_urls
+from app.canvas_pool import run_canvas_pipeline
+from app.canvas_pipeline import estimate_cost
+from app.image_loader import probe_image
+from app.jobs import enqueue_job, notify_workers, register_job_handler, request_cancel
+from app.cancellation import JobCancelled, open_token
+from app.scratch import get_scratch, ScratchSpaceFull
+from app.admission import check_admission, estimate_wait
+from app.pagination import page_args, paginate, InvalidPagination
+from app import counters
+from app.http_cache import make_etag, not_modified, with_validators
+from app.canvas_cache import (canvas_params, result_key, template_blob_path, project_template_path,
+                              is_reusable, find_ready_result, in_flight_job_id, claim_result,
+                              store_result, fail_result, has_waiting_projects)
+from app.progress import (broker, record_stage, publish_status, get_project_snapshot,
+                          snapshot_version, acquire_waiter_slot, release_waiter_slot,
+                          PROGRESS_POLL_INTERVAL)
 from werkzeug.utils import secure_filename
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
 import os
 import uuid
 import json
-import threading
+import time
+import base64
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
@@ -22,86 +39,213 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def process_image_async(project_id, image_path, num_colors, output_dir):
+def process_image_async(project_id, image_path, num_colors, output_dir, job_id=None, cache_key=None,
+                        cancel_token=None):
     """Process image asynchronously in background"""
     try:
         # Load the project
         project = ColoringProject.query.get(project_id)
-        if not project:
+        if not project and not (cache_key and has_waiting_projects(cache_key)):
             return
         
-        # Step 1: Apply neural cartoon preprocessing to simplify image
-        from app.neural_cartoon_processor import NeuralCartoonProcessor
-        import tempfile
-
-        print(f"🎨 Preprocessing image with Gemini AI for better segmentation...")
+        user_id = project.user_id if project else None
+        # Don't hold a transaction open while the pipeline runs
+        db.session.commit()
         
-        # Use Gemini 2.5 Flash (free tier)
-        neural_processor = NeuralCartoonProcessor(
-            image_path=image_path,
-            model_name='gemini-2.5-flash'
+        params = canvas_params(num_colors)
+        
+        # Steps 1-2: preprocessing + canvas generation. CPU-bound, so by
+        # default it runs in the canvas process pool, off this process's GIL
+        canvas_data, template_path = run_canvas_pipeline(
+            project_id,
+            image_path,
+            params['num_colors'],
+            output_dir,
+            max_size=params['max_size'],
+            min_region_size=params['min_region_size'],
+            time_budget=float(os.getenv('CANVAS_TIME_BUDGET', 60)),
+            progress_callback=lambda stage: record_stage(job_id, project_id, stage),
+            cancel_token=cancel_token
         )
         
-        # Process with neural network (with fallback to simple filter if fails)
-        neural_processor.process(use_neural=True)
-
-        # Save preprocessed image to temp file
-        temp_stylized_path = os.path.join(output_dir, f"{project_id}_preprocessed.png")
-        neural_processor.save(temp_stylized_path)
-
-        # Step 2: Run canvas processor on preprocessed image
-        generator = InteractiveCanvasGenerator(
-            image_path=temp_stylized_path,  # Use preprocessed image
-            num_colors=num_colors,
-            max_size=int(os.getenv('MAX_CANVAS_SIZE', 800)),
-            min_region_size=int(os.getenv('MIN_REGION_SIZE', 200))  # Increased default to 200
-        )
-        
-        # Process the image
-        generator.resize_image()
-        generator.quantize_colors()
-        generator.create_regions()
-        canvas_data = generator.generate_canvas_data()
-        
-        # Save outputs
-        base_name = f"{project_id}_canvas"
-        json_path = os.path.join(output_dir, f"{base_name}.json")
-        template_path = os.path.join(output_dir, f"{base_name}_template.png")
-        
-        # Save JSON
-        with open(json_path, 'w') as f:
-            json.dump(canvas_data, f)
+        # Last chance to stop before anything is written to storage
+        if cancel_token is not None:
+            cancel_token.check()
+        record_stage(job_id, project_id, 'upload')
         
-        # Save template preview
-        generator.save_template_preview(template_path)
-        
-        # Upload to cloud storage
-        bucket_name = os.getenv('BUCKET_NAME')
-        template_cloud_path = f"coloring/{project.user_id}/{base_name}_template.png"
+        # Upload to cloud storage - results kept for reuse live at a shared
+        # path, anything else (degraded, stylization fallback) per project
+        shared = bool(cache_key) and is_reusable(canvas_data)
+        if shared:
+            template_cloud_path = template_blob_path(cache_key)
+        else:
+            template_cloud_path = project_template_path(user_id, project_id)
         
         with open(template_path, 'rb') as f:
             upload_image(f, template_cloud_path)
-        
-        # Clean up temp preprocessed file
-        if os.path.exists(temp_stylized_path):
-            os.remove(temp_stylized_path)
 
         # Update project with canvas data
-        project.template_data = canvas_data
-        project.template_image_url = template_cloud_path
-        project.status = 'completed'
-        project.updated_at = datetime.utcnow()
+        completed = [project_id]
+        project = ColoringProject.query.get(project_id)
+        owned = project is not None and project.status == 'processing'
+        if owned:
+            project.template_data = canvas_data
+            project.template_image_url = template_cloud_path
+            project.status = 'completed'
+            project.updated_at = datetime.utcnow()
+        
+        # ...and every project that uploaded the same image meanwhile
+        if cache_key:
+            completed += store_result(cache_key, canvas_data, template_cloud_path)
+        
+        if not owned and not shared:
+            # Deleted/cancelled while uploading - waiting projects have their
+            # copies now, don't leave an orphan template
+            delete_image(template_cloud_path)
         
         db.session.commit()
+        for pid in set(completed):
+            publish_status(pid)
+    
+    except JobCancelled:
+        db.session.rollback()
+        print(f"🛑 Processing of {project_id} cancelled, cleaning up")
+        
+        # Uploads of the same image that joined while the cancel was in flight
+        failed = [project_id]
+        if cache_key:
+            failed += fail_result(cache_key, 'Processing was cancelled')
+        db.session.commit()
+        for pid in set(failed):
+            publish_status(pid)
+        raise
         
     except Exception as e:
         # Update project with error
+        db.session.rollback()
+        failed = [project_id]
         project = ColoringProject.query.get(project_id)
-        if project:
+        if project and project.status == 'processing':
             project.status = 'failed'
             project.error_message = str(e)
             project.updated_at = datetime.utcnow()
+        if cache_key:
+            failed += fail_result(cache_key, str(e))
+        db.session.commit()
+        for pid in set(failed):
+            publish_status(pid)
+
+
+def fetch_original(original_path, image_path, cancel_token=None):
+    """
+    Download a project's original, waiting for an upload that is still in flight
+    
+    The create request returns before the original is in storage, so a job
+    claimed on another instance can get here first.
+    """
+    deadline = time.monotonic() + float(os.getenv('ORIGINAL_UPLOAD_WAIT', 60))
+    while True:
+        try:
+            return download_image(original_path, image_path)
+        except Exception:
+            if time.monotonic() >= deadline:
+                raise
+            if cancel_token is not None:
+                cancel_token.check()
+            time.sleep(1)
+
+
+def check_original_upload(project_id, future, retry=None):
+    """
+    Handle a failed upload of a project's original (it finishes after the response)
+    
+    A project still processing is failed. A completed one (cache hit) was
+    already returned as ready with a valid template, so its status stays; the
+    upload is retried once and a lasting failure is only logged.
+    
+    Args:
+        project_id: Project the original belongs to
+        future: The upload_async() future
+        retry: Runs the upload again (for completed projects)
+    """
+    error = future.exception()
+    if error is None:
+        return
+    
+    print(f"❌ Original for {project_id} was not stored: {error}")
+    with app.app_context():
+        project = ColoringProject.query.get(project_id)
+        if not project or project.status in ('failed', 'cancelled'):
+            return
+        
+        if project.status == 'processing':
+            # Stop its processing - unless other uploads of the same image wait on it
+            if not (project.result_key and has_waiting_projects(project.result_key, exclude=project_id)):
+                request_cancel(project_id)
+            
+            project.status = 'failed'
+            project.error_message = f'Failed to upload image: {error}'
+            project.updated_at = datetime.utcnow()
             db.session.commit()
+            publish_status(project_id)
+            return
+    
+    if retry is not None:
+        try:
+            retry()
+            print(f"✓ Original for {project_id} stored on retry")
+            return
+        except Exception as e:
+            error = e
+    print(f"⚠️  Completed project {project_id} has no original in storage: {error}")
+
+
+def run_canvas_job(job):
+    """Job handler: generate the canvas for a coloring project"""
+    payload = job.payload
+    cancel_token = open_token(job.id)
+    scratch = get_scratch()
+    
+    # Everything the job writes goes to its scratch dir, removed when it's done
+    job_dir = scratch.acquire(job.project_id)
+    try:
+        image_path = os.path.join(job_dir, os.path.basename(payload['original_path']))
+        
+        # Requeued on another instance (or the upload's copy was evicted) - fetch the original again
+        if not os.path.exists(image_path):
+            print(f"Original for {job.project_id} missing locally, downloading from storage...")
+            fetch_original(payload['original_path'], image_path, cancel_token)
+        
+        process_image_async(job.project_id, image_path, payload['num_colors'], job_dir,
+                            job_id=job.id, cache_key=payload.get('cache_key'),
+                            cancel_token=cancel_token)
+    finally:
+        scratch.release(job.project_id)
+
+
+def fail_canvas_project(job, error):
+    """Mark the project (and any projects waiting on the same result) failed when its job can't be completed"""
+    error = error or 'Processing failed'
+    failed = [job.project_id]
+    project = ColoringProject.query.get(job.project_id)
+    if project and project.status == 'processing':
+        project.status = 'failed'
+        project.error_message = error
+        project.updated_at = datetime.utcnow()
+    if job.payload.get('cache_key'):
+        failed += fail_result(job.payload['cache_key'], error)
+    db.session.commit()
+    for pid in set(failed):
+        publish_status(pid)
+    get_scratch().discard(job.project_id)
+
+
+def discard_canvas_job(job):
+    """Remove the local copy of the original when a queued job is cancelled"""
+    get_scratch().discard(job.project_id)
+
+
+register_job_handler('canvas', run_canvas_job, on_give_up=fail_canvas_project, on_cancel=discard_canvas_job)
 
 
 @app.route('/api/projects/create', methods=['POST'])
@@ -134,64 +278,202 @@ def create_coloring_project():
         if num_colors < 8 or num_colors > 50:
             return jsonify({'error': 'num_colors must be between 8 and 50'}), 400
 
+        # Read the body once - storage upload, scratch copy and cache key all use this buffer
+        image_bytes = file.read()
+        
+        # Same decoded image + settings as an earlier upload -> reuse its result
+        params = canvas_params(num_colors)
+        cache_key = result_key(image_bytes, params)
+        
+        cached = find_ready_result(cache_key) if cache_key else None
+        leader_job_id = in_flight_job_id(cache_key) if cache_key and not cached else None
+        
+        # Turn the upload away (before storing anything) if its job would only
+        # queue behind a backlog; joining an in-flight job adds no work
+        admission = None
+        if not cached:
+            admission = estimate_wait() if leader_job_id else check_admission(user_id)
+            if not admission.get('admitted', True):
+                return jsonify({
+                    'error': admission['error'],
+                    'retry_after': admission['retry_after'],
+                    'estimated_wait_seconds': admission['wait_seconds']
+                }), admission['status_code'], {'Retry-After': str(admission['retry_after'])}
+
         # Generate unique filename
         file_ext = secure_filename(file.filename).rsplit('.', 1)[1].lower()
         project_id = f"proj_{uuid.uuid4().hex[:12]}"
         file_name = f"{project_id}.{file_ext}"
         
-        # Upload original image to cloud storage
+        # Upload original image to cloud storage in the background - processing
+        # works from the local copy, so neither waits for the GCS round-trip
         file_path = f"coloring/{user_id}/originals/{file_name}"
-        
+        content_type = file.content_type or 'image/jpeg'
+        original_upload = upload_async(image_bytes, file_path, content_type)
+        retry_original = lambda: upload_bytes(image_bytes, file_path, content_type)
+        
+        # Local copy for the job (only needed if this upload runs the job)
+        scratch = get_scratch()
+        if not cached and not leader_job_id:
+            try:
+                job_dir = scratch.acquire(project_id, reserve_bytes=len(image_bytes))
+                try:
+                    with open(os.path.join(job_dir, file_name), 'wb') as f:
+                        f.write(image_bytes)
+                finally:
+                    scratch.release(project_id, delete=False)
+            except ScratchSpaceFull as e:
+                print(f"⚠️  {e} - job for {project_id} will download the original")
+        
+        if cached:
+            project = ColoringProject(
+                id=project_id,
+                user_id=user_id,
+                title=title,
+                original_image_url=file_path,
+                template_image_url=cached.template_image_url,
+                template_data=cached.template_data,
+                num_colors=num_colors,
+                difficulty=difficulty,
+                status='completed',
+                result_key=cache_key
+            )
+            db.session.add(project)
+            counters.project_added(project)
+            db.session.commit()
+            original_upload.add_done_callback(lambda f: check_original_upload(project_id, f, retry_original))
+            
+            return jsonify({
+                'success': True,
+                'project_id': project_id,
+                'status': 'completed',
+                'cached': True,
+                'message': 'This image was processed before - the canvas is ready.'
+            }), 201
+        
+        # Scheduling hint: small, few-color canvases run ahead of big posters
         try:
-            # Upload to cloud (file is still a FileStorage object here)
-            upload_image(file, file_path)
+            width, height, _ = probe_image(image_bytes)
+            job_cost = estimate_cost(width, height, num_colors, params['max_size'])
+        except Exception:
+            job_cost = estimate_cost(params['max_size'], params['max_size'], num_colors, params['max_size'])
+        
+        for attempt in range(2):
+            # Create project record
+            project = ColoringProject(
+                id=project_id,
+                user_id=user_id,
+                title=title,
+                original_image_url=file_path,
+                num_colors=num_colors,
+                difficulty=difficulty,
+                status='processing',
+                result_key=cache_key
+            )
             
-            # Save temporarily for processing
-            temp_dir = os.path.join(os.getcwd(), 'temp')
-            os.makedirs(temp_dir, exist_ok=True)
-            temp_path = os.path.join(temp_dir, file_name)
+            db.session.add(project)
+            counters.project_added(project)
             
-            # Reset file pointer and save
-            file.seek(0)
-            file.save(temp_path)
+            # Queue background processing in the same transaction as the project,
+            # so a project never exists without its job. If the same image is
+            # already being processed, the project just waits for that job.
+            if not leader_job_id:
+                job = enqueue_job(
+                    'canvas',
+                    payload={
+                        'original_path': file_path,
+                        'num_colors': num_colors,
+                        'cache_key': cache_key
+                    },
+                    project_id=project_id,
+                    user_id=user_id,
+                    commit=False,
+                    cost=job_cost
+                )
+                if cache_key:
+                    db.session.flush()
+                    claim_result(cache_key, job.id)
             
-        except Exception as e:
-            return jsonify({'error': f'Failed to upload image: {str(e)}'}), 500
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                # A concurrent upload of the same image claimed the result first
+                db.session.rollback()
+                leader_job_id = in_flight_job_id(cache_key) if cache_key else None
+                if attempt or not leader_job_id:
+                    raise
+        
+        if leader_job_id:
+            print(f"♻️  {project_id} joins in-flight job {leader_job_id} (identical upload)")
+            scratch.discard(project_id)
+        else:
+            notify_workers()
+        original_upload.add_done_callback(lambda f: check_original_upload(project_id, f, retry_original))
+        
+        eta = max(1, round(admission['completion_seconds']))
+        return jsonify({
+            'success': True,
+            'project_id': project_id,
+            'status': 'processing',
+            'estimated_completion_seconds': eta,
+            'estimated_completion_at': (datetime.utcnow() + timedelta(seconds=eta)).isoformat() + 'Z',
+            'message': f'Image is being processed. Check back in ~{eta} seconds.'
+        }), 201
         
-        # Create project record
-        project = ColoringProject(
-            id=project_id,
-            user_id=user_id,
-            title=title,
-            original_image_url=file_path,
-            num_colors=num_colors,
-            difficulty=difficulty,
-            status='processing'
-        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/styles/preview', methods=['POST'])
+@require_auth
+def preview_styles():
+    """Render small previews of every style for the style picker"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file provided'}), 400
         
-        db.session.add(project)
-        db.session.commit()
+        file = request.files['file']
+        
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS).upper()}'}), 400
+        
+        from app.style_preview import generate_style_previews, PREVIEW_STYLES
         
-        # Start background processing
-        output_dir = os.path.join(os.getcwd(), 'output')
-        os.makedirs(output_dir, exist_ok=True)
+        # Optional comma-separated subset of styles
+        styles = request.form.get('styles')
+        styles = [s.strip() for s in styles.split(',') if s.strip()] if styles else None
+        if styles and any(s not in PREVIEW_STYLES for s in styles):
+            return jsonify({'error': f'Unknown style. Available: {", ".join(PREVIEW_STYLES)}'}), 400
         
-        thread = threading.Thread(
-            target=process_image_async,
-            args=(project_id, temp_path, num_colors, output_dir)
+        # Decode straight from the request body - nothing touches disk
+        bundle = generate_style_previews(
+            image_bytes=file.read(),
+            styles=styles,
+            timeout=float(os.getenv('STYLE_PREVIEW_TIMEOUT', 5))
         )
-        thread.daemon = True
-        thread.start()
         
         return jsonify({
-            'success': True,
-            'project_id': project_id,
-            'status': 'processing',
-            'message': 'Image is being processed. Check back in ~30 seconds.'
-        }), 201
+            'width': bundle['width'],
+            'height': bundle['height'],
+            'previews': {
+                style: {
+                    'image': f"data:{p['mime_type']};base64,{base64.b64encode(p['data']).decode('ascii')}",
+                    'elapsed_ms': p['elapsed_ms']
+                }
+                for style, p in bundle['styles'].items()
+            },
+            'errors': bundle['errors'],
+            'elapsed_ms': bundle['elapsed_ms']
+        }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
@@ -203,17 +485,164 @@ def get_coloring_project(project_id):
         user = get_user_from_token()
         user_id = user['uid']
         
+        # Validate against updated_at before loading template_data
+        row = db.session.query(ColoringProject.updated_at)\
+                        .filter_by(id=project_id, user_id=user_id)\
+                        .first()
+        if row is None:
+            return jsonify({'error': 'Project not found'}), 404
+        updated_at = row.updated_at
+        
+        etag = make_etag('project', project_id, updated_at)
+        cached = not_modified(etag, updated_at)
+        if cached:
+            return cached
+        
         project = ColoringProject.query.filter_by(id=project_id, user_id=user_id).first()
         
         if not project:
             return jsonify({'error': 'Project not found'}), 404
         
-        return jsonify(project.to_dict()), 200
+        return with_validators(jsonify(project.to_dict()), etag, updated_at), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/projects/<project_id>/events', methods=['GET'])
+@require_auth
+def stream_project_events(project_id):
+    """Server-sent events: push stage transitions and the final status of a project"""
+    user = get_user_from_token()
+    user_id = user['uid']
+    
+    if get_project_snapshot(project_id, user_id) is None:
+        return jsonify({'error': 'Project not found'}), 404
+    
+    # Each stream holds a server thread - past the cap, clients fall back to polling
+    if not acquire_waiter_slot():
+        return jsonify({
+            'error': 'Too many open progress streams, poll /status instead',
+            'retry_after': 5
+        }), 503, {'Retry-After': '5'}
+    
+    max_duration = float(os.getenv('SSE_MAX_DURATION', 60))
+    keepalive = 15
+    
+    def events():
+        # Client reconnects after the stream ends (still processing) or drops
+        yield "retry: 3000\n\n"
+        
+        started = time.monotonic()
+        last_sent = started
+        last_version = None
+        
+        while True:
+            version = broker.version(project_id)
+            snapshot = get_project_snapshot(project_id, user_id)
+            current = snapshot_version(snapshot)
+            
+            if current != last_version:
+                data = snapshot or {'project_id': project_id, 'status': 'deleted'}
+                yield f"event: status\nid: {current}\ndata: {json.dumps(data)}\n\n"
+                last_version = current
+                last_sent = time.monotonic()
+            
+            if snapshot is None or snapshot['status'] != 'processing':
+                return
+            if time.monotonic() - started > max_duration:
+                return
+            
+            # Wake on a local publish, or re-check the DB for other processes
+            if not broker.wait(project_id, version, PROGRESS_POLL_INTERVAL):
+                if time.monotonic() - last_sent > keepalive:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+    
+    response = Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let nginx buffer the stream
+    })
+    # Runs however the stream ends, even if it never started
+    response.call_on_close(release_waiter_slot)
+    return response
+
+
+@app.route('/api/projects/<project_id>/status', methods=['GET'])
+@require_auth
+def poll_project_status(project_id):
+    """Long-poll fallback: returns as soon as the status differs from `since` (or after `wait` seconds)"""
+    try:
+        user = get_user_from_token()
+        user_id = user['uid']
+        
+        since = request.args.get('since')
+        wait = min(max(float(request.args.get('wait', 25)), 0), 30)
+        
+        # Waiting holds a server thread - when all slots are taken, answer right away
+        held = wait > 0 and acquire_waiter_slot()
+        deadline = time.monotonic() + (wait if held else 0)
+        
+        try:
+            while True:
+                version = broker.version(project_id)
+                snapshot = get_project_snapshot(project_id, user_id)
+                
+                if snapshot is None:
+                    return jsonify({'error': 'Project not found'}), 404
+                
+                current = snapshot_version(snapshot)
+                remaining = deadline - time.monotonic()
+                
+                if current != since or snapshot['status'] != 'processing' or remaining <= 0:
+                    return jsonify(dict(snapshot, version=current)), 200
+                
+                broker.wait(project_id, version, min(remaining, PROGRESS_POLL_INTERVAL))
+        finally:
+            if held:
+                release_waiter_slot()
+        
+    except ValueError:
+        return jsonify({'error': 'wait must be a number'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/projects/<project_id>/cancel', methods=['POST'])
+@require_auth
+def cancel_coloring_project(project_id):
+    """Stop processing a project (it stays, with status 'cancelled')"""
+    try:
+        user = get_user_from_token()
+        user_id = user['uid']
+        
+        project = ColoringProject.query.filter_by(id=project_id, user_id=user_id).first()
+        if not project:
+            return jsonify({'error': 'Project not found'}), 404
+        
+        if project.status != 'processing':
+            return jsonify({'error': f'Project is not processing (status: {project.status})'}), 400
+        
+        # Other uploads of the same image may be waiting on this job
+        if not (project.result_key and has_waiting_projects(project.result_key, exclude=project_id)):
+            request_cancel(project_id)
+        
+        project.status = 'cancelled'
+        project.updated_at = datetime.utcnow()
+        db.session.commit()
+        publish_status(project_id)
+        
+        return jsonify({
+            'success': True,
+            'project_id': project_id,
+            'status': 'cancelled'
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/projects', methods=['GET'])
 @require_auth
 def get_user_projects():
@@ -222,26 +651,32 @@ def get_user_projects():
         user = get_user_from_token()
         user_id = user['uid']
         
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
+        # Any change to the user's projects moves their latest updated_at or
+        # the project counter (adds/deletes)
+        latest = db.session.query(db.func.max(ColoringProject.updated_at)).filter_by(user_id=user_id).scalar()
+        count, count_changed_at = counters.read(counters.project_key(user_id))
+        last_modified = max((t for t in (latest, count_changed_at) if t), default=None)
         
-        query = ColoringProject.query.filter_by(user_id=user_id).order_by(
-            ColoringProject.created_at.desc()
-        )
+        etag = make_etag('projects', user_id, latest, count, count_changed_at, sorted(request.args.items()))
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
         
-        total = query.count()
-        projects = query.offset((page - 1) * limit).limit(limit).all()
+        query = ColoringProject.query.filter_by(user_id=user_id)
+        projects, pagination = paginate(query, ColoringProject.created_at, ColoringProject.id,
+                                        count=lambda: counters.get(counters.project_key(user_id)),
+                                        **page_args())
         
-        return jsonify({
-            'projects': [p.to_dict() for p in projects],
-            'pagination': {
-                'page': page,
-                'limit': limit,
-                'total': total,
-                'pages': (total + limit - 1) // limit
-            }
-        }), 200
+        urls = generate_signed_urls(path for p in projects for path in p.signed_paths())
+        
+        response = jsonify({
+            'projects': [p.to_dict(urls) for p in projects],
+            'pagination': pagination
+        })
+        return with_validators(response, etag, last_modified), 200
         
+    except InvalidPagination as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -333,6 +768,8 @@ def complete_coloring_project():
             return jsonify({'error': 'Session not found'}), 404
         
         # Mark as completed
+        if not session.is_completed:
+            counters.coloring_completed(session)
         session.is_completed = True
         session.completed_at = datetime.utcnow()
         session.updated_at = datetime.utcnow()
@@ -358,27 +795,23 @@ def get_completed_colorings():
         user = get_user_from_token()
         user_id = user['uid']
         
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        
         query = ColoringSession.query.filter_by(
             user_id=user_id,
             is_completed=True
-        ).order_by(ColoringSession.completed_at.desc())
+        ).filter(ColoringSession.completed_at.isnot(None))
+        sessions, pagination = paginate(query, ColoringSession.completed_at, ColoringSession.id,
+                                        count=lambda: counters.get(counters.completed_key(user_id)),
+                                        **page_args())
         
-        total = query.count()
-        sessions = query.offset((page - 1) * limit).limit(limit).all()
+        urls = generate_signed_urls(path for s in sessions for path in s.signed_paths())
         
         return jsonify({
-            'sessions': [s.to_dict() for s in sessions],
-            'pagination': {
-                'page': page,
-                'limit': limit,
-                'total': total,
-                'pages': (total + limit - 1) // limit
-            }
+            'sessions': [s.to_dict(urls) for s in sessions],
+            'pagination': pagination
         }), 200
         
+    except InvalidPagination as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -395,9 +828,16 @@ def delete_coloring_project(project_id):
         if not project:
             return jsonify({'error': 'Project not found'}), 404
         
+        # Stop its processing - unless other uploads of the same image wait on it
+        if project.status == 'processing':
+            if not (project.result_key and has_waiting_projects(project.result_key, exclude=project_id)):
+                request_cancel(project_id)
+        
         # Delete project (sessions will cascade)
+        counters.project_removed(project)
         db.session.delete(project)
         db.session.commit()
+        publish_status(project_id)
         
         return jsonify({'success': True, 'message': 'Project deleted'}), 200
         
@@ -0,0 +1,225 @@
+"""
+Materialized counters
+
+Listing totals and admin stats used to COUNT(*) images, projects and
+colorings on every request - scans that grow with the tables. Counts now live
+in the `counters` table, one row per key:
+
+    images:<status>                      all images in a status
+    images:<status>:user:<uid>           one user's images in a status
+    projects / projects:user:<uid>       coloring projects
+    completed_colorings[:user:<uid>]     completed coloring sessions
+    gallery:generation                   bumped whenever the public gallery changes
+
+Code that inserts, deletes or changes the status of a counted row calls the
+matching hook below in the same transaction, so the counts commit (or roll
+back) with it. Each hook is a single atomic upsert, safe under concurrency.
+reconcile() recounts everything from the source tables and adds the drift
+(e.g. rows changed outside the app) to the counters the same way; it runs
+periodically as the 'reconcile_counters' job (COUNTER_RECONCILE_INTERVAL).
+"""
+
+import os
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Counter, Image, ColoringProject, ColoringSession
+from app import metrics
+from app.jobs import register_job_handler, register_periodic_job
+
+
+IMAGE_STATUSES = ('pending', 'approved', 'rejected')
+
+GALLERY_GENERATION = 'gallery:generation'
+
+
+def image_key(status, user_id=None):
+    return f"images:{status}:user:{user_id}" if user_id else f"images:{status}"
+
+
+def project_key(user_id=None):
+    return f"projects:user:{user_id}" if user_id else 'projects'
+
+
+def completed_key(user_id=None):
+    return f"completed_colorings:user:{user_id}" if user_id else 'completed_colorings'
+
+
+def _upsert():
+    """INSERT ... ON CONFLICT for the current database"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def bump(deltas):
+    """
+    Add to counters in the current transaction (caller commits)
+
+    Args:
+        deltas: {key: delta}
+    """
+    table = Counter.__table__
+    insert = _upsert()
+    # Fixed key order - concurrent transactions lock rows in the same order
+    for key, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        now = datetime.utcnow()
+        statement = insert(table).values(key=key, value=delta, updated_at=now)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={'value': table.c.value + delta, 'updated_at': now}
+        )
+        db.session.execute(statement)
+
+
+def image_added(image):
+    bump({image_key(image.status): 1, image_key(image.status, image.user_id): 1})
+
+
+def image_removed(image):
+    bump({
+        image_key(image.status): -1,
+        image_key(image.status, image.user_id): -1,
+        GALLERY_GENERATION: 1 if image.status == 'approved' else 0
+    })
+
+
+def image_status_changed(image, old_status):
+    if old_status == image.status:
+        return
+    bump({
+        image_key(old_status): -1,
+        image_key(old_status, image.user_id): -1,
+        image_key(image.status): 1,
+        image_key(image.status, image.user_id): 1,
+        GALLERY_GENERATION: 1 if 'approved' in (old_status, image.status) else 0
+    })
+
+
+def gallery_changed():
+    """Approved images changed in a way the counts don't show (e.g. new file paths)"""
+    bump({GALLERY_GENERATION: 1})
+
+
+def project_added(project):
+    bump({project_key(): 1, project_key(project.user_id): 1})
+
+
+def project_removed(project):
+    """Project deleted - its sessions go with it"""
+    completed = sum(1 for s in project.sessions if s.is_completed)
+    bump({
+        project_key(): -1,
+        project_key(project.user_id): -1,
+        completed_key(): -completed,
+        completed_key(project.user_id): -completed
+    })
+
+
+def coloring_completed(session):
+    bump({completed_key(): 1, completed_key(session.user_id): 1})
+
+
+def get(*keys):
+    """
+    Current value of counters (missing keys are 0)
+
+    Returns:
+        int: Sum of the keys' values
+    """
+    if not keys:
+        return 0
+    total = db.session.query(db.func.sum(Counter.value)).filter(Counter.key.in_(keys)).scalar()
+    return max(0, int(total or 0))
+
+
+def read(key):
+    """
+    One counter with the time it last changed
+
+    Returns:
+        tuple: (value, updated_at) - (0, None) if it doesn't exist yet
+    """
+    row = db.session.query(Counter.value, Counter.updated_at).filter_by(key=key).first()
+    return (row.value, row.updated_at) if row else (0, None)
+
+
+def get_many(keys):
+    """Values of several counters: {key: value} (missing keys are 0)"""
+    values = dict(db.session.query(Counter.key, Counter.value).filter(Counter.key.in_(list(keys))).all())
+    return {key: max(0, int(values.get(key, 0))) for key in keys}
+
+
+def _actual_counts(session):
+    """Every counter's true value, counted from the source tables"""
+    counts = {}
+
+    for status, user_id, n in session.query(Image.status, Image.user_id, db.func.count(Image.id))\
+                                        .group_by(Image.status, Image.user_id).all():
+        counts[image_key(status)] = counts.get(image_key(status), 0) + n
+        counts[image_key(status, user_id)] = n
+
+    for user_id, n in session.query(ColoringProject.user_id, db.func.count(ColoringProject.id))\
+                                .group_by(ColoringProject.user_id).all():
+        counts[project_key()] = counts.get(project_key(), 0) + n
+        counts[project_key(user_id)] = n
+
+    for user_id, n in session.query(ColoringSession.user_id, db.func.count(ColoringSession.id))\
+                                .filter(ColoringSession.is_completed.is_(True))\
+                                .group_by(ColoringSession.user_id).all():
+        counts[completed_key()] = counts.get(completed_key(), 0) + n
+        counts[completed_key(user_id)] = n
+
+    return counts
+
+
+def reconcile():
+    """
+    Recount everything and correct counters that drifted
+
+    The recount and the stored values are read from one snapshot (a
+    REPEATABLE READ transaction on Postgres, a read transaction on SQLite),
+    where a row change and its counter bump are either both visible or both
+    not. The difference is then added to each counter like
+    any other bump, so bumps committed in the meantime are kept.
+
+    Returns:
+        dict: {key: (stored, actual)} for every corrected counter
+    """
+    options = {}
+    if db.engine.dialect.name == 'postgresql':
+        options['isolation_level'] = 'REPEATABLE READ'
+    with db.engine.connect().execution_options(**options) as connection, Session(bind=connection) as snapshot:
+        if db.engine.dialect.name == 'sqlite':
+            connection.exec_driver_sql('BEGIN')  # pysqlite doesn't start one for SELECTs
+        actual = _actual_counts(snapshot)
+        stored = dict(snapshot.query(Counter.key, Counter.value).all())
+    stored.pop(GALLERY_GENERATION, None)  # Not a count
+
+    drift = {}
+    for key in set(actual) | set(stored):
+        if actual.get(key, 0) != stored.get(key, 0):
+            drift[key] = (stored.get(key, 0), actual.get(key, 0))
+
+    bump({key: new - old for key, (old, new) in drift.items()})
+    db.session.commit()
+
+    if drift:
+        metrics.inc('counter_drift_total', len(drift))
+        print(f"🔢 Reconciled {len(drift)} counters: {dict(list(drift.items())[:10])}")
+
+    return drift
+
+
+def run_reconcile_job(job):
+    reconcile()
+
+
+register_job_handler('reconcile_counters', run_reconcile_job)
+register_periodic_job('reconcile_counters', float(os.getenv('COUNTER_RECONCILE_INTERVAL', 3600)))
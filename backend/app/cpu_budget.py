@@ -0,0 +1,158 @@
+"""
+CPU thread budget for canvas jobs
+
+OpenCV, OpenMP (scikit-learn's KMeans) and BLAS each size their thread pools
+to the full core count. With several jobs running at once that means
+jobs x libraries x cores threads fighting over the same cores, which is slower
+than running the jobs one after another. Each job instead gets
+cores / active jobs threads for all three.
+
+Limits are process-wide. In the process pool each worker applies its job's
+budget when the job starts, so a job's budget is fixed when it is submitted -
+it is not rebalanced as other jobs start or finish. Inline ('thread' executor)
+jobs share the web process, so its budget is set once, from the configured
+number of job workers, by the first job.
+
+Configuration (env):
+    CANVAS_THREAD_BUDGET   'auto' (default), a fixed thread count per job, or 0 (don't limit)
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+
+_active_jobs = 0
+_active_lock = threading.Lock()
+
+# Kept alive so the threadpoolctl limits stay in effect
+_limiter = None
+
+# Budget applied by apply_process_budget (None = not yet)
+_process_budget = None
+
+# (raw CANVAS_THREAD_BUDGET, parsed value) - parsed again only if the env changes
+_setting = (None, 'auto')
+
+
+def cpu_count():
+    """Cores this process may run on (respects CPU affinity / container cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _budget_setting():
+    """CANVAS_THREAD_BUDGET as 'auto' or an int - invalid values fall back to 'auto'"""
+    global _setting
+
+    raw = os.getenv('CANVAS_THREAD_BUDGET', 'auto').strip().lower()
+    if raw != _setting[0]:
+        value = 'auto'
+        if raw != 'auto':
+            try:
+                value = int(raw)
+            except ValueError:
+                print(f"⚠️  Invalid CANVAS_THREAD_BUDGET={raw!r}, using auto")
+        _setting = (raw, value)
+
+    return _setting[1]
+
+
+def threads_per_job(concurrent_jobs):
+    """
+    Threads one job may use
+
+    Returns:
+        int: Thread count, or None when budgeting is disabled
+    """
+    setting = _budget_setting()
+    if setting == 'auto':
+        return max(1, cpu_count() // max(1, concurrent_jobs))
+    if setting <= 0:
+        return None
+    return setting
+
+
+def apply_thread_budget(threads):
+    """
+    Limit OpenCV, OpenMP and BLAS thread pools in this process to threads
+
+    Replaces the limits of an earlier call; None or 0 restores the library
+    defaults.
+    """
+    global _limiter
+
+    if not threads and _limiter is None:
+        return
+
+    import cv2
+    from threadpoolctl import threadpool_limits
+
+    if _limiter is not None:
+        _limiter.restore_original_limits()
+        _limiter = None
+
+    if not threads:
+        cv2.setNumThreads(-1)
+        return
+
+    cv2.setNumThreads(threads)
+    _limiter = threadpool_limits(limits=threads)
+
+
+def apply_process_budget(concurrent_jobs):
+    """
+    Set the budget for jobs run inline in this process - once, later calls do nothing
+
+    Args:
+        concurrent_jobs: Jobs that can run at once in this process (job workers)
+    """
+    global _process_budget
+
+    with _active_lock:
+        if _process_budget is None:
+            _process_budget = threads_per_job(concurrent_jobs) or 0
+            apply_thread_budget(_process_budget)
+
+
+def reset_thread_budget():
+    """Restore the library defaults in this process (and let apply_process_budget run again)"""
+    global _process_budget
+
+    with _active_lock:
+        _process_budget = None
+        apply_thread_budget(None)
+
+
+@contextmanager
+def job_slot(max_concurrent=None):
+    """
+    Count a canvas job as active for its duration
+
+    Args:
+        max_concurrent: Jobs that can actually run at once (e.g. process pool
+                        size) - jobs beyond it are queued and don't share cores
+
+    Yields:
+        int: This job's thread budget (None = unlimited)
+    """
+    global _active_jobs
+
+    with _active_lock:
+        _active_jobs += 1
+        running = min(_active_jobs, max_concurrent) if max_concurrent else _active_jobs
+        threads = threads_per_job(running)
+
+    try:
+        yield threads
+    finally:
+        with _active_lock:
+            _active_jobs -= 1
+
+
+def active_jobs():
+    """Canvas jobs currently running in this process"""
+    with _active_lock:
+        return _active_jobs
@@ -0,0 +1,80 @@
+"""
+Conditional GET for read endpoints
+
+Read endpoints compute a cheap validator before doing any real work - from
+row timestamps, counters or the gallery generation - and answer 304 Not
+Modified when the client already has that version (If-None-Match /
+If-Modified-Since). Only on a miss is the JSON (e.g. a canvas's large
+template_data) serialized and sent.
+
+Bodies contain signed URLs, so every ETag also includes the signed-URL epoch
+(app.storage.signed_url_epoch), and Last-Modified is never earlier than the
+epoch's start. Epochs are as long as the signed-URL refresh margin, so a
+client told 304 never keeps using a URL about to expire. ETags are weak: a
+body whose URLs were re-signed within an epoch is equivalent.
+
+Responses are sent with Cache-Control no-cache, so clients keep them but
+revalidate on every use.
+"""
+
+import hashlib
+import json
+
+from flask import request, make_response
+
+from app.storage import signed_url_epoch, signed_url_epoch_start
+
+
+def make_etag(*parts):
+    """ETag value for a version of a resource (parts: anything JSON/str-able)"""
+    raw = json.dumps([*parts, signed_url_epoch()], default=str, separators=(',', ':'))
+    return hashlib.sha1(raw.encode()).hexdigest()[:32]
+
+
+def _cache_control(private):
+    return 'private, no-cache' if private else 'public, no-cache'
+
+
+def _last_modified(last_modified):
+    """Last-Modified covering the signed-URL epoch too (whole seconds, naive UTC)"""
+    if last_modified is None:
+        return None
+    return max(last_modified, signed_url_epoch_start()).replace(microsecond=0)
+
+
+def not_modified(etag, last_modified=None, private=True):
+    """
+    304 response if the client's copy is current, else None
+
+    Args:
+        etag: make_etag() of the current version
+        last_modified: When the resource last changed (naive UTC), if known
+        private: Response depends on the caller's identity
+
+    If-None-Match wins over If-Modified-Since (RFC 9110).
+    """
+    last_modified = _last_modified(last_modified)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        fresh = last_modified <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+
+    return with_validators(make_response('', 304), etag, last_modified, private)
+
+
+def with_validators(response, etag, last_modified=None, private=True):
+    """Attach ETag, Last-Modified and Cache-Control to a response"""
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = _last_modified(last_modified)
+    response.headers['Cache-Control'] = _cache_control(private)
+    response.vary.add('Accept')  # Picks the image variant format
+    if private:
+        response.vary.add('Authorization')
+    return response
@@ -0,0 +1,130 @@
+"""
+Shared image loader for the processing pipeline
+
+Every processor only needs the photo at (roughly) canvas resolution, but a
+phone upload is often 12+ megapixels. JPEG can be decoded directly at 1/2,
+1/4 or 1/8 scale (libjpeg DCT scaling), which is much faster and needs a
+fraction of the memory of a full decode followed by a resize.
+
+The loader reads the header first to get the dimensions, then picks the
+largest reduction that still leaves the longest side >= target size.
+"""
+
+import io
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# Pillow formats backed by a baseline JPEG stream (MPO = multi-picture
+# JPEG written by many phone cameras)
+_JPEG_FORMATS = {'JPEG', 'MPO'}
+
+# Reduction factor -> OpenCV decode flag (largest first)
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def probe_image(source):
+    """
+    Read image dimensions and format from the header (no pixel decode)
+
+    Args:
+        source: File path or encoded image bytes
+
+    Returns:
+        tuple: (width, height, format) - format is Pillow's name, e.g. 'JPEG'
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    with Image.open(source) as img:
+        return img.width, img.height, img.format
+
+
+def reduction_factor(width, height, target_size):
+    """
+    Largest JPEG decode reduction that keeps the longest side >= target_size
+
+    Args:
+        width: Full image width
+        height: Full image height
+        target_size: Longest side needed downstream (None = full size)
+
+    Returns:
+        int: 1, 2, 4 or 8
+    """
+    if not target_size:
+        return 1
+
+    longest = max(width, height)
+    for factor, _ in _REDUCED_FLAGS:
+        if longest // factor >= target_size:
+            return factor
+    return 1
+
+
+def _decode_flag(source, target_size):
+    """Choose the cv2 imread flag for source at target_size"""
+    if not target_size:
+        return cv2.IMREAD_COLOR
+
+    try:
+        width, height, image_format = probe_image(source)
+    except Exception:
+        # Let OpenCV produce the real error (or decode something Pillow can't)
+        return cv2.IMREAD_COLOR
+
+    # Only JPEG decodes natively at reduced scale; other formats would be
+    # fully decoded and then resized by OpenCV anyway
+    if image_format not in _JPEG_FORMATS:
+        return cv2.IMREAD_COLOR
+
+    factor = reduction_factor(width, height, target_size)
+    return dict(_REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+
+
+def load_image(image_path, target_size=None):
+    """
+    Load an image as RGB, decoding at reduced scale when it is far larger than needed
+
+    Args:
+        image_path: Path to input image
+        target_size: Longest side needed downstream (None = full resolution)
+
+    Returns:
+        ndarray: RGB image whose longest side is >= target_size (or full size)
+
+    Raises:
+        ValueError: If the image can't be loaded
+    """
+    image = cv2.imread(str(image_path), _decode_flag(str(image_path), target_size))
+    if image is None:
+        raise ValueError(f"Could not load image: {image_path}")
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def load_image_bytes(data, target_size=None):
+    """
+    Decode encoded image bytes (e.g. an upload) as RGB, at reduced scale when possible
+
+    Args:
+        data: Encoded image bytes
+        target_size: Longest side needed downstream (None = full resolution)
+
+    Returns:
+        ndarray: RGB image
+
+    Raises:
+        ValueError: If the data can't be decoded
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    image = cv2.imdecode(buffer, _decode_flag(data, target_size))
+    if image is None:
+        raise ValueError("Could not decode image data")
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
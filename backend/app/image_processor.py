@@ -10,6 +10,12 @@ from PIL import Image, ImageDraw, ImageFont
 from scipy import ndimage
 import os
 
+try:
+    from app.image_loader import load_image
+except ImportError:
+    # Running as a standalone script (python app/<module>.py)
+    from image_loader import load_image
+
 
 class PaintByNumbersGenerator:
     """Generate paint-by-numbers templates from photos"""
@@ -27,13 +33,8 @@ class PaintByNumbersGenerator:
         self.num_colors = num_colors
         self.max_size = max_size
         
-        # Load image
-        self.original = cv2.imread(image_path)
-        if self.original is None:
-            raise ValueError(f"Could not load image: {image_path}")
-        
-        # Convert BGR to RGB
-        self.original = cv2.cvtColor(self.original, cv2.COLOR_BGR2RGB)
+        # Load image (RGB) at reduced scale when far larger than max_size
+        self.original = load_image(image_path, target_size=max_size)
         
         # Storage for processed data
         self.resized = None
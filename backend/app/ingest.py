@@ -0,0 +1,196 @@
+"""
+Upload ingest: decode an uploaded image once and derive everything from it
+
+Metadata comes from the header alone (Pillow opens images lazily). The pixels
+are then decoded a single time - for JPEG at reduced scale via draft(), so a
+12 megapixel phone photo that only feeds a 300px thumbnail is decoded at
+1/8 size - and every derived image is resized from that one bitmap, largest
+first, each from the previous one.
+
+Gallery uploads get a set of responsive variants besides the thumbnail, so
+clients can fetch the smallest copy that fits their display (see
+Image.pick_variant).
+
+Configuration (env):
+    IMAGE_VARIANT_WIDTHS    Variant sizes - longest side in px (default 160,320,640,1280)
+    IMAGE_VARIANT_FORMATS   Variant formats (default jpeg,webp)
+"""
+
+import io
+import math
+import os
+from PIL import Image
+
+
+# Pillow formats backed by a baseline JPEG stream (see app.image_loader)
+_JPEG_FORMATS = {'JPEG', 'MPO'}
+
+# Decode at least this many times the largest output (like Image.thumbnail's
+# reducing_gap) so the final LANCZOS pass still has detail to work with
+DRAFT_GAP = 2.0
+
+THUMBNAIL_SIZE = (300, 300)
+
+CONTENT_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png'
+}
+
+# Variant format name -> (Pillow format, file extension)
+VARIANT_FORMATS = {
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp')
+}
+
+
+def variant_outputs(width, height):
+    """
+    Responsive variants to make for an image of width x height
+
+    Only sizes smaller than the original are made - clients asking for more
+    get the original.
+
+    Returns:
+        dict: {name: ((size, size), pillow_format)} for derive_images - name
+              is '<size>.<extension>'
+    """
+    sizes = [int(s) for s in os.getenv('IMAGE_VARIANT_WIDTHS', '160,320,640,1280').split(',') if s.strip()]
+    formats = [f.strip().lower() for f in os.getenv('IMAGE_VARIANT_FORMATS', 'jpeg,webp').split(',') if f.strip()]
+
+    outputs = {}
+    for size in sizes:
+        if size >= max(width, height):
+            continue
+        for name in formats:
+            pillow_format, extension = VARIANT_FORMATS[name]
+            outputs[f"{size}.{extension}"] = ((size, size), pillow_format)
+    return outputs
+
+
+def read_metadata(data):
+    """
+    Read dimensions, format and mode from the image header (no pixel decode)
+
+    Args:
+        data: Encoded image bytes
+
+    Returns:
+        dict: width, height, format, mode
+
+    Raises:
+        ValueError: If the data isn't a readable image
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return {
+                'width': img.width,
+                'height': img.height,
+                'format': img.format,
+                'mode': img.mode
+            }
+    except Exception as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+
+def fitted_size(size, box):
+    """Size of an image of size scaled down (never up) to fit in box, keeping aspect ratio"""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _to_rgb(img):
+    """Flatten transparency onto white and convert to RGB"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def decode(data, largest_box=None):
+    """
+    Decode an upload once, at reduced scale when only smaller images are needed
+
+    Args:
+        data: Encoded image bytes
+        largest_box: (width, height) box of the largest image that will be
+                     derived (None = full resolution)
+
+    Returns:
+        PIL.Image: RGB image, at least DRAFT_GAP x the fitted box (or full size)
+
+    Raises:
+        ValueError: If the data can't be decoded
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+
+        if largest_box and img.format in _JPEG_FORMATS:
+            target = fitted_size(img.size, largest_box)
+            img.draft('RGB', (math.ceil(target[0] * DRAFT_GAP), math.ceil(target[1] * DRAFT_GAP)))
+
+        img.load()
+        return _to_rgb(img)
+    except Exception as e:
+        raise ValueError(f"Could not decode image: {e}")
+
+
+def encode(img, image_format='JPEG', quality=85):
+    """Encode a PIL image to bytes"""
+    output = io.BytesIO()
+    if image_format == 'JPEG':
+        img.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        img.save(output, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(output, format=image_format)
+    return output.getvalue()
+
+
+def derive_images(data, outputs, quality=85):
+    """
+    Decode an upload once and produce resized, encoded copies of it
+
+    Args:
+        data: Encoded image bytes
+        outputs: {name: ((max_width, max_height), format)} - format is a
+                 Pillow name ('JPEG', 'WEBP', ...)
+        quality: Encoder quality
+
+    Returns:
+        dict: {name: {'data': bytes, 'width', 'height', 'format', 'content_type'}}
+
+    Raises:
+        ValueError: If the data can't be decoded
+    """
+    if not outputs:
+        return {}
+
+    largest = max((box for box, _ in outputs.values()), key=lambda box: box[0] * box[1])
+    image = decode(data, largest)
+
+    # Largest first, each resized from the previous (smaller) bitmap
+    results = {}
+    current = image
+    for name, (box, image_format) in sorted(outputs.items(), key=lambda item: -item[1][0][0] * item[1][0][1]):
+        size = fitted_size(image.size, box)
+        if current.width < size[0] or current.height < size[1]:
+            current = image
+        if current.size != size:
+            current = current.resize(size, Image.Resampling.LANCZOS)
+
+        results[name] = {
+            'data': encode(current, image_format, quality),
+            'width': current.width,
+            'height': current.height,
+            'format': image_format,
+            'content_type': CONTENT_TYPES.get(image_format, 'application/octet-stream')
+        }
+
+    return results
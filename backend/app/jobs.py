@@ -0,0 +1,519 @@
+"""
+Durable background job queue
+
+Jobs are rows in the `jobs` table, so nothing is lost on restart. A fixed-size
+pool of worker threads in each serving process (started by run.py and
+gunicorn.conf.py, never on import) claims them one at a time:
+
+- Claiming picks a job with weighted fair scheduling across users (see
+  claim_job) and flips it to 'running' with a conditional UPDATE, so two
+  workers can never both win the same row (Postgres or SQLite).
+- request_cancel() stops a project's jobs: queued ones immediately, running
+  ones cooperatively via their CancelToken (app.cancellation).
+- A running job holds a lease that a heartbeat thread keeps extending. If the
+  process dies the lease expires and the job is requeued (up to max_attempts).
+- A job whose handler raises is retried after a backoff (JOB_RETRY_BACKOFF,
+  doubling per attempt) until it has used max_attempts, then failed for good.
+- Periodic jobs (register_periodic_job) are queued by the heartbeat thread
+  once their interval has passed since the last one of their kind.
+
+Configuration (env):
+    JOB_WORKERS          Worker threads per process (default 2, 0 = don't run jobs here)
+    JOB_LEASE_SECONDS    Lease length (default 60)
+    JOB_POLL_INTERVAL    Seconds between queue polls when idle (default 2)
+    JOB_CLASS_WEIGHTS    Scheduling weight per user class (default 'interactive:3,bulk:1')
+    JOB_BULK_THRESHOLD   Queued/running jobs after which a user's new jobs are 'bulk' (default 3)
+    JOB_MAX_QUEUE_WAIT   Seconds after which a queued job is served first regardless (default 300)
+    JOB_RETRY_BACKOFF    Seconds before a failed job's first retry, doubled for each later one (default 10)
+    JOB_CANCEL_POLL      Seconds between checks for cancel requests on running jobs (default 1)
+
+Queue wait and service time per kind/user class are recorded in app.metrics.
+"""
+
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Job
+from app import metrics
+from app.cancellation import JobCancelled, open_token, close_token, cancel_local
+
+
+# kind -> (handler(job), on_give_up(job, error) or None, on_cancel(job) or None)
+_handlers = {}
+
+# kind -> seconds between runs (see register_periodic_job)
+_periodic = {}
+
+# How often the heartbeat thread looks for due periodic jobs
+PERIODIC_CHECK_INTERVAL = 30.0
+
+# Longest wait before a failed job is retried
+MAX_RETRY_BACKOFF = 600.0
+
+# Wakes idle workers in this process when a job is enqueued
+_wakeup = threading.Event()
+
+_pool = None
+
+
+def register_job_handler(kind, handler, on_give_up=None, on_cancel=None):
+    """
+    Register the function that runs jobs of a kind
+
+    Args:
+        kind: Job kind string
+        handler: Called with the Job (inside an app context)
+        on_give_up: Called with (job, error) when the job fails for good
+        on_cancel: Called with the job when it is cancelled before it started
+                   (running jobs clean up after themselves on JobCancelled)
+    """
+    _handlers[kind] = (handler, on_give_up, on_cancel)
+
+
+def register_periodic_job(kind, interval):
+    """
+    Run a registered job kind every interval seconds (across all instances)
+
+    Args:
+        kind: Job kind (register its handler with register_job_handler)
+        interval: Seconds between runs (0 = never)
+    """
+    if interval > 0:
+        _periodic[kind] = interval
+
+
+def enqueue_due_periodic_jobs():
+    """
+    Queue periodic jobs whose last run was queued more than their interval ago
+
+    Returns:
+        list: Queued jobs
+    """
+    now = datetime.utcnow()
+    queued = []
+
+    for kind, interval in _periodic.items():
+        last = db.session.query(db.func.max(Job.created_at)).filter(Job.kind == kind).scalar()
+        if last is None or now - last >= timedelta(seconds=interval):
+            queued.append(enqueue_job(kind, max_attempts=1, commit=False))
+
+    db.session.commit()
+    if queued:
+        notify_workers()
+    return queued
+
+
+def enqueue_job(kind, payload=None, project_id=None, user_id=None, max_attempts=3, commit=True, cost=1):
+    """
+    Add a job to the queue
+
+    Args:
+        kind: Registered job kind
+        payload: JSON-serializable handler arguments
+        project_id: Related coloring project (optional)
+        user_id: Owner (optional)
+        max_attempts: Attempts before the job is failed for good
+        commit: Commit immediately (False = caller commits with its own changes)
+        cost: Estimated cost - a user's cheaper jobs run first
+
+    Returns:
+        Job: The queued job
+    """
+    user_class = 'interactive'
+    if user_id:
+        backlog = Job.query.filter(Job.user_id == user_id, Job.status.in_(('queued', 'running'))).count()
+        if backlog >= int(os.getenv('JOB_BULK_THRESHOLD', 3)):
+            user_class = 'bulk'
+
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        project_id=project_id,
+        user_id=user_id,
+        max_attempts=max_attempts,
+        cost=max(1, int(cost)),
+        user_class=user_class,
+        status='queued'
+    )
+    db.session.add(job)
+
+    if commit:
+        db.session.commit()
+        notify_workers()
+
+    return job
+
+
+def notify_workers():
+    """Wake idle workers in this process (other processes pick jobs up on their next poll)"""
+    _wakeup.set()
+
+
+def _class_weights():
+    """Scheduling weight per user class from JOB_CLASS_WEIGHTS ('interactive:3,bulk:1')"""
+    weights = {}
+    for item in os.getenv('JOB_CLASS_WEIGHTS', 'interactive:3,bulk:1').split(','):
+        name, _, weight = item.partition(':')
+        if name.strip():
+            weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def claim_job(worker_id, lease_seconds):
+    """
+    Claim the next queued job for worker_id (weighted fair across users)
+
+    Each user's queue is served cheapest job first (then oldest). Between
+    users, the next job goes to the user with the lowest
+    (running jobs + 1) / class weight, so one user's backlog can't take every
+    worker and bulk uploaders yield to interactive users. Jobs queued longer
+    than JOB_MAX_QUEUE_WAIT seconds go first regardless - within their user's
+    queue too, so an expensive job isn't starved by cheaper ones queued after
+    it.
+
+    Returns:
+        str: Claimed job id, or None if the queue is empty
+    """
+    now = datetime.utcnow()
+    max_wait = timedelta(seconds=float(os.getenv('JOB_MAX_QUEUE_WAIT', 300)))
+    weights = _class_weights()
+
+    # Head of every user's queue - overdue jobs first, then cheapest
+    overdue_first = db.case((Job.created_at < now - max_wait, 0), else_=1)
+    rank = db.func.row_number().over(
+        partition_by=Job.user_id,
+        order_by=(overdue_first, Job.cost.asc(), Job.created_at.asc())
+    ).label('rank')
+    queued = db.session.query(Job.id, Job.user_id, Job.user_class, Job.cost, Job.created_at, rank)\
+                       .filter(Job.status == 'queued')\
+                       .filter(db.or_(Job.run_after.is_(None), Job.run_after <= now))\
+                       .subquery()
+    heads = db.session.query(queued).filter(queued.c.rank == 1).all()
+
+    if not heads:
+        db.session.rollback()
+        return None
+
+    running = dict(
+        db.session.query(Job.user_id, db.func.count(Job.id))
+                  .filter(Job.status == 'running')
+                  .group_by(Job.user_id)
+                  .all()
+    )
+
+    def order(head):
+        overdue = now - head.created_at > max_wait
+        share = (running.get(head.user_id, 0) + 1) / weights.get(head.user_class, 1.0)
+        return (not overdue, share, head.cost, head.created_at)
+
+    for head in sorted(heads, key=order):
+        # Conditional update - loses cleanly if another worker got there first
+        claimed = Job.query.filter_by(id=head.id, status='queued').update({
+            'status': 'running',
+            'worker_id': worker_id,
+            'attempts': Job.attempts + 1,
+            'started_at': now,
+            'heartbeat_at': now,
+            'lease_expires_at': now + timedelta(seconds=lease_seconds)
+        }, synchronize_session=False)
+        db.session.commit()
+
+        if claimed == 1:
+            return head.id
+
+    return None
+
+
+def request_cancel(project_id):
+    """
+    Cancel a project's unfinished jobs
+
+    Queued jobs are cancelled right away. Running jobs get cancel_requested_at;
+    the worker running them (on any instance) stops at its next check. Caller
+    commits.
+
+    Returns:
+        list: Jobs cancelled or asked to cancel
+    """
+    jobs = Job.query.filter(Job.project_id == project_id, Job.status.in_(('queued', 'running'))).all()
+
+    for job in jobs:
+        if job.status == 'queued':
+            _finish(job, 'cancelled')
+            metrics.inc('jobs_cancelled_total', kind=job.kind, stage='queued')
+            _, _, on_cancel = _handlers.get(job.kind, (None, None, None))
+            if on_cancel:
+                try:
+                    on_cancel(job)
+                except Exception as e:
+                    print(f"⚠️  Cancel hook for {job.id} failed: {e}")
+        elif job.cancel_requested_at is None:
+            job.cancel_requested_at = datetime.utcnow()
+            cancel_local(job.id)  # Running here - no need to wait for the poll
+
+    return jobs
+
+
+def requeue_expired_jobs():
+    """
+    Requeue running jobs whose lease expired (worker crashed or was killed)
+
+    Jobs out of attempts are failed and their give-up hook runs.
+
+    Returns:
+        int: Number of jobs requeued or failed
+    """
+    now = datetime.utcnow()
+
+    expired = Job.query.filter(Job.status == 'running', Job.lease_expires_at < now)\
+                       .with_for_update(skip_locked=True)\
+                       .all()
+
+    for job in expired:
+        if job.cancel_requested_at is not None:
+            _finish(job, 'cancelled')
+        elif job.attempts < job.max_attempts:
+            print(f"♻️  Requeueing {job.id} (lease expired, attempt {job.attempts}/{job.max_attempts})")
+            job.status = 'queued'
+            job.worker_id = None
+            job.lease_expires_at = None
+        else:
+            print(f"✗ Giving up on {job.id} after {job.attempts} attempts")
+            _finish(job, 'failed', 'Worker lost (lease expired) too many times')
+            _give_up(job, job.error_message)
+
+    db.session.commit()
+    return len(expired)
+
+
+def retry_delay(attempts):
+    """Backoff before retrying a job that failed on its attempts-th attempt"""
+    base = float(os.getenv('JOB_RETRY_BACKOFF', 10))
+    return min(MAX_RETRY_BACKOFF, base * 2 ** max(0, attempts - 1))
+
+
+def _retry_later(job, error):
+    """Put a failed job back in the queue, claimable after its backoff"""
+    delay = retry_delay(job.attempts)
+    print(f"♻️  Retrying {job.id} in {delay:.0f}s (attempt {job.attempts}/{job.max_attempts} failed: {error})")
+    job.status = 'queued'
+    job.error_message = error
+    job.worker_id = None
+    job.lease_expires_at = None
+    job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def _finish(job, status, error=None):
+    job.status = status
+    job.error_message = error
+    job.finished_at = datetime.utcnow()
+    job.lease_expires_at = None
+
+
+def _give_up(job, error):
+    _, on_give_up, _ = _handlers.get(job.kind, (None, None, None))
+    if on_give_up:
+        try:
+            on_give_up(job, error)
+        except Exception as e:
+            print(f"⚠️  Give-up hook for {job.id} failed: {e}")
+
+
+class JobWorkerPool:
+    """Fixed-size pool of worker threads draining the jobs table"""
+
+    def __init__(self, app, num_workers=2, lease_seconds=60, poll_interval=2.0):
+        """
+        Initialize worker pool
+
+        Args:
+            app: Flask app (workers run inside its app context)
+            num_workers: Number of worker threads (= max concurrent jobs in this process)
+            lease_seconds: Lease length; a job whose worker stops heartbeating is requeued after this
+            poll_interval: Seconds between queue polls when idle
+        """
+        self.app = app
+        self.num_workers = num_workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._running = {}  # worker_id -> job_id
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start worker and heartbeat threads"""
+        for i in range(self.num_workers):
+            worker_id = f"{self.instance_id}/w{i}"
+            thread = threading.Thread(target=self._worker_loop, args=(worker_id,),
+                                      name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+
+        print(f"Job worker pool started ({self.num_workers} workers, lease {self.lease_seconds}s)")
+
+    def stop(self, timeout=None):
+        """Stop after current jobs finish"""
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def active_jobs(self):
+        """Job ids currently running in this pool"""
+        with self._lock:
+            return list(self._running.values())
+
+    def _worker_loop(self, worker_id):
+        while not self._stop.is_set():
+            job_id = None
+            try:
+                with self.app.app_context():
+                    requeue_expired_jobs()
+                    job_id = claim_job(worker_id, self.lease_seconds)
+                    if job_id:
+                        self._run(worker_id, job_id)
+            except Exception as e:
+                print(f"⚠️  Job worker {worker_id} error: {e}")
+
+            if not job_id:
+                # Idle - wait for a local enqueue or the next poll
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+
+    def _run(self, worker_id, job_id):
+        job = db.session.get(Job, job_id)
+        handler, _, _ = _handlers.get(job.kind, (None, None, None))
+
+        with self._lock:
+            self._running[worker_id] = job_id
+
+        labels = {'kind': job.kind, 'user_class': job.user_class}
+        metrics.observe('job_queue_wait_seconds', (job.started_at - job.created_at).total_seconds(), **labels)
+
+        # Handlers pass this token to anything long-running (get it with open_token(job.id))
+        token = open_token(job_id)
+        if job.cancel_requested_at is not None:
+            token.cancel()
+
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job.kind}'")
+
+            handler(job)
+
+            job = db.session.get(Job, job_id)
+            _finish(job, 'completed')
+            db.session.commit()
+        except JobCancelled:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            print(f"🛑 Job {job_id} cancelled")
+            _finish(job, 'cancelled')
+            db.session.commit()
+            metrics.inc('jobs_cancelled_total', kind=job.kind, stage=job.stage or 'started')
+            metrics.observe('job_cancelled_seconds', (job.finished_at - job.started_at).total_seconds(),
+                            kind=job.kind)
+        except Exception as e:
+            traceback.print_exc()
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            if handler is not None and job.attempts < job.max_attempts and job.cancel_requested_at is None:
+                # Possibly transient (storage 503, DB blip) - try again later
+                _retry_later(job, str(e))
+                db.session.commit()
+                metrics.inc('jobs_retried_total', **labels)
+            else:
+                _finish(job, 'failed', str(e))
+                db.session.commit()
+                _give_up(job, str(e))
+        finally:
+            close_token(job_id)
+            if job.finished_at and job.started_at:
+                metrics.observe('job_service_seconds', (job.finished_at - job.started_at).total_seconds(), **labels)
+            if job.status != 'queued':
+                metrics.inc('jobs_finished_total', status=job.status, **labels)
+            with self._lock:
+                self._running.pop(worker_id, None)
+
+    def _heartbeat_loop(self):
+        """Extend leases of running jobs, pass on cancel requests made on any instance and queue periodic jobs"""
+        heartbeat_interval = max(1.0, self.lease_seconds / 3)
+        cancel_poll = float(os.getenv('JOB_CANCEL_POLL', 1))
+        last_heartbeat = 0.0
+        last_periodic = 0.0
+
+        while not self._stop.wait(min(heartbeat_interval, cancel_poll)):
+            if _periodic and time.monotonic() - last_periodic >= PERIODIC_CHECK_INTERVAL:
+                last_periodic = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        enqueue_due_periodic_jobs()
+                except Exception as e:
+                    print(f"⚠️  Scheduling periodic jobs failed: {e}")
+
+            with self._lock:
+                running = dict(self._running)
+            if not running:
+                continue
+            try:
+                with self.app.app_context():
+                    cancelled = db.session.query(Job.id)\
+                                          .filter(Job.id.in_(list(running.values())),
+                                                  Job.cancel_requested_at.isnot(None))\
+                                          .all()
+                    for (job_id,) in cancelled:
+                        cancel_local(job_id)
+
+                    if time.monotonic() - last_heartbeat >= heartbeat_interval:
+                        now = datetime.utcnow()
+                        for worker_id, job_id in running.items():
+                            Job.query.filter_by(id=job_id, worker_id=worker_id, status='running').update({
+                                'heartbeat_at': now,
+                                'lease_expires_at': now + timedelta(seconds=self.lease_seconds)
+                            }, synchronize_session=False)
+                        last_heartbeat = time.monotonic()
+
+                    db.session.commit()
+            except Exception as e:
+                print(f"⚠️  Job heartbeat failed: {e}")
+
+
+def start_worker_pool(app):
+    """
+    Start this process's worker pool (once) using env configuration
+
+    Returns:
+        JobWorkerPool or None if JOB_WORKERS is 0
+    """
+    global _pool
+
+    num_workers = int(os.getenv('JOB_WORKERS', 2))
+    if _pool is not None or num_workers <= 0:
+        return _pool
+
+    _pool = JobWorkerPool(
+        app,
+        num_workers=num_workers,
+        lease_seconds=int(os.getenv('JOB_LEASE_SECONDS', 60)),
+        poll_interval=float(os.getenv('JOB_POLL_INTERVAL', 2))
+    )
+    _pool.start()
+    return _pool
+
+
+def get_worker_pool():
+    """Get this process's worker pool (None if not started)"""
+    return _pool
@@ -0,0 +1,92 @@
+"""
+In-process metrics
+
+Counters and latency histograms kept in memory, labelled like
+observe('job_queue_wait_seconds', 1.8, kind='canvas', user_class='bulk').
+Histograms keep the most recent samples (HISTOGRAM_WINDOW) so percentiles
+reflect current load. Values are per process - each instance reports its own.
+Exposed to admins via GET /api/admin/metrics.
+"""
+
+import math
+import threading
+from collections import deque
+
+
+# Samples kept per histogram series
+HISTOGRAM_WINDOW = 2048
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def _series(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Increment a counter"""
+    key = _series(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record a sample (e.g. seconds) in a histogram"""
+    key = _series(name, labels)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = {'count': 0, 'sum': 0.0, 'samples': deque(maxlen=HISTOGRAM_WINDOW)}
+        series['count'] += 1
+        series['sum'] += value
+        series['samples'].append(value)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def snapshot():
+    """
+    Current metric values
+
+    Returns:
+        dict: {'counters': [...], 'histograms': [...]} - each entry has name and
+              labels; histograms add count, sum and p50/p95/p99/max of recent samples
+    """
+    with _lock:
+        counters = [(key, value) for key, value in _counters.items()]
+        histograms = [(key, series['count'], series['sum'], sorted(series['samples']))
+                      for key, series in _histograms.items()]
+
+    result = {'counters': [], 'histograms': []}
+
+    for (name, labels), value in sorted(counters):
+        result['counters'].append({'name': name, 'labels': dict(labels), 'value': value})
+
+    for (name, labels), count, total, samples in sorted(histograms, key=lambda h: h[0]):
+        result['histograms'].append({
+            'name': name,
+            'labels': dict(labels),
+            'count': count,
+            'sum': round(total, 3),
+            'p50': percentile(samples, 50),
+            'p95': percentile(samples, 95),
+            'p99': percentile(samples, 99),
+            'max': samples[-1] if samples else None
+        })
+
+    return result
+
+
+def reset():
+    """Clear all metrics (tests/benchmarks)"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -6,9 +6,31 @@ from datetime import datetime
 import uuid
 import json
 
+
+def signed_url(blob_path, urls=None):
+    """
+    Signed URL for a blob
+    
+    Args:
+        blob_path: Path to blob in bucket (None -> None)
+        urls: Optional batch from storage.generate_signed_urls to take it from
+    """
+    if not blob_path:
+        return None
+    if urls is not None and blob_path in urls:
+        return urls[blob_path]
+    from app.storage import generate_signed_url
+    return generate_signed_url(blob_path)
+
+
 class Image(db.Model):
     """Image metadata model"""
     __tablename__ = 'images'
+    __table_args__ = (
+        # Keyset pagination (app.pagination): gallery/pending by status, uploads by user
+        db.Index('ix_images_status_uploaded_at_id', 'status', 'uploaded_at', 'id'),
+        db.Index('ix_images_user_uploaded_at_id', 'user_id', 'uploaded_at', 'id'),
+    )
     
     id = db.Column(db.String(50), primary_key=True, default=lambda: f"img_{uuid.uuid4().hex[:12]}")
     user_id = db.Column(db.String(128), nullable=False, index=True)
@@ -18,11 +40,15 @@ class Image(db.Model):
     title = db.Column(db.String(255))
     description = db.Column(db.Text)
     
-    status = db.Column(db.String(20), default='pending', index=True)  # pending, approved, rejected
+    # pending, approved, rejected - lives only here; objects keep their paths (see app.moderation)
+    status = db.Column(db.String(20), default='pending', index=True)
     
     file_path = db.Column(db.String(512), nullable=False)
     thumbnail_path = db.Column(db.String(512))
     
+    # Resized copies made at upload: [{'width', 'height', 'format', 'path'}] (see app.ingest)
+    variants = db.Column(db.JSON)
+    
     mime_type = db.Column(db.String(50))
     file_size = db.Column(db.Integer)
     width = db.Column(db.Integer)
@@ -32,8 +58,59 @@ class Image(db.Model):
     reviewed_at = db.Column(db.DateTime)
     reviewed_by = db.Column(db.String(128))
     
-    def to_dict(self, include_urls=False):
-        """Convert model to dictionary"""
+    def variant_paths(self):
+        """Storage paths of all resized variants"""
+        return [variant['path'] for variant in self.variants or []]
+    
+    def storage_paths(self):
+        """Storage paths of every stored copy: original, thumbnail and variants"""
+        return [p for p in [self.file_path, self.thumbnail_path, *self.variant_paths()] if p]
+    
+    def pick_variant(self, width, image_format='jpeg'):
+        """
+        Smallest stored copy at least width pixels wide
+        
+        Args:
+            width: Width the client will display the image at
+            image_format: Preferred variant format ('jpeg' or 'webp')
+            
+        Returns:
+            dict: width, height, format and path - the original if no variant is wide enough
+        """
+        variants = [v for v in self.variants or [] if v['format'] == image_format] or self.variants or []
+        for variant in sorted(variants, key=lambda v: v['width']):
+            if variant['width'] >= width:
+                return variant
+        
+        # Variants are only made smaller than the original
+        return {'width': self.width, 'height': self.height, 'format': 'original', 'path': self.file_path}
+    
+    def signed_paths(self, width=None, image_format='jpeg'):
+        """Blob paths to_dict/to_public_dict sign - for batch signing a page up front"""
+        paths = [self.file_path, self.thumbnail_path]
+        if width:
+            paths.append(self.pick_variant(width, image_format)['path'])
+        return paths
+    
+    def _display_fields(self, width, image_format, urls=None):
+        """display_url/width/height for a client showing the image width pixels wide"""
+        variant = self.pick_variant(width, image_format)
+        return {
+            'display_url': signed_url(variant['path'], urls),
+            'display_width': variant['width'],
+            'display_height': variant['height']
+        }
+    
+    def to_dict(self, include_urls=False, width=None, image_format='jpeg', urls=None):
+        """
+        Convert model to dictionary
+        
+        Args:
+            include_urls: Add signed image/thumbnail URLs
+            width: Display width - adds display_url for the best fitting variant (with include_urls)
+            image_format: Preferred variant format for display_url
+            urls: Signed URLs already made for this page (storage.generate_signed_urls)
+        """
         data = {
             'id': self.id,
             'user_id': self.user_id,
@@ -49,34 +126,48 @@ class Image(db.Model):
                 'file_size': self.file_size,
                 'width': self.width,
                 'height': self.height
-            }
+            },
+            'variants': [{'width': v['width'], 'height': v['height'], 'format': v['format']}
+                         for v in self.variants or []]
         }
         
         if include_urls:
-            from app.storage import generate_signed_url
-            data['image_url'] = generate_signed_url(self.file_path) if self.file_path else None
-            data['thumbnail_url'] = generate_signed_url(self.thumbnail_path) if self.thumbnail_path else None
+            data['image_url'] = signed_url(self.file_path, urls)
+            data['thumbnail_url'] = signed_url(self.thumbnail_path, urls)
+            if width:
+                data.update(self._display_fields(width, image_format, urls))
         
         return data
     
-    def to_public_dict(self):
-        """Convert model to public dictionary (for approved images only)"""
+    def to_public_dict(self, width=None, image_format='jpeg', urls=None):
+        """
+        Convert model to public dictionary (for approved images only)
+        
+        Args:
+            width: Display width - adds display_url for the best fitting variant
+            image_format: Preferred variant format for display_url
+            urls: Signed URLs already made for this page (storage.generate_signed_urls)
+        """
         if self.status != 'approved':
             return None
         
-        from app.storage import generate_signed_url
-        return {
+        data = {
             'id': self.id,
             'title': self.title,
             'description': self.description,
-            'image_url': generate_signed_url(self.file_path) if self.file_path else None,
-            'thumbnail_url': generate_signed_url(self.thumbnail_path) if self.thumbnail_path else None,
+            'image_url': signed_url(self.file_path, urls),
+            'thumbnail_url': signed_url(self.thumbnail_path, urls),
             'uploaded_at': self.uploaded_at.isoformat() + 'Z' if self.uploaded_at else None,
             'uploader': {
                 'name': self.user_name,
                 'id': self.user_id
             }
         }
+        
+        if width:
+            data.update(self._display_fields(width, image_format, urls))
+        
+        return data
     
     def __repr__(self):
         return f'<Image {self.id} - {self.status}>'
@@ -85,6 +176,10 @@ class Image(db.Model):
 class ColoringProject(db.Model):
     """Coloring project - photo converted to paint-by-numbers template"""
     __tablename__ = 'coloring_projects'
+    __table_args__ = (
+        # Keyset pagination of a user's projects (app.pagination)
+        db.Index('ix_coloring_projects_user_created_at_id', 'user_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.String(50), primary_key=True, default=lambda: f"proj_{uuid.uuid4().hex[:12]}")
     user_id = db.Column(db.String(128), nullable=False, index=True)
@@ -99,25 +194,30 @@ class ColoringProject(db.Model):
     difficulty = db.Column(db.String(20), default='medium')  # easy, medium, hard
     num_colors = db.Column(db.Integer, default=20)
     
-    status = db.Column(db.String(20), default='processing', index=True)  # processing, completed, failed
+    status = db.Column(db.String(20), default='processing', index=True)  # processing, completed, failed, cancelled
     error_message = db.Column(db.Text)
     
+    # Canvas result this project uses / waits for (see CanvasResult)
+    result_key = db.Column(db.String(64), index=True)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship to sessions
     sessions = db.relationship('ColoringSession', backref='project', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        """Convert to dictionary"""
-        from app.storage import generate_signed_url
-        
+    def signed_paths(self):
+        """Blob paths to_dict signs - for batch signing a page up front"""
+        return [self.original_image_url, self.template_image_url]
+    
+    def to_dict(self, urls=None):
+        """Convert to dictionary (urls: signed URLs already made for this page)"""
         return {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
-            'original_image_url': generate_signed_url(self.original_image_url) if self.original_image_url else None,
-            'template_image_url': generate_signed_url(self.template_image_url) if self.template_image_url else None,
+            'original_image_url': signed_url(self.original_image_url, urls),
+            'template_image_url': signed_url(self.template_image_url, urls),
             'template_data': self.template_data,
             'difficulty': self.difficulty,
             'num_colors': self.num_colors,
@@ -133,6 +233,10 @@ class ColoringProject(db.Model):
 class ColoringSession(db.Model):
     """User's coloring progress on a project"""
     __tablename__ = 'coloring_sessions'
+    __table_args__ = (
+        # Keyset pagination of a user's completed colorings (app.pagination)
+        db.Index('ix_coloring_sessions_user_completed_at_id', 'user_id', 'is_completed', 'completed_at', 'id'),
+    )
     
     id = db.Column(db.String(50), primary_key=True, default=lambda: f"sess_{uuid.uuid4().hex[:12]}")
     project_id = db.Column(db.String(50), db.ForeignKey('coloring_projects.id'), nullable=False, index=True)
@@ -150,17 +254,19 @@ class ColoringSession(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
     
-    def to_dict(self):
-        """Convert to dictionary"""
-        from app.storage import generate_signed_url
-        
+    def signed_paths(self):
+        """Blob paths to_dict signs - for batch signing a page up front"""
+        return [self.colored_image_url]
+    
+    def to_dict(self, urls=None):
+        """Convert to dictionary (urls: signed URLs already made for this page)"""
         return {
             'id': self.id,
             'project_id': self.project_id,
             'user_id': self.user_id,
             'filled_regions': self.filled_regions or {},
             'completion_percent': self.completion_percent,
-            'colored_image_url': generate_signed_url(self.colored_image_url) if self.colored_image_url else None,
+            'colored_image_url': signed_url(self.colored_image_url, urls),
             'is_completed': self.is_completed,
             'started_at': self.started_at.isoformat() + 'Z' if self.started_at else None,
             'updated_at': self.updated_at.isoformat() + 'Z' if self.updated_at else None,
@@ -170,3 +276,108 @@ class ColoringSession(db.Model):
     def __repr__(self):
         return f'<ColoringSession {self.id} - {self.completion_percent}%>'
 
+
+
+class Job(db.Model):
+    """Background job - durable queue entry claimed by the worker pool"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Claim query: oldest queued job first
+        db.Index('ix_jobs_status_created_at', 'status', 'created_at'),
+        # Fair claim: each user's cheapest, oldest queued job
+        db.Index('ix_jobs_status_user_cost', 'status', 'user_id', 'cost', 'created_at'),
+    )
+    
+    id = db.Column(db.String(50), primary_key=True, default=lambda: f"job_{uuid.uuid4().hex[:12]}")
+    kind = db.Column(db.String(50), nullable=False)  # e.g. canvas
+    
+    project_id = db.Column(db.String(50), index=True)
+    user_id = db.Column(db.String(128), index=True)
+    
+    # Handler arguments
+    payload = db.Column(db.JSON, default=dict)
+    
+    # Scheduling: estimated cost (cheap jobs first within a user) and user class
+    # at enqueue time - interactive, or bulk when the user already had a backlog
+    cost = db.Column(db.Integer, default=1, nullable=False)
+    user_class = db.Column(db.String(20), default='interactive', nullable=False)
+    
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, completed, failed, cancelled
+    cancel_requested_at = db.Column(db.DateTime)  # Set to stop a running job (see app.cancellation)
+    
+    # Pipeline progress: current stage (see app.progress.PIPELINE_STAGES) and percent
+    stage = db.Column(db.String(20))
+    progress = db.Column(db.Integer, default=0)
+    stage_started_at = db.Column(db.DateTime)
+    
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    run_after = db.Column(db.DateTime)  # Not claimed before this (retry backoff)
+    
+    # Lease held by the worker running the job; expired leases get requeued
+    worker_id = db.Column(db.String(128))
+    lease_expires_at = db.Column(db.DateTime, index=True)
+    heartbeat_at = db.Column(db.DateTime)
+    
+    error_message = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'project_id': self.project_id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'cost': self.cost,
+            'user_class': self.user_class,
+            'attempts': self.attempts,
+            'error_message': self.error_message,
+            'created_at': self.created_at.isoformat() + 'Z' if self.created_at else None,
+            'started_at': self.started_at.isoformat() + 'Z' if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() + 'Z' if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} - {self.status}>'
+
+
+class CanvasResult(db.Model):
+    """Cached canvas generation result, shared by projects with identical input"""
+    __tablename__ = 'canvas_results'
+    
+    # sha256 of decoded image + generation parameters (see app.canvas_cache)
+    key = db.Column(db.String(64), primary_key=True)
+    
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending (job in flight), ready
+    job_id = db.Column(db.String(50))  # Job producing the result while pending
+    
+    template_data = db.Column(db.JSON)
+    template_image_url = db.Column(db.String(512))
+    
+    hit_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CanvasResult {self.key[:12]} - {self.status}>'
+
+
+class Counter(db.Model):
+    """Materialized row count, kept in step with the counted rows (see app.counters)"""
+    __tablename__ = 'counters'
+    
+    # e.g. images:approved, images:pending:user:<uid>, projects:user:<uid>
+    key = db.Column(db.String(255), primary_key=True)
+    value = db.Column(db.BigInteger, default=0, nullable=False)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Counter {self.key}={self.value}>'
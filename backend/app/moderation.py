@@ -0,0 +1,134 @@
+"""
+Image moderation
+
+Approving or rejecting an image is a database update only. Objects keep the
+paths they were uploaded to, so a decision commits in milliseconds and is
+atomic; storage catches up afterwards through background jobs queued in the
+same transaction (app.jobs):
+
+- 'delete_objects': removes a rejected image's files (batched deletes)
+- 'publish_images': with GALLERY_PUBLIC_URLS, copies approved images to their
+                    content-hashed public/ paths and then repoints the rows.
+                    Until it has run they are served with signed URLs.
+"""
+
+from datetime import datetime
+
+from app import db
+from app.models import Image
+from app import metrics, counters
+from app.jobs import enqueue_job, register_job_handler
+from app.storage import delete_images, publish_images, public_urls_enabled, is_public_path
+
+
+class ModerationError(ValueError):
+    """A decision that can't be applied to the image in its current state"""
+
+
+def approve(image, admin_id):
+    """
+    Mark an image approved (caller commits and queues the storage work)
+
+    Returns:
+        list: Ids of images to publish (see queue_reconcile)
+
+    Raises:
+        ModerationError: If the image is already approved or was rejected
+    """
+    if image.status == 'approved':
+        raise ModerationError('Image already approved')
+    if image.status == 'rejected':
+        # Its files are deleted on rejection
+        raise ModerationError('Rejected images cannot be approved')
+
+    old_status = image.status
+    image.status = 'approved'
+    counters.image_status_changed(image, old_status)
+    image.reviewed_at = datetime.utcnow()
+    image.reviewed_by = admin_id
+    metrics.inc('moderation_decisions_total', decision='approve')
+
+    return [image.id] if public_urls_enabled() else []
+
+
+def reject(image, admin_id, reason=''):
+    """
+    Mark an image rejected (caller commits and queues the storage work)
+
+    Returns:
+        list: Storage paths to delete (see queue_reconcile)
+    """
+    old_status = image.status
+    image.status = 'rejected'
+    counters.image_status_changed(image, old_status)
+    image.reviewed_at = datetime.utcnow()
+    image.reviewed_by = admin_id
+    if reason:
+        image.description = f"[REJECTED: {reason}]"
+    metrics.inc('moderation_decisions_total', decision='reject')
+
+    return image.storage_paths()
+
+
+def queue_reconcile(delete_paths=(), publish_ids=()):
+    """
+    Queue the storage work for a set of decisions - at most one job of each kind
+
+    Added to the current session; the caller commits it together with the
+    decisions, so either both happen or neither does.
+
+    Returns:
+        list: Queued jobs
+    """
+    jobs = []
+    delete_paths = list(dict.fromkeys(delete_paths))
+    publish_ids = list(dict.fromkeys(publish_ids))
+
+    if delete_paths:
+        jobs.append(enqueue_job('delete_objects', {'paths': delete_paths}, commit=False, cost=len(delete_paths)))
+    if publish_ids:
+        jobs.append(enqueue_job('publish_images', {'image_ids': publish_ids}, commit=False, cost=len(publish_ids)))
+
+    return jobs
+
+
+def run_delete_job(job):
+    """Delete objects left behind by moderation decisions"""
+    failed = delete_images(job.payload.get('paths', []))
+    if failed:
+        raise Exception(f"Failed to delete {len(failed)} objects: {', '.join(failed[:10])}")
+
+
+def run_publish_job(job):
+    """Publish approved images under public/ and point their rows at the copies"""
+    images = Image.query.filter(Image.id.in_(job.payload.get('image_ids', [])), Image.status == 'approved').all()
+    db.session.commit()  # Don't hold a transaction open during the copies
+
+    stale = []
+    for image in images:
+        paths = [p for p in image.storage_paths() if not is_public_path(p)]
+        if not paths:
+            continue
+
+        published = publish_images(paths, f"public/{image.id}")
+
+        # Only if nothing changed meanwhile (rejected, deleted or already published)
+        updated = Image.query.filter_by(id=image.id, status='approved', file_path=image.file_path).update({
+            'file_path': published.get(image.file_path, image.file_path),
+            'thumbnail_path': published.get(image.thumbnail_path, image.thumbnail_path),
+            'variants': [dict(variant, path=published.get(variant['path'], variant['path']))
+                         for variant in image.variants or []]
+        }, synchronize_session=False)
+        if updated:
+            counters.gallery_changed()
+        db.session.commit()
+
+        stale += paths if updated else list(published.values())
+
+    failed = delete_images(stale)
+    if failed:
+        raise Exception(f"Published, but failed to delete {len(failed)} old objects: {', '.join(failed[:10])}")
+
+
+register_job_handler('delete_objects', run_delete_job)
+register_job_handler('publish_images', run_publish_job)
@@ -1,58 +1,59 @@
 """
 Neural Cartoon/Anime Style Transfer Processor
-Uses Google Gemini API with enhanced preprocessing for cartoon conversion
+Uses a remote stylization service (Gemini image generation) when configured,
+with enhanced CV preprocessing as the local fallback
 This provides much better segmentation results than traditional filters
 """
 
 import cv2
 import numpy as np
 from pathlib import Path
-import os
 from dotenv import load_dotenv
-from google import genai
 from PIL import Image
 
+try:
+    from app.image_loader import load_image
+    from app.remote_stylizer import get_remote_stylizer, RemoteStylizeError
+except ImportError:
+    # Running as a standalone script (python app/<module>.py)
+    from image_loader import load_image
+    from remote_stylizer import get_remote_stylizer, RemoteStylizeError
+
 # Load environment variables
 load_dotenv()
 
 
 class NeuralCartoonProcessor:
     """
-    Convert photos to cartoon/anime style using enhanced preprocessing
-    Gemini API is available but currently uses optimized CV preprocessing
+    Convert photos to cartoon/anime style
+    Uses the shared remote stylizer when REMOTE_STYLIZE_BACKEND is set,
+    falling back to optimized CV preprocessing on timeout or error
     """
     
-    def __init__(self, image_path, model_name='gemini-2.5-flash', api_key=None):
+    def __init__(self, image_path=None, image=None, max_size=None):
         """
         Initialize neural cartoon processor
         
+        The remote model and API key are configured process-wide from the
+        environment (GEMINI_IMAGE_MODEL, GOOGLE_API_KEY - see remote_stylizer).
+        
         Args:
             image_path: Path to input photo
-            model_name: Gemini model (default: 'gemini-2.5-flash' - free tier)
-            api_key: Google API key (or set GOOGLE_API_KEY env var)
+            image: Already-decoded RGB array (skips loading from image_path)
+            max_size: Longest side needed downstream; large JPEGs are decoded
+                      at reduced scale but never below it (None = full size)
         """
         self.image_path = image_path
-        self.model_name = model_name
         
         # Load image
-        self.original = cv2.imread(str(image_path))
-        if self.original is None:
-            raise ValueError(f"Could not load image: {image_path}")
-        self.original = cv2.cvtColor(self.original, cv2.COLOR_BGR2RGB)
-        
-        # Setup Gemini API client
-        if api_key is None:
-            api_key = os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY')
-        
-        if not api_key:
-            print("⚠️  Warning: No Gemini API key found. Will use enhanced preprocessing.")
-            self.client = None
+        if image is not None:
+            self.original = image
         else:
-            # Use new genai.Client() pattern
-            self.client = genai.Client(api_key=api_key)
-            print(f"Gemini client ready ({self.model_name})")
+            self.original = load_image(image_path, target_size=max_size)
         
+        # Remote client is pooled process-wide (see remote_stylizer), not per job
         self.stylized = None
+        self.used_remote = False
     
     def apply_enhanced_preprocessing(self):
         """
@@ -90,15 +91,47 @@ class NeuralCartoonProcessor:
         print("   ✅ Enhanced preprocessing complete!")
         return self.stylized
     
-    def process(self, use_neural=True):
+    def apply_remote_stylization(self, timeout=None):
         """
-        Process image (currently uses enhanced preprocessing)
+        Stylize via the remote service
         
         Args:
-            use_neural: Reserved for future Gemini image generation integration
+            timeout: Deadline in seconds (default: REMOTE_STYLIZE_TIMEOUT)
+        
+        Raises:
+            RemoteStylizeError: If remote stylization is disabled, times out or fails
         """
-        # For now, always use enhanced preprocessing
-        # Gemini text API doesn't generate images directly
+        stylizer = get_remote_stylizer()
+        if stylizer is None:
+            raise RemoteStylizeError("Remote stylization is not configured")
+        
+        print("Requesting remote stylization...")
+        result = stylizer.stylize(self.original, style='cartoon', timeout=timeout)
+        
+        # Keep the input geometry - the service may return a different size
+        height, width = self.original.shape[:2]
+        if result.shape[:2] != (height, width):
+            result = cv2.resize(result, (width, height), interpolation=cv2.INTER_AREA)
+        
+        self.stylized = result
+        self.used_remote = True
+        print("   ✅ Remote stylization complete!")
+        return self.stylized
+    
+    def process(self, use_neural=True, timeout=None):
+        """
+        Process image
+        
+        Args:
+            use_neural: Try remote stylization first (when configured)
+            timeout: Deadline in seconds for the remote call
+        """
+        if use_neural and get_remote_stylizer() is not None:
+            try:
+                return self.apply_remote_stylization(timeout=timeout)
+            except RemoteStylizeError as e:
+                print(f"⚠️  Remote stylization unavailable ({e}), using enhanced preprocessing")
+        
         return self.apply_enhanced_preprocessing()
     
     def save(self, output_path):
@@ -0,0 +1,140 @@
+"""
+Keyset (cursor) pagination for listings
+
+Listings are ordered by (timestamp, id), and the next page is fetched with
+WHERE (timestamp, id) < (last timestamp, last id) ... LIMIT n + 1 - one range
+scan of a composite index however far a client scrolls. OFFSET instead reads
+and throws away every earlier row, and the COUNT(*) it came with scanned the
+whole filtered set on every request.
+
+Clients get an opaque `next_cursor` and pass it back as ?cursor=. The exact
+total is only counted when asked for (?include_total=true). The old ?page=
+parameter still works (OFFSET, with total and pages) for existing clients.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+
+from app import db
+
+
+class InvalidPagination(ValueError):
+    """Pagination parameters the API can't use (answered with 400)"""
+
+
+class InvalidCursor(InvalidPagination):
+    """A ?cursor= that wasn't issued by this API"""
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque cursor pointing just past a row"""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Row key from a cursor
+
+    Returns:
+        tuple: (timestamp, id)
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), str(row_id)
+    except Exception:
+        raise InvalidCursor('Invalid cursor')
+
+
+def page_args(default_limit=20, max_limit=100):
+    """
+    Pagination parameters of the current request
+
+    Returns:
+        dict: limit, cursor, page (None unless the legacy ?page= is used)
+              and include_total
+
+    Raises:
+        InvalidPagination: If limit or page isn't a number
+    """
+    try:
+        limit = int(request.args.get('limit', default_limit))
+        page = int(request.args['page']) if request.args.get('page') else None
+    except ValueError:
+        raise InvalidPagination('limit and page must be numbers')
+
+    return {
+        'limit': max(1, min(limit, max_limit)),
+        'cursor': request.args.get('cursor') or None,
+        'page': max(1, page) if page else None,
+        'include_total': request.args.get('include_total', 'false').lower() in ('1', 'true', 'yes')
+    }
+
+
+def paginate(query, order_column, id_column, limit=20, cursor=None, page=None,
+             include_total=False, descending=True, count=None):
+    """
+    Fetch one page of query ordered by (order_column, id_column)
+
+    Args:
+        query: Filtered, unordered query
+        order_column: Timestamp column to order by (not nullable in the result set)
+        id_column: Primary key column - tie-breaker for equal timestamps
+        limit: Page size
+        cursor: next_cursor of the previous page (None = first page)
+        page: Legacy 1-based page number (uses OFFSET and always counts)
+        include_total: Also count all matching rows
+        descending: Newest first
+        count: Returns the total without scanning (e.g. from app.counters) -
+               default is COUNT(*) of query
+
+    Returns:
+        tuple: (rows, pagination dict with limit, has_more, next_cursor and -
+               when counted - total, plus page/pages for ?page= requests)
+
+    Raises:
+        InvalidCursor: If cursor is malformed
+    """
+    key = db.tuple_(order_column, id_column)
+    total = None
+    if include_total or (page and not cursor):
+        total = count() if count else query.order_by(None).count()
+
+    if descending:
+        ordered = query.order_by(order_column.desc(), id_column.desc())
+    else:
+        ordered = query.order_by(order_column.asc(), id_column.asc())
+
+    if cursor:
+        after = db.tuple_(*decode_cursor(cursor))
+        ordered = ordered.filter(key < after if descending else key > after)
+        page = None
+    elif page:
+        ordered = ordered.offset((page - 1) * limit)
+
+    rows = ordered.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    last = rows[-1] if rows and has_more else None
+    pagination = {
+        'limit': limit,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(getattr(last, order_column.key), getattr(last, id_column.key)) if last else None
+    }
+    if total is not None:
+        pagination['total'] = total
+    if page:
+        pagination.update({
+            'page': page,
+            'pages': (total + limit - 1) // limit
+        })
+
+    return rows, pagination
@@ -5,17 +5,25 @@ Creates very blocky, simple regions like cartoon illustrations
 import cv2
 import numpy as np
 
+try:
+    from app.image_loader import load_image
+except ImportError:
+    # Running as a standalone script (python app/<module>.py)
+    from image_loader import load_image
+
 class PetCartoonFilter:
     """
     Specialized cartoon filter for pet photos
     Creates fewer, larger, blockier regions similar to cartoon illustrations
     """
     
-    def __init__(self, image_path):
-        self.original = cv2.imread(image_path)
-        if self.original is None:
-            raise ValueError(f"Could not load image: {image_path}")
-        self.original = cv2.cvtColor(self.original, cv2.COLOR_BGR2RGB)
+    def __init__(self, image_path=None, image=None, max_size=None):
+        if image is not None:
+            # Already-decoded RGB array (e.g. shared by style previews)
+            self.original = image
+        else:
+            # Large JPEGs are decoded at reduced scale, never below max_size
+            self.original = load_image(image_path, target_size=max_size)
         self.stylized = None
     
     def apply_pet_cartoon(self):
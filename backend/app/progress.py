@@ -0,0 +1,210 @@
+"""
+Job progress tracking
+
+Each canvas job records the pipeline stage it is in on its `jobs` row, and
+publishes the change on an in-process broker so server-sent-event and
+long-poll requests waiting on that project wake up immediately. Waiters also
+re-read the database every PROGRESS_POLL_INTERVAL seconds, which covers jobs
+running in another process or instance.
+"""
+
+import os
+import threading
+from datetime import datetime
+
+from app import app, db
+from app.models import ColoringProject, Job, CanvasResult
+
+
+# Pipeline stages in order (progress percent = position in this list)
+PIPELINE_STAGES = ('decode', 'stylize', 'quantize', 'simplify', 'merge', 'extract', 'upload')
+
+# Seconds between database re-checks while waiting for a change
+PROGRESS_POLL_INTERVAL = float(os.getenv('PROGRESS_POLL_INTERVAL', 2))
+
+# Requests per process that may wait for changes at once (SSE streams and
+# long-polls). Each holds a server thread, so this stays below the thread
+# count (gunicorn --threads 8) and leaves the rest for other API calls
+PROGRESS_MAX_WAITERS = int(os.getenv('PROGRESS_MAX_WAITERS', 4))
+
+_waiter_slots = threading.BoundedSemaphore(max(1, PROGRESS_MAX_WAITERS))
+
+
+def acquire_waiter_slot():
+    """Take a waiting-request slot without blocking (False if all are in use)"""
+    return _waiter_slots.acquire(blocking=False)
+
+
+def release_waiter_slot():
+    _waiter_slots.release()
+
+
+class _Topic:
+    """Change counter and waiters of one project"""
+
+    def __init__(self, lock):
+        self.version = 0
+        self.waiters = 0
+        self.cond = threading.Condition(lock)
+
+
+class ProgressBroker:
+    """
+    In-process notification of project status/stage changes
+
+    Each project has its own condition (all sharing one lock), so a publish
+    only wakes that project's waiters. A project's entry is dropped when it
+    reaches a final status, or when its last waiter leaves before anything
+    was published, so finished projects don't pile up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+
+    def version(self, project_id):
+        """Current change counter for a project"""
+        with self._lock:
+            topic = self._topics.get(project_id)
+            return topic.version if topic else 0
+
+    def publish(self, project_id, final=False):
+        """
+        Signal that a project's status or stage changed
+
+        Args:
+            project_id: Project that changed
+            final: The project reached a final status - forget it afterwards
+        """
+        with self._lock:
+            topic = self._topics.get(project_id)
+            if topic is None:
+                if final:
+                    return  # Nobody here is following it
+                topic = self._topics[project_id] = _Topic(self._lock)
+            topic.version += 1
+            topic.cond.notify_all()
+            if final:
+                del self._topics[project_id]
+
+    def wait(self, project_id, version, timeout):
+        """
+        Wait until the project's counter moves past version
+
+        Returns:
+            bool: True if changed, False on timeout
+        """
+        with self._lock:
+            topic = self._topics.get(project_id)
+            if topic is None:
+                if version:
+                    return True  # Finished (and forgotten) since version was read
+                topic = self._topics[project_id] = _Topic(self._lock)
+
+            topic.waiters += 1
+            try:
+                return topic.cond.wait_for(lambda: topic.version != version, timeout)
+            finally:
+                topic.waiters -= 1
+                if not topic.waiters and not topic.version and self._topics.get(project_id) is topic:
+                    del self._topics[project_id]
+
+    def __len__(self):
+        """Projects currently tracked"""
+        with self._lock:
+            return len(self._topics)
+
+
+broker = ProgressBroker()
+
+
+def stage_progress(stage):
+    """Percent complete at the start of a stage"""
+    if stage not in PIPELINE_STAGES:
+        return 0
+    return int(100 * PIPELINE_STAGES.index(stage) / len(PIPELINE_STAGES))
+
+
+def record_stage(job_id, project_id, stage):
+    """
+    Record that a job entered a pipeline stage and notify waiters
+
+    Safe to call from any thread (uses its own app context). Stages never
+    move backwards, so a late report from a worker process is ignored.
+    """
+    if job_id:
+        try:
+            with app.app_context():
+                job = db.session.get(Job, job_id)
+                if job and (job.stage not in PIPELINE_STAGES or
+                            PIPELINE_STAGES.index(stage) > PIPELINE_STAGES.index(job.stage)):
+                    job.stage = stage
+                    job.progress = stage_progress(stage)
+                    job.stage_started_at = datetime.utcnow()
+                    db.session.commit()
+        except Exception as e:
+            print(f"⚠️  Could not record stage {stage} for {job_id}: {e}")
+
+    print(f"   [{project_id}] stage: {stage}")
+    broker.publish(project_id)
+
+
+def publish_status(project_id):
+    """Notify waiters that a project reached a final status (completed, failed, cancelled or deleted)"""
+    broker.publish(project_id, final=True)
+
+
+def get_project_snapshot(project_id, user_id):
+    """
+    Lightweight status of a project (no template_data, no signed URLs)
+
+    Ends the session's transaction afterwards so the next call sees fresh data.
+
+    Returns:
+        dict or None if the project doesn't exist
+    """
+    try:
+        row = db.session.query(
+            ColoringProject.status, ColoringProject.error_message, ColoringProject.updated_at,
+            ColoringProject.result_key
+        ).filter_by(id=project_id, user_id=user_id).first()
+
+        if row is None:
+            return None
+
+        job = db.session.query(Job.stage, Job.progress, Job.status)\
+                        .filter_by(project_id=project_id)\
+                        .order_by(Job.created_at.desc())\
+                        .first()
+
+        # Project waiting on another upload's job for the same image
+        if job is None and row.result_key and row.status == 'processing':
+            leader = db.session.query(CanvasResult.job_id).filter_by(key=row.result_key).scalar_subquery()
+            job = db.session.query(Job.stage, Job.progress, Job.status).filter(Job.id == leader).first()
+    finally:
+        db.session.rollback()
+
+    status, error_message, updated_at, _ = row
+    stage = job.stage if job else None
+    progress = job.progress if job and job.progress else 0
+
+    if status == 'processing' and job and job.status == 'queued':
+        stage = 'queued'
+    if status == 'completed':
+        progress = 100
+
+    return {
+        'project_id': project_id,
+        'status': status,
+        'stage': stage,
+        'progress': progress,
+        'error_message': error_message,
+        'updated_at': updated_at.isoformat() + 'Z' if updated_at else None
+    }
+
+
+def snapshot_version(snapshot):
+    """Opaque token identifying a snapshot's state (for long-poll `since`)"""
+    if snapshot is None:
+        return 'deleted'
+    return f"{snapshot['status']}:{snapshot['stage']}:{snapshot['progress']}"
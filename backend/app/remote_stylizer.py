@@ -0,0 +1,331 @@
+"""
+Remote stylization client
+
+Calls a remote image-to-image service (Gemini image generation, or any HTTP
+endpoint that takes a PNG and returns a PNG) without letting it stall the
+processing workers:
+
+- One process-wide client (genai.Client / pooled requests.Session)
+- Per-call deadline - the caller never waits longer than the timeout
+- Semaphore bounding how many remote calls are in flight at once
+- Content-hash result cache on local disk (same image + style = no call)
+
+Callers get a RemoteStylizeError on timeout/overload/failure and are expected
+to fall back to local preprocessing.
+
+Configuration (env):
+    REMOTE_STYLIZE_BACKEND          '' (disabled), 'http' or 'gemini'
+    REMOTE_STYLIZE_URL              Endpoint for the 'http' backend
+    REMOTE_STYLIZE_TIMEOUT          Per-call deadline in seconds (default 20)
+    REMOTE_STYLIZE_MAX_CONCURRENCY  Max in-flight remote calls (default 2)
+    REMOTE_STYLIZE_CACHE_DIR        Result cache directory (default ./cache/stylize)
+    GEMINI_IMAGE_MODEL              Model for the 'gemini' backend
+"""
+
+import os
+import io
+import hashlib
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+# Bump when prompts/request format change so stale cache entries are ignored
+STYLIZE_PROTOCOL_VERSION = 1
+
+STYLE_PROMPTS = {
+    'cartoon': (
+        "Redraw this photo as a flat-color cartoon illustration with bold, clean "
+        "outlines and large uniform color regions. Keep the composition and subject "
+        "identical. No text, no gradients, no texture."
+    ),
+}
+
+DEFAULT_GEMINI_IMAGE_MODEL = 'gemini-2.5-flash-image'
+
+
+class RemoteStylizeError(Exception):
+    """Remote stylization failed, timed out or was rejected (caller should fall back)"""
+
+
+# Process-wide clients, created lazily
+_client_lock = threading.Lock()
+_genai_client = None
+_http_session = None
+_stylizer = None
+
+
+def get_genai_client(api_key=None, timeout=None):
+    """
+    Get the process-wide Gemini client (created on first use)
+
+    Args:
+        api_key: Google API key (or set GOOGLE_API_KEY / GEMINI_API_KEY env var)
+        timeout: Per-request timeout in seconds, so a hung call gives up its
+                 concurrency slot (default: REMOTE_STYLIZE_TIMEOUT)
+
+    Returns:
+        genai.Client or None if no API key is configured
+    """
+    global _genai_client
+
+    if _genai_client is None:
+        with _client_lock:
+            if _genai_client is None:
+                api_key = api_key or os.getenv('GOOGLE_API_KEY') or os.getenv('GEMINI_API_KEY')
+                if not api_key:
+                    return None
+                from google import genai
+                from google.genai import types
+                timeout = timeout or float(os.getenv('REMOTE_STYLIZE_TIMEOUT', 20))
+                _genai_client = genai.Client(
+                    api_key=api_key,
+                    http_options=types.HttpOptions(timeout=int(timeout * 1000))  # Milliseconds
+                )
+
+    return _genai_client
+
+
+def get_http_session(pool_size=None):
+    """Get the process-wide pooled HTTP session"""
+    global _http_session
+
+    if _http_session is None:
+        with _client_lock:
+            if _http_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                pool_size = pool_size or int(os.getenv('REMOTE_STYLIZE_MAX_CONCURRENCY', 2))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _http_session = session
+
+    return _http_session
+
+
+def encode_png(image_rgb):
+    """Encode RGB array as PNG bytes"""
+    ok, encoded = cv2.imencode('.png', cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise RemoteStylizeError("Could not encode image")
+    return encoded.tobytes()
+
+
+def decode_image(data):
+    """Decode image bytes to RGB array"""
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise RemoteStylizeError("Remote service returned an undecodable image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+class RemoteStylizer:
+    """
+    Bounded, cached, deadline-aware client for a remote stylization service
+    """
+
+    def __init__(self, backend='http', url=None, model_name=DEFAULT_GEMINI_IMAGE_MODEL,
+                 timeout=20.0, max_concurrency=2, cache_dir=None):
+        """
+        Initialize remote stylizer
+
+        Args:
+            backend: 'http' (POST PNG to url) or 'gemini'
+            url: Endpoint for the 'http' backend
+            model_name: Gemini image model for the 'gemini' backend
+            timeout: Per-call deadline in seconds
+            max_concurrency: Max remote calls in flight
+            cache_dir: Result cache directory (None = no cache)
+        """
+        if backend not in ('http', 'gemini'):
+            raise ValueError(f"Unknown remote stylize backend: {backend}")
+        if backend == 'http' and not url:
+            raise ValueError("REMOTE_STYLIZE_URL is required for the http backend")
+
+        self.backend = backend
+        self.url = url
+        self.model_name = model_name
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.cache_dir = cache_dir
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # Held for the whole remote call - released by the call itself, so a
+        # caller that gives up on a hung request doesn't free its slot early
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                            thread_name_prefix='remote-stylize')
+
+        self.stats = {'calls': 0, 'cache_hits': 0, 'timeouts': 0, 'rejected': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def cache_key(self, png_bytes, style):
+        """Content hash of input image + everything that affects the output"""
+        digest = hashlib.sha256()
+        digest.update(png_bytes)
+        digest.update(f"|{self.backend}|{self.model_name}|{style}|v{STYLIZE_PROTOCOL_VERSION}".encode())
+        return digest.hexdigest()
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.png")
+
+    def _cache_get(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._cache_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Keep recently used entries fresh for cleanup
+            return data
+        except OSError:
+            return None
+
+    def _cache_put(self, key, data):
+        if not self.cache_dir:
+            return
+        path = self._cache_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Atomic write so concurrent readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  Could not write stylize cache entry: {e}")
+
+    def _call(self, png_bytes, style):
+        """Perform the remote call (runs on the executor, releases its slot)"""
+        try:
+            if self.backend == 'http':
+                return self._call_http(png_bytes, style)
+            return self._call_gemini(png_bytes, style)
+        finally:
+            self._slots.release()
+
+    def _call_http(self, png_bytes, style):
+        response = get_http_session(self.max_concurrency).post(
+            self.url,
+            data=png_bytes,
+            params={'style': style},
+            headers={'Content-Type': 'image/png'},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.content
+
+    def _call_gemini(self, png_bytes, style):
+        from PIL import Image
+
+        client = get_genai_client(timeout=self.timeout)
+        if client is None:
+            raise RemoteStylizeError("No Gemini API key configured")
+
+        response = client.models.generate_content(
+            model=self.model_name,
+            contents=[STYLE_PROMPTS.get(style, STYLE_PROMPTS['cartoon']), Image.open(io.BytesIO(png_bytes))]
+        )
+
+        for candidate in response.candidates or []:
+            content = getattr(candidate, 'content', None)
+            for part in (content.parts if content else None) or []:
+                if getattr(part, 'inline_data', None) and part.inline_data.data:
+                    return part.inline_data.data
+
+        raise RemoteStylizeError("Gemini response contained no image")
+
+    def stylize(self, image_rgb, style='cartoon', timeout=None):
+        """
+        Stylize an image remotely
+
+        Args:
+            image_rgb: Input RGB array
+            style: Style name (selects the prompt)
+            timeout: Deadline in seconds for this call (default: self.timeout)
+
+        Returns:
+            ndarray: Stylized RGB image
+
+        Raises:
+            RemoteStylizeError: On timeout, overload or remote failure
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+
+        png_bytes = encode_png(image_rgb)
+        key = self.cache_key(png_bytes, style)
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            self._count('cache_hits')
+            return decode_image(cached)
+
+        # Wait for a free slot, but never past the deadline
+        if not self._slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            self._count('rejected')
+            raise RemoteStylizeError("Too many remote stylize calls in flight")
+
+        self._count('calls')
+        try:
+            future = self._executor.submit(self._call, png_bytes, style)
+        except Exception as e:
+            self._slots.release()
+            self._count('errors')
+            raise RemoteStylizeError(f"Could not start remote call: {e}")
+
+        try:
+            data = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            self._count('timeouts')
+            raise RemoteStylizeError("Remote stylize call timed out")
+        except RemoteStylizeError:
+            self._count('errors')
+            raise
+        except Exception as e:
+            self._count('errors')
+            raise RemoteStylizeError(f"Remote stylize call failed: {e}")
+
+        result = decode_image(data)
+        self._cache_put(key, data)
+        return result
+
+
+def get_remote_stylizer():
+    """
+    Get the process-wide remote stylizer configured from the environment
+
+    Returns:
+        RemoteStylizer or None if REMOTE_STYLIZE_BACKEND is not set
+    """
+    global _stylizer
+
+    backend = os.getenv('REMOTE_STYLIZE_BACKEND', '').strip().lower()
+    if not backend:
+        return None
+
+    if _stylizer is None:
+        with _client_lock:
+            if _stylizer is None:
+                _stylizer = RemoteStylizer(
+                    backend=backend,
+                    url=os.getenv('REMOTE_STYLIZE_URL'),
+                    model_name=os.getenv('GEMINI_IMAGE_MODEL', DEFAULT_GEMINI_IMAGE_MODEL),
+                    timeout=float(os.getenv('REMOTE_STYLIZE_TIMEOUT', 20)),
+                    max_concurrency=int(os.getenv('REMOTE_STYLIZE_MAX_CONCURRENCY', 2)),
+                    cache_dir=os.getenv('REMOTE_STYLIZE_CACHE_DIR',
+                                        os.path.join(os.getcwd(), 'cache', 'stylize'))
+                )
+
+    return _stylizer
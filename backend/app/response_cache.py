@@ -0,0 +1,140 @@
+"""
+Response cache for the public gallery
+
+/api/gallery is public and read-heavy but only changes when moderation does.
+Rendered pages are cached under their ETag (app.http_cache), which already
+covers everything the body depends on:
+
+- the gallery generation (app.counters), bumped in the same transaction as
+  every approve/reject/delete touching an approved image, so a decision
+  invalidates all cached pages at once on every instance
+- the query (sort, cursor/page, limit, width, format)
+- the signed-URL epoch, so a cached body never outlives its URLs
+
+Entries for old generations are simply never asked for again and age out.
+
+Every process keeps an LRU of GALLERY_CACHE_SIZE pages. With
+GALLERY_CACHE_URL (redis://...) pages are also shared between instances
+through Redis (needs the `redis` package); a page rendered on one instance is
+then served by all of them.
+
+Hit rate is in app.metrics as gallery_cache_total{result}.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from app import metrics
+
+
+class MemoryCache:
+    """Bounded in-process LRU"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisCache:
+    """Cache shared by all instances (entries expire after their TTL)"""
+
+    def __init__(self, url, prefix='gallery:'):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+
+class ResponseCache:
+    """In-process LRU in front of an optional shared cache"""
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        """Cached bytes for key, or None"""
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                print(f"⚠️  Shared gallery cache unavailable: {e}")
+            if value is not None:
+                self.local.set(key, value)
+
+        metrics.inc('gallery_cache_total', result='hit' if value is not None else 'miss')
+        return value
+
+    def set(self, key, value, ttl):
+        """Remember bytes for key (ttl: seconds they stay valid)"""
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                print(f"⚠️  Shared gallery cache unavailable: {e}")
+
+    def stats(self):
+        """Entries in this process and hit rate"""
+        counts = {c['labels']['result']: c['value'] for c in metrics.snapshot()['counters']
+                  if c['name'] == 'gallery_cache_total'}
+        hits, misses = counts.get('hit', 0), counts.get('miss', 0)
+        return {
+            'size': len(self.local),
+            'shared': self.shared is not None,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None
+        }
+
+
+_gallery_cache = None
+_gallery_cache_lock = threading.Lock()
+
+
+def get_gallery_cache():
+    """Process-wide gallery cache configured from env"""
+    global _gallery_cache
+
+    if _gallery_cache is None:
+        with _gallery_cache_lock:
+            if _gallery_cache is None:
+                url = os.getenv('GALLERY_CACHE_URL')
+                _gallery_cache = ResponseCache(
+                    MemoryCache(int(os.getenv('GALLERY_CACHE_SIZE', 256))),
+                    RedisCache(url) if url else None
+                )
+
+    return _gallery_cache
@@ -1,19 +1,32 @@
 """
 API routes and endpoints
 """
-from flask import request, jsonify
+from flask import request, jsonify, send_file
 from app import app, db
-from app.models import Image
+from app.models import Image, Job
+from app.jobs import notify_workers
+from app import metrics
 from app.auth import require_auth, require_admin, get_user_from_token
-from app.storage import upload_image, upload_thumbnail, delete_image, get_image_metadata
+from app.storage import (upload_async, delete_image, delete_images, generate_signed_urls,
+                         signed_url_cache_stats, signed_url_epoch_seconds, get_backend, PUBLIC_CACHE_CONTROL)
+from app.storage_backends import LocalBackend
+from app.ingest import read_metadata, derive_images, variant_outputs, THUMBNAIL_SIZE
+from app import moderation, counters
+from app.pagination import page_args, paginate, InvalidPagination
+from app.http_cache import make_etag, not_modified, with_validators
+from app.response_cache import get_gallery_cache
 from werkzeug.utils import secure_filename
 from datetime import datetime
-import os
+import mimetypes
+import time
 import uuid
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
 
+# Decisions accepted by one /api/admin/moderate call
+MAX_MODERATION_BATCH = 500
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -27,6 +40,26 @@ def sanitize_input(text, max_length=255):
     text = re.sub(r'<[^>]+>', '', text)
     return text[:max_length].strip()
 
+def display_options():
+    """
+    Display width and preferred variant format requested by the client
+    
+    ?width=<px> asks for the smallest variant at least that wide; the format
+    comes from ?format=jpeg|webp, else WebP if the Accept header allows it.
+    Invalid values are ignored, like a missing parameter.
+    
+    Returns:
+        tuple: (width or None, 'jpeg' or 'webp')
+    """
+    width = request.args.get('width', '')
+    width = int(width) if width.isdigit() and int(width) > 0 else None
+    
+    image_format = request.args.get('format', '').lower()
+    if image_format not in ('jpeg', 'webp'):
+        image_format = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    
+    return width, image_format
+
 @app.route('/api/upload', methods=['POST'])
 @require_auth
 def upload():
@@ -54,9 +87,12 @@ def upload():
         title = sanitize_input(request.form.get('title', ''))
         description = sanitize_input(request.form.get('description', ''), max_length=1000)
         
+        # Read the body once - everything below works from this buffer
+        data = file.read()
+        
         # Validate image
         try:
-            metadata = get_image_metadata(file)
+            metadata = read_metadata(data)
             
             # Check minimum dimensions
             if metadata['width'] < 200 or metadata['height'] < 200:
@@ -69,16 +105,46 @@ def upload():
         image_id = f"img_{uuid.uuid4().hex[:12]}"
         file_name = f"{image_id}.{file_ext}"
         
-        # Upload paths
-        file_path = f"pending/{user_id}/{file_name}"
-        thumbnail_path = f"pending/{user_id}/thumb_{file_name}"
+        # Upload paths - these don't change on approval (see app.moderation)
+        file_path = f"images/{user_id}/{file_name}"
+        thumbnail_path = f"images/{user_id}/thumb_{file_name}"
         
-        # Upload image and thumbnail
+        # Upload image, thumbnail and responsive variants - the original uploads
+        # while the others are made (all from one decode)
+        original_upload = upload_async(data, file_path, file.content_type or 'image/jpeg')
+        outputs = variant_outputs(metadata['width'], metadata['height'])
+        outputs['thumbnail'] = (THUMBNAIL_SIZE, 'JPEG')
         try:
-            upload_image(file, file_path)
-            upload_thumbnail(file, thumbnail_path)
-        except Exception as e:
-            return jsonify({'error': f'Failed to upload image: {str(e)}'}), 500
+            derived = derive_images(data, outputs)
+        except ValueError as e:
+            # Header was fine but the pixels aren't - don't keep the original
+            original_upload.add_done_callback(lambda f: f.exception() is None and delete_image(file_path))
+            return jsonify({'error': f'Invalid image file: {str(e)}'}), 400
+        
+        thumbnail = derived.pop('thumbnail')
+        variants = []
+        uploads = [original_upload, upload_async(thumbnail['data'], thumbnail_path, thumbnail['content_type'])]
+        for name, variant in sorted(derived.items(), key=lambda item: (item[1]['width'], item[0])):
+            path = f"images/{user_id}/{image_id}_{name}"
+            uploads.append(upload_async(variant['data'], path, variant['content_type']))
+            variants.append({
+                'width': variant['width'],
+                'height': variant['height'],
+                'format': variant['format'].lower(),
+                'path': path
+            })
+        
+        # Wait for every upload; if any failed, queue the ones that made it for deletion
+        errors = [upload.exception() for upload in uploads]
+        if any(errors):
+            paths = [file_path, thumbnail_path] + [variant['path'] for variant in variants]
+            stored = [path for path, error in zip(paths, errors) if error is None]
+            if stored:
+                moderation.queue_reconcile(delete_paths=stored)
+                db.session.commit()
+                notify_workers()
+            error = next(error for error in errors if error)
+            return jsonify({'error': str(error)}), 500
         
         # Create database record
         image = Image(
@@ -91,6 +157,7 @@ def upload():
             status='pending',
             file_path=file_path,
             thumbnail_path=thumbnail_path,
+            variants=variants,
             mime_type=file.content_type,
             file_size=request.content_length,
             width=metadata['width'],
@@ -98,6 +165,7 @@ def upload():
         )
         
         db.session.add(image)
+        counters.image_added(image)
         db.session.commit()
         
         return jsonify({
@@ -121,8 +189,7 @@ def get_user_uploads():
         
         # Get query parameters
         status = request.args.get('status', None)
-        page = int(request.args.get('page', 1))
-        limit = min(int(request.args.get('limit', 20)), 100)
+        width, image_format = display_options()
         
         # Build query
         query = Image.query.filter_by(user_id=user_id)
@@ -130,25 +197,26 @@ def get_user_uploads():
         if status:
             query = query.filter_by(status=status)
         
-        # Get total count
-        total = query.count()
-        
         # Paginate
-        images = query.order_by(Image.uploaded_at.desc())\
-                     .offset((page - 1) * limit)\
-                     .limit(limit)\
-                     .all()
+        # Totals come from the materialized counters, not COUNT(*)
+        statuses = [status] if status else counters.IMAGE_STATUSES
+        images, pagination = paginate(
+            query, Image.uploaded_at, Image.id,
+            count=lambda: counters.get(*(counters.image_key(s, user_id) for s in statuses)),
+            **page_args()
+        )
+        
+        # Sign the whole page in one batch
+        urls = generate_signed_urls(p for img in images for p in img.signed_paths(width, image_format))
         
         return jsonify({
-            'images': [img.to_dict(include_urls=True) for img in images],
-            'pagination': {
-                'page': page,
-                'limit': limit,
-                'total': total,
-                'pages': (total + limit - 1) // limit
-            }
+            'images': [img.to_dict(include_urls=True, width=width, image_format=image_format, urls=urls)
+                       for img in images],
+            'pagination': pagination
         }), 200
         
+    except InvalidPagination as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -156,36 +224,46 @@ def get_user_uploads():
 def get_gallery():
     """Get approved images for public gallery"""
     try:
+        # Unchanged since the client's copy? (generation moves on every approve/reject/delete)
+        generation, changed_at = counters.read(counters.GALLERY_GENERATION)
+        etag = make_etag('gallery', generation, sorted(request.args.items()), display_options())
+        cached = not_modified(etag, changed_at, private=False)
+        if cached:
+            return cached
+        
+        # Rendered already (here or, with a shared cache, on another instance)?
+        gallery_cache = get_gallery_cache()
+        body = gallery_cache.get(etag)
+        if body is not None:
+            response = app.response_class(body, mimetype='application/json')
+            return with_validators(response, etag, changed_at, private=False), 200
+        
         # Get query parameters
-        page = int(request.args.get('page', 1))
-        limit = min(int(request.args.get('limit', 20)), 100)
+        width, image_format = display_options()
         sort = request.args.get('sort', 'newest')
         
         # Build query
         query = Image.query.filter_by(status='approved')
         
-        # Sort
-        if sort == 'oldest':
-            query = query.order_by(Image.uploaded_at.asc())
-        else:  # newest (default)
-            query = query.order_by(Image.uploaded_at.desc())
-        
-        # Get total count
-        total = query.count()
-        
-        # Paginate
-        images = query.offset((page - 1) * limit).limit(limit).all()
-        
-        return jsonify({
-            'images': [img.to_public_dict() for img in images],
-            'pagination': {
-                'page': page,
-                'limit': limit,
-                'total': total,
-                'pages': (total + limit - 1) // limit
-            }
-        }), 200
-        
+        # Paginate (newest first by default)
+        images, pagination = paginate(query, Image.uploaded_at, Image.id,
+                                      descending=sort != 'oldest',
+                                      count=lambda: counters.get(counters.image_key('approved')),
+                                      **page_args())
+        
+        # Sign the whole page in one batch
+        urls = generate_signed_urls(p for img in images for p in img.signed_paths(width, image_format))
+        
+        response = jsonify({
+            'images': [img.to_public_dict(width=width, image_format=image_format, urls=urls)
+                       for img in images],
+            'pagination': pagination
+        })
+        gallery_cache.set(etag, response.get_data(), ttl=signed_url_epoch_seconds())
+        return with_validators(response, etag, changed_at, private=False), 200
+        
+    except InvalidPagination as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -214,7 +292,18 @@ def get_image(image_id):
             else:
                 return jsonify({'error': 'Access forbidden'}), 403
         
-        return jsonify(image.to_dict(include_urls=True)), 200
+        # Changes with moderation (status, reviewed_at) and publishing (file paths)
+        width, image_format = display_options()
+        etag = make_etag('image', image.id, image.status, image.reviewed_at, image.file_path, width, image_format)
+        last_modified = image.reviewed_at or image.uploaded_at
+        private = image.status != 'approved'
+        
+        cached = not_modified(etag, last_modified, private=private)
+        if cached:
+            return cached
+        
+        response = jsonify(image.to_dict(include_urls=True, width=width, image_format=image_format))
+        return with_validators(response, etag, last_modified, private=private), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -237,11 +326,11 @@ def delete_user_image(image_id):
         if image.user_id != user_id and not is_admin:
             return jsonify({'error': 'Access forbidden'}), 403
         
-        # Delete from storage
-        delete_image(image.file_path)
-        delete_image(image.thumbnail_path)
+        # Delete from storage (one batch)
+        delete_images(image.storage_paths())
         
         # Delete from database
+        counters.image_removed(image)
         db.session.delete(image)
         db.session.commit()
         
@@ -260,26 +349,71 @@ def get_pending_images():
     """Get pending images for admin approval"""
     try:
         # Get query parameters
-        page = int(request.args.get('page', 1))
-        limit = min(int(request.args.get('limit', 20)), 100)
+        width, image_format = display_options()
         
-        # Query pending images
+        # Query pending images, oldest first
         query = Image.query.filter_by(status='pending')
-        total = query.count()
+        images, pagination = paginate(query, Image.uploaded_at, Image.id, descending=False,
+                                      count=lambda: counters.get(counters.image_key('pending')),
+                                      **page_args())
+        
+        # Sign the whole page in one batch
+        urls = generate_signed_urls(p for img in images for p in img.signed_paths(width, image_format))
+        
+        return jsonify({
+            'images': [img.to_dict(include_urls=True, width=width, image_format=image_format, urls=urls)
+                       for img in images],
+            'pagination': pagination
+        }), 200
+        
+    except InvalidPagination as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/metrics', methods=['GET'])
+@require_admin
+def get_metrics():
+    """Processing metrics: job queue depth (all instances) and this instance's latency histograms"""
+    try:
+        now = datetime.utcnow()
+        rows = db.session.query(Job.kind, Job.user_class, db.func.count(Job.id), db.func.min(Job.created_at))\
+                         .filter(Job.status == 'queued')\
+                         .group_by(Job.kind, Job.user_class)\
+                         .all()
+        
+        queue = [{
+            'kind': kind,
+            'user_class': user_class,
+            'queued': count,
+            'oldest_wait_seconds': round((now - oldest).total_seconds(), 1) if oldest else None
+        } for kind, user_class, count, oldest in rows]
+        
+        return jsonify({
+            'queue': queue,
+            'signed_url_cache': signed_url_cache_stats(),
+            'gallery_cache': get_gallery_cache().stats(),
+            **metrics.snapshot()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/stats', methods=['GET'])
+@require_admin
+def get_stats():
+    """Gallery and coloring totals (from the materialized counters - no table scans)"""
+    try:
+        image_keys = {status: counters.image_key(status) for status in counters.IMAGE_STATUSES}
+        values = counters.get_many([*image_keys.values(), counters.project_key(), counters.completed_key()])
         
-        images = query.order_by(Image.uploaded_at.asc())\
-                     .offset((page - 1) * limit)\
-                     .limit(limit)\
-                     .all()
+        images = {status: values[key] for status, key in image_keys.items()}
+        images['total'] = sum(images.values())
         
         return jsonify({
-            'images': [img.to_dict(include_urls=True) for img in images],
-            'pagination': {
-                'page': page,
-                'limit': limit,
-                'total': total,
-                'pages': (total + limit - 1) // limit
-            }
+            'images': images,
+            'coloring_projects': values[counters.project_key()],
+            'completed_colorings': values[counters.completed_key()]
         }), 200
         
     except Exception as e:
@@ -293,38 +427,21 @@ def approve_image(image_id):
         user = get_user_from_token()
         admin_id = user['uid']
         
-        image = Image.query.get(image_id)
+        # Locked until commit - concurrent decisions on one image apply one at a time
+        image = db.session.get(Image, image_id, with_for_update=True)
         
         if not image:
             return jsonify({'error': 'Image not found'}), 404
         
-        if image.status == 'approved':
-            return jsonify({'error': 'Image already approved'}), 400
-        
-        # Move files from pending to approved
-        new_file_path = image.file_path.replace('pending/', 'approved/')
-        new_thumbnail_path = image.thumbnail_path.replace('pending/', 'approved/')
-        
-        # Update in storage (copy and delete old)
-        from google.cloud import storage
-        bucket = storage.Client(project=os.getenv('PROJECT_ID')).bucket(os.getenv('BUCKET_NAME'))
-        
-        # Copy files
-        bucket.copy_blob(bucket.blob(image.file_path), bucket, new_file_path)
-        bucket.copy_blob(bucket.blob(image.thumbnail_path), bucket, new_thumbnail_path)
-        
-        # Delete old files
-        delete_image(image.file_path)
-        delete_image(image.thumbnail_path)
-        
-        # Update database
-        image.status = 'approved'
-        image.file_path = new_file_path
-        image.thumbnail_path = new_thumbnail_path
-        image.reviewed_at = datetime.utcnow()
-        image.reviewed_by = admin_id
+        # Status change only - storage is reconciled in the background
+        try:
+            publish_ids = moderation.approve(image, admin_id)
+        except moderation.ModerationError as e:
+            return jsonify({'error': str(e)}), 400
+        moderation.queue_reconcile(publish_ids=publish_ids)
         
         db.session.commit()
+        notify_workers()
         
         return jsonify({
             'success': True,
@@ -344,7 +461,8 @@ def reject_image(image_id):
         user = get_user_from_token()
         admin_id = user['uid']
         
-        image = Image.query.get(image_id)
+        # Locked until commit - concurrent decisions on one image apply one at a time
+        image = db.session.get(Image, image_id, with_for_update=True)
         
         if not image:
             return jsonify({'error': 'Image not found'}), 404
@@ -353,18 +471,11 @@ def reject_image(image_id):
         data = request.get_json() or {}
         reason = sanitize_input(data.get('reason', ''), max_length=500)
         
-        # Delete from storage
-        delete_image(image.file_path)
-        delete_image(image.thumbnail_path)
-        
-        # Update database
-        image.status = 'rejected'
-        image.reviewed_at = datetime.utcnow()
-        image.reviewed_by = admin_id
-        if reason:
-            image.description = f"[REJECTED: {reason}]"
+        # Status change only - files are deleted in the background
+        moderation.queue_reconcile(delete_paths=moderation.reject(image, admin_id, reason))
         
         db.session.commit()
+        notify_workers()
         
         return jsonify({
             'success': True,
@@ -375,3 +486,101 @@ def reject_image(image_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/moderate', methods=['POST'])
+@require_admin
+def moderate_images():
+    """Approve/reject many images in one transaction"""
+    try:
+        user = get_user_from_token()
+        admin_id = user['uid']
+        
+        data = request.get_json() or {}
+        decisions = data.get('decisions')
+        
+        if not isinstance(decisions, list) or not decisions:
+            return jsonify({'error': 'decisions must be a non-empty list'}), 400
+        if len(decisions) > MAX_MODERATION_BATCH:
+            return jsonify({'error': f'At most {MAX_MODERATION_BATCH} decisions per request'}), 400
+        
+        ids = [d.get('image_id') for d in decisions if isinstance(d, dict)]
+        images = {img.id: img for img in Image.query.filter(Image.id.in_([i for i in ids if i]))
+                                                     .order_by(Image.id)
+                                                     .with_for_update()
+                                                     .all()}
+        
+        results = []
+        delete_paths, publish_ids = [], []
+        for item in decisions:
+            item = item if isinstance(item, dict) else {}
+            image_id = item.get('image_id')
+            decision = item.get('decision')
+            image = images.get(image_id)
+            
+            if decision not in ('approve', 'reject'):
+                results.append({'image_id': image_id, 'success': False, 'error': "decision must be 'approve' or 'reject'"})
+                continue
+            if not image:
+                results.append({'image_id': image_id, 'success': False, 'error': 'Image not found'})
+                continue
+            
+            try:
+                if decision == 'approve':
+                    publish_ids += moderation.approve(image, admin_id)
+                else:
+                    reason = sanitize_input(item.get('reason', ''), max_length=500)
+                    delete_paths += moderation.reject(image, admin_id, reason)
+            except moderation.ModerationError as e:
+                results.append({'image_id': image_id, 'success': False, 'error': str(e)})
+                continue
+            
+            results.append({'image_id': image_id, 'success': True, 'status': image.status})
+        
+        # Storage work for every decision goes into at most two batched jobs
+        moderation.queue_reconcile(delete_paths=delete_paths, publish_ids=publish_ids)
+        
+        db.session.commit()
+        notify_workers()
+        
+        succeeded = sum(1 for r in results if r['success'])
+        return jsonify({
+            'success': True,
+            'results': results,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/storage/<path:blob_path>', methods=['GET'])
+def serve_stored_object(blob_path):
+    """Serve an object from the local storage backend (signed URL, or public/ without one)"""
+    try:
+        backend = get_backend()
+        if not isinstance(backend, LocalBackend):
+            return jsonify({'error': 'Not found'}), 404
+        
+        if blob_path.startswith('public/'):
+            cache_control = PUBLIC_CACHE_CONTROL
+        else:
+            expires = request.args.get('expires')
+            if not backend.verify(blob_path, expires, request.args.get('signature')):
+                return jsonify({'error': 'Invalid or expired signature'}), 403
+            cache_control = f"private, max-age={max(0, int(expires) - int(time.time()))}"
+        
+        if not backend.exists(blob_path):
+            return jsonify({'error': 'Not found'}), 404
+        
+        response = send_file(
+            backend.file_path(blob_path),
+            mimetype=mimetypes.guess_type(blob_path)[0] or 'application/octet-stream'
+        )
+        response.headers['Cache-Control'] = cache_control
+        return response
+        
+    except ValueError:
+        return jsonify({'error': 'Not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
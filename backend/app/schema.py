@@ -0,0 +1,73 @@
+"""
+Schema upgrades for existing databases
+
+Tables are created with db.create_all(), which creates missing tables but
+never alters one that already exists. Columns added to existing tables are
+listed in ADDED_COLUMNS and added here, and every index declared on the
+models is created if it is missing. Both steps are idempotent and work on
+Postgres and SQLite. Runs at startup right after create_all, and from
+create_tables.py.
+"""
+
+from sqlalchemy import inspect, text
+
+from app import db
+
+
+# (table, column) added to a table after it first shipped - nullable, no default
+ADDED_COLUMNS = [
+    ('coloring_projects', 'result_key'),
+    ('images', 'variants'),
+    ('jobs', 'run_after'),
+]
+
+
+def _add_column(table_name, column_name):
+    column = db.metadata.tables[table_name].c[column_name]
+    with db.engine.begin() as connection:
+        column_type = column.type.compile(dialect=connection.dialect)
+        connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+
+
+def upgrade_schema():
+    """
+    Add missing columns and indexes to existing tables
+
+    Another process upgrading at the same time makes a step fail here; that
+    step is then already done, so failures are only logged.
+
+    Returns:
+        list: Columns and indexes added
+    """
+    inspector = inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    added = []
+
+    for table_name, column_name in ADDED_COLUMNS:
+        if table_name not in tables:
+            continue
+        if column_name in {c['name'] for c in inspector.get_columns(table_name)}:
+            continue
+        try:
+            _add_column(table_name, column_name)
+            added.append(f"{table_name}.{column_name}")
+        except Exception as e:
+            print(f"⚠️  Could not add column {table_name}.{column_name}: {e}")
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(db.engine, checkfirst=True)
+                added.append(index.name)
+            except Exception as e:
+                print(f"⚠️  Could not create index {index.name}: {e}")
+
+    if added:
+        print(f"🔧 Upgraded database schema: {', '.join(added)}")
+
+    return added
@@ -0,0 +1,280 @@
+"""
+Scratch space for processing jobs
+
+Every canvas job works in its own directory under SCRATCH_DIR (the uploaded
+original, the preprocessed image and the template preview) which is removed
+as soon as the job is done. Results live in the database and cloud storage,
+so nothing in scratch is needed afterwards.
+
+The total size is capped: before new files are written, the least recently
+used idle job directories are evicted (e.g. leftovers of a crashed worker, or
+originals of jobs queued long ago - those are downloaded again from storage
+when their job runs). A directory in use holds a shared lock on its lock file,
+so processes sharing SCRATCH_DIR never evict each other's running jobs.
+
+Usage is kept as a running total, updated as directories are acquired,
+released and evicted; the whole tree is only walked again every
+SCRATCH_RESCAN_INTERVAL to pick up what other processes wrote.
+
+Configuration (env):
+    SCRATCH_DIR              Root directory (default ./scratch; e.g. /dev/shm/cloud-gallery for tmpfs)
+    SCRATCH_QUOTA_MB         Size cap in MB (default 2048)
+    SCRATCH_RESCAN_INTERVAL  Seconds between full rescans of the usage (default 300)
+"""
+
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX - fall back to only evicting long idle directories
+    fcntl = None
+
+from app import metrics
+
+
+# Held (shared) by every process using a directory, taken exclusively to evict it
+LOCK_FILE = '.lock'
+
+# Without fcntl, directories idle for less than this are never evicted
+MIN_IDLE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 60))
+
+
+class ScratchSpaceFull(Exception):
+    """Scratch quota can't be met even after evicting every idle directory"""
+
+
+class ScratchSpace:
+    """Per-job directories under one root with a total size quota"""
+
+    def __init__(self, root, quota_bytes, rescan_interval=300):
+        """
+        Initialize scratch space
+
+        Args:
+            root: Root directory (created if missing)
+            quota_bytes: Maximum total size of all job directories
+            rescan_interval: Seconds between full walks of root to correct the running total
+        """
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.rescan_interval = rescan_interval
+        self._active = {}  # key -> number of users in this process
+        self._locks = {}  # key -> open lock file of a directory in use
+        self._sizes = {}  # key -> bytes, as of the last measurement
+        self._used = 0
+        self._scanned_at = None
+        self._lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        """Directory of a job (not created)"""
+        return os.path.join(self.root, key)
+
+    def acquire(self, key, reserve_bytes=0):
+        """
+        Create (or reuse) a job's directory and protect it from eviction until release()
+
+        Args:
+            key: Job key (e.g. project id)
+            reserve_bytes: Space about to be written - older directories are evicted to make room
+
+        Returns:
+            str: Directory path
+
+        Raises:
+            ScratchSpaceFull: If the quota can't be met
+        """
+        with self._lock:
+            self._active[key] = self._active.get(key, 0) + 1
+
+        try:
+            self.ensure_space(reserve_bytes)
+            path = self.path(key)
+            self._hold(key)
+            os.utime(path)  # Most recently used
+            with self._lock:
+                self._set_size(key, self._sizes.get(key, 0) + reserve_bytes)
+            return path
+        except Exception:
+            self.release(key, delete=False)
+            raise
+
+    def release(self, key, delete=True):
+        """Stop using a job's directory and (by default) delete it"""
+        with self._lock:
+            remaining = self._active.get(key, 0) - 1
+            if remaining > 0:
+                self._active[key] = remaining
+                return
+            self._active.pop(key, None)
+            lock_file = self._locks.pop(key, None)
+
+            if delete:
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                self._set_size(key, 0)
+            else:
+                self._set_size(key, _dir_size(self.path(key)))
+
+        if lock_file:
+            lock_file.close()
+
+    def discard(self, key):
+        """Delete a job's directory unless a job in this process is using it"""
+        with self._lock:
+            if key in self._active:
+                return
+        self._evict(key)
+
+    def _hold(self, key):
+        """Create the directory and take a shared lock on it for this process"""
+        with self._lock:
+            if key in self._locks:
+                return
+            lock_path = os.path.join(self.path(key), LOCK_FILE)
+            while True:
+                os.makedirs(self.path(key), exist_ok=True)
+                try:
+                    lock_file = open(lock_path, 'a')
+                except FileNotFoundError:
+                    continue  # Evicted between makedirs and open
+                if fcntl is None:
+                    break
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+                try:
+                    if os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                        break
+                except FileNotFoundError:
+                    pass
+                lock_file.close()  # Evicted while we waited for the lock - start over
+            self._locks[key] = lock_file
+
+    def _evict(self, key, min_idle=0):
+        """
+        Delete a directory unless a process is using it
+
+        Returns:
+            bool: True if it was deleted
+        """
+        path = self.path(key)
+
+        if fcntl is None:
+            try:
+                if time.time() - os.stat(path).st_mtime < min_idle:
+                    return False
+            except FileNotFoundError:
+                pass
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                lock_file = open(os.path.join(path, LOCK_FILE), 'a')
+            except FileNotFoundError:
+                lock_file = None  # Already gone
+            if lock_file:
+                with lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return False  # In use by another process
+                    shutil.rmtree(path, ignore_errors=True)
+
+        with self._lock:
+            self._set_size(key, 0)
+        return True
+
+    def _set_size(self, key, size):
+        """Update the running total (caller holds _lock)"""
+        self._used += size - self._sizes.pop(key, 0)
+        if size:
+            self._sizes[key] = size
+
+    def rescan(self):
+        """Walk every job directory and reset the running total from what is on disk"""
+        sizes = {}
+        for entry in os.scandir(self.root):
+            if entry.is_dir(follow_symlinks=False):
+                sizes[entry.name] = _dir_size(entry.path)
+
+        with self._lock:
+            self._sizes = sizes
+            self._used = sum(sizes.values())
+            self._scanned_at = time.monotonic()
+
+    def usage(self):
+        """Total bytes used"""
+        if self._scanned_at is None or time.monotonic() - self._scanned_at > self.rescan_interval:
+            self.rescan()
+        return self._used
+
+    def ensure_space(self, needed_bytes=0):
+        """
+        Evict least recently used idle job directories until needed_bytes fit in the quota
+
+        Raises:
+            ScratchSpaceFull: If that isn't possible
+        """
+        if self.usage() + needed_bytes <= self.quota_bytes:
+            return
+
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.name))
+            except OSError:
+                continue
+
+        with self._lock:
+            active = set(self._active)
+
+        for mtime, key in sorted(entries):
+            if self._used + needed_bytes <= self.quota_bytes:
+                break
+            if key in active:
+                continue
+            size = self._sizes.get(key, 0)
+            if not self._evict(key, min_idle=MIN_IDLE_SECONDS):
+                continue
+            metrics.inc('scratch_evictions_total')
+            metrics.inc('scratch_evicted_bytes_total', size)
+            print(f"🧹 Evicted scratch dir {key} ({size // 1024} KB, idle {int(time.time() - mtime)}s)")
+
+        if self._used + needed_bytes > self.quota_bytes:
+            raise ScratchSpaceFull(
+                f"Scratch space full ({self._used // (1024 * 1024)} MB used of {self.quota_bytes // (1024 * 1024)} MB)"
+            )
+
+
+def _dir_size(path):
+    """Bytes in the files under path (0 if it doesn't exist)"""
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return size
+
+_scratch = None
+_scratch_lock = threading.Lock()
+
+
+def get_scratch():
+    """Get the process-wide scratch space configured from the environment"""
+    global _scratch
+
+    if _scratch is None:
+        with _scratch_lock:
+            if _scratch is None:
+                _scratch = ScratchSpace(
+                    root=os.getenv('SCRATCH_DIR', os.path.join(os.getcwd(), 'scratch')),
+                    quota_bytes=int(float(os.getenv('SCRATCH_QUOTA_MB', 2048)) * 1024 * 1024),
+                    rescan_interval=float(os.getenv('SCRATCH_RESCAN_INTERVAL', 300))
+                )
+
+    return _scratch
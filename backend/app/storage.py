@@ -1,62 +1,58 @@
 """
-Google Cloud Storage operations
+Object storage operations
+
+Everything goes through a pluggable backend (app.storage_backends, selected
+by STORAGE_BACKEND): Google Cloud Storage in production, a local directory
+for development and tests.
+
+Signed URLs are cached: each costs an RSA signature, and a gallery page
+needs several per image. A URL is reused until it is within
+SIGNED_URL_REFRESH_MARGIN seconds of expiring, in an LRU of at most
+SIGNED_URL_CACHE_SIZE entries (hit rate in app.metrics as
+signed_url_cache_total{result}).
+
+With GALLERY_PUBLIC_URLS on, approved gallery images are published under
+public/ with content-hashed names and a long, immutable Cache-Control, and
+get stable unsigned URLs (PUBLIC_BASE_URL, e.g. a CDN in front of the
+bucket) that browsers and CDNs can cache. The bucket must allow public reads
+of public/ (an IAM condition on the prefix).
 """
 import os
-from google.cloud import storage
-from google.oauth2 import service_account
-from datetime import timedelta
-from PIL import Image
-import io
-
-# Storage client and bucket will be initialized lazily
-_storage_client = None
-_bucket = None
-
-def get_storage_client():
-    """Get or create storage client with service account credentials"""
-    global _storage_client
-    
-    if _storage_client is None:
-        credentials_path = os.getenv('FIREBASE_CREDENTIALS')
-        
-        # Convert relative path to absolute if needed
-        if credentials_path and not os.path.isabs(credentials_path):
-            # Assume path is relative to backend directory
-            backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            credentials_path = os.path.join(backend_dir, credentials_path)
-        
-        if credentials_path and os.path.exists(credentials_path):
-            credentials = service_account.Credentials.from_service_account_file(
-                credentials_path,
-                scopes=['https://www.googleapis.com/auth/cloud-platform']
-            )
-            _storage_client = storage.Client(
-                project=os.getenv('PROJECT_ID'),
-                credentials=credentials
-            )
-        else:
-            raise ValueError(
-                f"Firebase credentials not found. "
-                f"FIREBASE_CREDENTIALS={os.getenv('FIREBASE_CREDENTIALS')}, "
-                f"Resolved path={credentials_path}, "
-                f"Exists={os.path.exists(credentials_path) if credentials_path else False}"
-            )
-    
-    return _storage_client
-
-def get_bucket():
-    """Get storage bucket"""
-    global _bucket
-    
-    if _bucket is None:
-        bucket_name = os.getenv('BUCKET_NAME')
-        if not bucket_name:
-            raise ValueError("BUCKET_NAME environment variable not set")
-        
-        client = get_storage_client()
-        _bucket = client.bucket(bucket_name)
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app import metrics
+from app.storage_backends import create_backend
+
+# Storage backend will be initialized lazily
+_backend = None
+_backend_lock = threading.Lock()
+
+# Background uploads (see upload_async)
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+
+# Published objects never change - their names contain a hash of the content
+PUBLIC_PREFIX = 'public/'
+PUBLIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# (blob path, method) -> (url, expires at - epoch seconds), least recently used first
+_signed_urls = OrderedDict()
+_signed_urls_lock = threading.Lock()
+
+def get_backend():
+    """Get the process-wide storage backend"""
+    global _backend
+    
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
     
-    return _bucket
+    return _backend
 
 def upload_image(file, destination_path):
     """
@@ -70,81 +66,225 @@ def upload_image(file, destination_path):
         str: Path to uploaded file
     """
     try:
-        bucket = get_bucket()
-        blob = bucket.blob(destination_path)
-        
         # Upload file
         file.seek(0)
         
         # Check if it's a FileStorage object (has content_type)
-        content_type = getattr(file, 'content_type', 'image/jpeg')
+        content_type = getattr(file, 'content_type', None) or 'image/jpeg'
         
-        blob.upload_from_file(file, content_type=content_type)
+        get_backend().put(destination_path, file.read(), content_type=content_type)
         
         return destination_path
     except Exception as e:
         raise Exception(f"Failed to upload image: {str(e)}")
 
-def create_thumbnail(image_file, max_size=(300, 300)):
+def upload_bytes(data, destination_path, content_type='image/jpeg'):
     """
-    Create thumbnail from image
+    Upload an in-memory image to Cloud Storage
     
     Args:
-        image_file: Image file object
-        max_size: Maximum dimensions for thumbnail
+        data: Image bytes
+        destination_path: Destination path in bucket
+        content_type: MIME type
         
     Returns:
-        BytesIO: Thumbnail image data
+        str: Path to uploaded file
     """
     try:
-        image_file.seek(0)
-        img = Image.open(image_file)
+        get_backend().put(destination_path, data, content_type=content_type)
         
-        # Convert RGBA to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
+        return destination_path
+    except Exception as e:
+        raise Exception(f"Failed to upload image: {str(e)}")
+
+def upload_async(data, destination_path, content_type='image/jpeg'):
+    """
+    Start uploading an in-memory image in the background
+    
+    Uploads run on a shared thread pool (STORAGE_UPLOAD_THREADS, default 8)
+    so a request can overlap them with other work.
+    
+    Args:
+        data: Image bytes
+        destination_path: Destination path in bucket
+        content_type: MIME type
         
-        # Create thumbnail
-        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+    Returns:
+        Future: Resolves to the destination path (raises if the upload failed)
+    """
+    global _upload_executor
+    
+    if _upload_executor is None:
+        with _upload_executor_lock:
+            if _upload_executor is None:
+                _upload_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('STORAGE_UPLOAD_THREADS', 8)),
+                    thread_name_prefix='storage-upload'
+                )
+    
+    return _upload_executor.submit(upload_bytes, data, destination_path, content_type)
+
+def copy_image(source_path, destination_path):
+    """
+    Copy a blob within the bucket
+    
+    Args:
+        source_path: Existing blob path
+        destination_path: New blob path
         
-        # Save to bytes
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=85, optimize=True)
-        output.seek(0)
+    Returns:
+        str: Destination path
+    """
+    get_backend().copy(source_path, destination_path)
+    return destination_path
+
+def copy_images(pairs, cache_control=None):
+    """
+    Copy several blobs in one batch
+    
+    Args:
+        pairs: (source path, destination path) tuples
+        cache_control: Optional Cache-Control for the copies
+    """
+    get_backend().copy_many(pairs, cache_control=cache_control)
+
+def public_urls_enabled():
+    """Whether approved images are published with stable public URLs (GALLERY_PUBLIC_URLS)"""
+    return os.getenv('GALLERY_PUBLIC_URLS', 'false').lower() in ('1', 'true', 'yes')
+
+def is_public_path(blob_path):
+    """Whether a blob was published under public/"""
+    return bool(blob_path) and blob_path.startswith(PUBLIC_PREFIX)
+
+def public_url(blob_path):
+    """Stable unsigned URL of a published blob"""
+    base = os.getenv('PUBLIC_BASE_URL')
+    if base:
+        return f"{base.rstrip('/')}/{blob_path}"
+    return get_backend().public_url(blob_path)
+
+def publish_images(blob_paths, public_dir):
+    """
+    Copy blobs to content-hashed paths under public/ with long-lived caching
+    
+    Args:
+        blob_paths: Existing blob paths
+        public_dir: Directory under public/ (e.g. 'public/<image id>')
         
-        return output
-    except Exception as e:
-        raise Exception(f"Failed to create thumbnail: {str(e)}")
+    Returns:
+        dict: blob path -> published path (<public_dir>/<content hash>.<ext>)
+    """
+    backend = get_backend()
+    published = {}
+    for blob_path in blob_paths:
+        checksum = backend.checksum(blob_path)
+        if checksum is None:
+            raise Exception(f"Failed to publish image: {blob_path} not found")
+        published[blob_path] = f"{public_dir}/{checksum[:16]}{os.path.splitext(blob_path)[1]}"
+    
+    backend.copy_many(published.items(), cache_control=PUBLIC_CACHE_CONTROL)
+    return published
+
+def _refresh_margin():
+    return float(os.getenv('SIGNED_URL_REFRESH_MARGIN', 300))
 
-def upload_thumbnail(image_file, destination_path):
+def signed_url_epoch():
     """
-    Create and upload thumbnail
+    Current signed-URL epoch (a number)
+    
+    Epochs are SIGNED_URL_REFRESH_MARGIN seconds long. Every URL handed out
+    stays valid past the margin, so past the end of the epoch it was handed
+    out in - a response whose validators include the epoch can be reused
+    until it changes (see app.http_cache).
+    """
+    return int(time.time() // _refresh_margin())
+
+def signed_url_epoch_seconds():
+    """Length of a signed-URL epoch"""
+    return _refresh_margin()
+
+def signed_url_epoch_start():
+    """Start of the current signed-URL epoch (naive UTC datetime)"""
+    return datetime.utcfromtimestamp(signed_url_epoch() * _refresh_margin())
+
+def _cached_signed_url(key, now):
+    """Cached URL for key if it stays valid past the refresh margin"""
+    margin = _refresh_margin()
+    with _signed_urls_lock:
+        entry = _signed_urls.get(key)
+        if entry is None:
+            return None
+        url, expires_at = entry
+        if expires_at - now <= margin:
+            del _signed_urls[key]
+            return None
+        _signed_urls.move_to_end(key)
+        return url
+
+def _store_signed_url(key, url, expires_at):
+    """Remember a signed URL, evicting the least recently used beyond the size limit"""
+    max_size = int(os.getenv('SIGNED_URL_CACHE_SIZE', 10000))
+    with _signed_urls_lock:
+        _signed_urls[key] = (url, expires_at)
+        _signed_urls.move_to_end(key)
+        while len(_signed_urls) > max_size:
+            _signed_urls.popitem(last=False)
+
+def generate_signed_urls(blob_paths, expiration=3600, method="GET"):
+    """
+    Signed URLs for many blobs at once (e.g. everything on a page)
+    
+    Cached URLs are reused; only the rest are signed. Published blobs
+    (public/) get their stable public URL instead.
     
     Args:
-        image_file: Original image file
-        destination_path: Destination path for thumbnail
+        blob_paths: Paths to blobs in bucket (falsy entries are skipped)
+        expiration: URL expiration time in seconds for newly signed URLs
+        method: HTTP method the URLs are for
         
     Returns:
-        str: Path to uploaded thumbnail
+        dict: blob path -> signed URL (None if signing failed)
     """
+    now = time.time()
+    urls = {}
+    missing = []
+    
+    for blob_path in dict.fromkeys(p for p in blob_paths if p):
+        if is_public_path(blob_path):
+            urls[blob_path] = public_url(blob_path)
+            continue
+        url = _cached_signed_url((blob_path, method), now)
+        if url is None:
+            missing.append(blob_path)
+        else:
+            urls[blob_path] = url
+    
+    if urls:
+        metrics.inc('signed_url_cache_total', len(urls), result='hit')
+    if not missing:
+        return urls
+    metrics.inc('signed_url_cache_total', len(missing), result='miss')
+    
     try:
-        thumbnail = create_thumbnail(image_file)
-        
-        bucket = get_bucket()
-        blob = bucket.blob(destination_path)
-        blob.upload_from_file(thumbnail, content_type='image/jpeg')
-        
-        return destination_path
+        backend = get_backend()
     except Exception as e:
-        raise Exception(f"Failed to upload thumbnail: {str(e)}")
+        print(f"Failed to generate signed URL: {str(e)}")
+        return dict(urls, **{blob_path: None for blob_path in missing})
+    
+    for blob_path in missing:
+        try:
+            url = backend.sign(blob_path, expiration, method)
+            _store_signed_url((blob_path, method), url, now + expiration)
+            urls[blob_path] = url
+        except Exception as e:
+            print(f"Failed to generate signed URL: {str(e)}")
+            urls[blob_path] = None
+    
+    return urls
 
 def generate_signed_url(blob_path, expiration=3600):
     """
-    Generate signed URL for blob access
+    Generate signed URL for blob access (cached, see generate_signed_urls)
     
     Args:
         blob_path: Path to blob in bucket
@@ -153,23 +293,42 @@ def generate_signed_url(blob_path, expiration=3600):
     Returns:
         str: Signed URL
     """
-    try:
-        if not blob_path:
-            return None
-        
-        bucket = get_bucket()
-        blob = bucket.blob(blob_path)
+    if not blob_path:
+        return None
+    return generate_signed_urls([blob_path], expiration).get(blob_path)
+
+def signed_url_cache_stats():
+    """Size of the signed URL cache and its hit rate in this process"""
+    counts = {c['labels']['result']: c['value'] for c in metrics.snapshot()['counters']
+              if c['name'] == 'signed_url_cache_total'}
+    hits, misses = counts.get('hit', 0), counts.get('miss', 0)
+    with _signed_urls_lock:
+        size = len(_signed_urls)
+    return {
+        'size': size,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None
+    }
+
+def download_image(blob_path, destination_path):
+    """
+    Download blob to a local file
+    
+    Args:
+        blob_path: Path to blob in bucket
+        destination_path: Local file path to write
         
-        url = blob.generate_signed_url(
-            version="v4",
-            expiration=timedelta(seconds=expiration),
-            method="GET"
-        )
+    Returns:
+        str: Local file path
+    """
+    try:
+        os.makedirs(os.path.dirname(destination_path) or '.', exist_ok=True)
+        get_backend().download(blob_path, destination_path)
         
-        return url
+        return destination_path
     except Exception as e:
-        print(f"Failed to generate signed URL: {str(e)}")
-        return None
+        raise Exception(f"Failed to download image: {str(e)}")
 
 def delete_image(blob_path):
     """
@@ -179,31 +338,25 @@ def delete_image(blob_path):
         blob_path: Path to blob in bucket
     """
     try:
-        bucket = get_bucket()
-        blob = bucket.blob(blob_path)
-        blob.delete()
+        get_backend().delete(blob_path)
     except Exception as e:
         print(f"Failed to delete image: {str(e)}")
 
-def get_image_metadata(image_file):
+def delete_images(blob_paths):
     """
-    Get image metadata (dimensions, format, size)
+    Delete several images in one batch
     
     Args:
-        image_file: Image file object
+        blob_paths: Paths to blobs in bucket (falsy entries are skipped)
         
     Returns:
-        dict: Image metadata
+        list: Paths that could not be deleted
     """
+    blob_paths = [p for p in dict.fromkeys(blob_paths) if p]
+    if not blob_paths:
+        return []
     try:
-        image_file.seek(0)
-        img = Image.open(image_file)
-        
-        return {
-            'width': img.width,
-            'height': img.height,
-            'format': img.format,
-            'mode': img.mode
-        }
+        return get_backend().delete_many(blob_paths)
     except Exception as e:
-        raise Exception(f"Failed to get image metadata: {str(e)}")
+        print(f"Failed to delete images: {str(e)}")
+        return blob_paths
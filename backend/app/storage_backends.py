@@ -0,0 +1,320 @@
+"""
+Storage backends
+
+app.storage talks to object storage only through a StorageBackend:
+
+- GCSBackend: Google Cloud Storage with one client per process whose HTTP
+  connection pool is sized for concurrent use (STORAGE_POOL_SIZE), and
+  multi-object copies/deletes sent as GCS batch requests.
+- LocalBackend: a directory on disk, for development, tests and offline
+  benchmarks. Signed URLs point at the app itself (GET /api/storage/<path>)
+  and carry an HMAC signature and expiry.
+
+Configuration (env):
+    STORAGE_BACKEND        'gcs' (default) or 'local'
+    STORAGE_POOL_SIZE      HTTP connections kept open to GCS (default 32)
+    STORAGE_LOCAL_ROOT     Directory for the local backend (default ./storage)
+    STORAGE_LOCAL_SECRET   Key for local signed URLs (default: random per process)
+    STORAGE_LOCAL_URL      Base URL of this app for local URLs (default: the current request's host)
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from urllib.parse import quote
+
+
+# Operations per GCS batch request (API limit is 100)
+GCS_BATCH_SIZE = 100
+
+
+class StorageBackend:
+    """Object storage operations used by app.storage"""
+
+    def put(self, path, data, content_type='application/octet-stream', cache_control=None):
+        """Store bytes at path"""
+        raise NotImplementedError
+
+    def get(self, path):
+        """Bytes stored at path"""
+        raise NotImplementedError
+
+    def download(self, path, destination):
+        """Write the object at path to a local file"""
+        with open(destination, 'wb') as f:
+            f.write(self.get(path))
+
+    def exists(self, path):
+        """Whether an object exists at path"""
+        raise NotImplementedError
+
+    def copy(self, source, destination, cache_control=None):
+        """Copy an object (optionally setting its Cache-Control)"""
+        raise NotImplementedError
+
+    def copy_many(self, pairs, cache_control=None):
+        """Copy several objects: pairs of (source, destination)"""
+        for source, destination in pairs:
+            self.copy(source, destination, cache_control)
+
+    def delete(self, path):
+        """Delete an object (missing objects are ignored)"""
+        raise NotImplementedError
+
+    def delete_many(self, paths):
+        """
+        Delete several objects
+
+        Returns:
+            list: Paths that could not be deleted
+        """
+        failed = []
+        for path in paths:
+            try:
+                self.delete(path)
+            except Exception as e:
+                print(f"Failed to delete {path}: {e}")
+                failed.append(path)
+        return failed
+
+    def checksum(self, path):
+        """Hex digest of the object's content, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def sign(self, path, expiration, method='GET'):
+        """URL granting method on path for expiration seconds"""
+        raise NotImplementedError
+
+    def public_url(self, path):
+        """Unsigned URL of an object in the publicly readable area (public/)"""
+        raise NotImplementedError
+
+
+class GCSBackend(StorageBackend):
+    """Google Cloud Storage bucket (BUCKET_NAME) with a pooled client"""
+
+    def __init__(self, bucket_name=None, pool_size=None):
+        from google.cloud import storage
+        from google.oauth2 import service_account
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        credentials_path = os.getenv('FIREBASE_CREDENTIALS')
+
+        # Convert relative path to absolute if needed
+        if credentials_path and not os.path.isabs(credentials_path):
+            # Assume path is relative to backend directory
+            backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            credentials_path = os.path.join(backend_dir, credentials_path)
+
+        if not (credentials_path and os.path.exists(credentials_path)):
+            raise ValueError(
+                f"Firebase credentials not found. "
+                f"FIREBASE_CREDENTIALS={os.getenv('FIREBASE_CREDENTIALS')}, "
+                f"Resolved path={credentials_path}, "
+                f"Exists={os.path.exists(credentials_path) if credentials_path else False}"
+            )
+
+        bucket_name = bucket_name or os.getenv('BUCKET_NAME')
+        if not bucket_name:
+            raise ValueError("BUCKET_NAME environment variable not set")
+
+        credentials = service_account.Credentials.from_service_account_file(
+            credentials_path,
+            scopes=['https://www.googleapis.com/auth/cloud-platform']
+        )
+
+        # requests keeps 10 connections per host by default - too few for
+        # upload threads and request threads sharing this client. The client
+        # takes a ready-made authorized session as its documented _http argument
+        pool_size = pool_size or int(os.getenv('STORAGE_POOL_SIZE', 32))
+        session = AuthorizedSession(credentials)
+        session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self.client = storage.Client(project=os.getenv('PROJECT_ID'), credentials=credentials, _http=session)
+
+        self.bucket = self.client.bucket(bucket_name)
+        self.bucket_name = bucket_name
+
+    def put(self, path, data, content_type='application/octet-stream', cache_control=None):
+        blob = self.bucket.blob(path)
+        if cache_control:
+            blob.cache_control = cache_control
+        blob.upload_from_string(data, content_type=content_type)
+
+    def get(self, path):
+        return self.bucket.blob(path).download_as_bytes()
+
+    def download(self, path, destination):
+        self.bucket.blob(path).download_to_filename(destination)
+
+    def exists(self, path):
+        return self.bucket.blob(path).exists()
+
+    def copy(self, source, destination, cache_control=None):
+        self.copy_many([(source, destination)], cache_control)
+
+    def copy_many(self, pairs, cache_control=None):
+        pairs = list(pairs)
+        for start in range(0, len(pairs), GCS_BATCH_SIZE):
+            chunk = pairs[start:start + GCS_BATCH_SIZE]
+            with self.client.batch():
+                for source, destination in chunk:
+                    self.bucket.copy_blob(self.bucket.blob(source), self.bucket, destination)
+            if cache_control:
+                # Copies keep the source's metadata - set Cache-Control on the new objects
+                with self.client.batch():
+                    for _, destination in chunk:
+                        blob = self.bucket.blob(destination)
+                        blob.cache_control = cache_control
+                        blob.patch()
+
+    def delete(self, path):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.bucket.blob(path).delete()
+        except NotFound:
+            pass
+
+    def delete_many(self, paths):
+        paths = list(paths)
+        failed = []
+        for start in range(0, len(paths), GCS_BATCH_SIZE):
+            chunk = paths[start:start + GCS_BATCH_SIZE]
+            try:
+                with self.client.batch():
+                    for path in chunk:
+                        self.bucket.blob(path).delete()
+                continue
+            except Exception as e:
+                # The batch only reports its first failed request (a missing
+                # object counts too) - delete this chunk one by one to find out which
+                print(f"Batch delete of {len(chunk)} objects failed ({e}), deleting one by one")
+
+            for path in chunk:
+                try:
+                    self.delete(path)
+                except Exception as e:
+                    print(f"Failed to delete {path}: {e}")
+                    failed.append(path)
+        return failed
+
+    def checksum(self, path):
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            return None
+        # MD5 comes with the object metadata (composite objects only have CRC32C)
+        return base64.b64decode(blob.md5_hash or blob.crc32c).hex()
+
+    def sign(self, path, expiration, method='GET'):
+        return self.bucket.blob(path).generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=expiration),
+            method=method
+        )
+
+    def public_url(self, path):
+        return f"https://storage.googleapis.com/{self.bucket_name}/{quote(path)}"
+
+
+class LocalBackend(StorageBackend):
+    """Objects as files under a root directory, served by the app's /api/storage route"""
+
+    def __init__(self, root=None, secret=None):
+        self.root = os.path.abspath(root or os.getenv('STORAGE_LOCAL_ROOT', os.path.join(os.getcwd(), 'storage')))
+        secret = secret or os.getenv('STORAGE_LOCAL_SECRET') or secrets.token_hex(32)
+        self.secret = secret.encode()
+        os.makedirs(self.root, exist_ok=True)
+
+    def file_path(self, path):
+        """Local file for an object path (refuses paths escaping the root)"""
+        full = os.path.abspath(os.path.join(self.root, path))
+        if not full.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid object path: {path}")
+        return full
+
+    def put(self, path, data, content_type='application/octet-stream', cache_control=None):
+        full = self.file_path(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+
+        # Write-then-rename so readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, full)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, path):
+        with open(self.file_path(path), 'rb') as f:
+            return f.read()
+
+    def download(self, path, destination):
+        shutil.copyfile(self.file_path(path), destination)
+
+    def exists(self, path):
+        return os.path.isfile(self.file_path(path))
+
+    def copy(self, source, destination, cache_control=None):
+        full = self.file_path(destination)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        shutil.copyfile(self.file_path(source), full)
+
+    def delete(self, path):
+        try:
+            os.remove(self.file_path(path))
+        except FileNotFoundError:
+            pass
+
+    def checksum(self, path):
+        try:
+            with open(self.file_path(path), 'rb') as f:
+                return hashlib.md5(f.read()).hexdigest()
+        except FileNotFoundError:
+            return None
+
+    def _signature(self, path, expires, method):
+        message = f"{method}\n{path}\n{expires}".encode()
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    def _base_url(self):
+        base = os.getenv('STORAGE_LOCAL_URL')
+        if not base:
+            from flask import has_request_context, request
+            base = request.host_url if has_request_context() else 'http://localhost:8080/'
+        return base.rstrip('/')
+
+    def sign(self, path, expiration, method='GET'):
+        expires = int(time.time() + expiration)
+        signature = self._signature(path, expires, method)
+        return f"{self._base_url()}/api/storage/{quote(path)}?expires={expires}&signature={signature}"
+
+    def verify(self, path, expires, signature, method='GET'):
+        """Whether a signed URL's expires/signature are valid for path"""
+        try:
+            if int(expires) < time.time():
+                return False
+        except (TypeError, ValueError):
+            return False
+        return hmac.compare_digest(self._signature(path, int(expires), method), signature or '')
+
+    def public_url(self, path):
+        return f"{self._base_url()}/api/storage/{quote(path)}"
+
+
+def create_backend():
+    """Backend selected by STORAGE_BACKEND"""
+    name = os.getenv('STORAGE_BACKEND', 'gcs').lower()
+    if name == 'local':
+        return LocalBackend()
+    if name == 'gcs':
+        return GCSBackend()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {name}")
@@ -0,0 +1,184 @@
+"""
+Style Picker Previews
+
+Renders small previews of every available style from ONE decoded,
+downscaled copy of the photo, fanning the filters out on a thread pool
+(OpenCV releases the GIL, so the filters really run in parallel).
+
+Previews are returned as an in-memory bundle - nothing is written to disk.
+"""
+
+import os
+import time
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+from app.stylized_processor import ImageStylizer
+from app.pet_cartoon_filter import PetCartoonFilter
+from app.neural_cartoon_processor import NeuralCartoonProcessor
+from app.image_loader import load_image, load_image_bytes
+
+
+# All styles offered in the style picker (order = display order)
+PREVIEW_STYLES = ('cartoon', 'posterize', 'oil', 'watercolor', 'edge', 'simple', 'pet', 'neural')
+
+# Longest side of a preview image (pixels)
+STYLE_PREVIEW_SIZE = int(os.getenv('STYLE_PREVIEW_SIZE', 256))
+
+# Shared pool so concurrent preview requests don't each spin up threads
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('STYLE_PREVIEW_WORKERS', len(PREVIEW_STYLES))),
+    thread_name_prefix='style-preview'
+)
+
+
+def load_preview_source(image_path=None, image_bytes=None, max_size=STYLE_PREVIEW_SIZE):
+    """
+    Decode and downscale the photo once for all preview styles
+
+    Args:
+        image_path: Path to input photo
+        image_bytes: Encoded image data (used instead of image_path)
+        max_size: Longest side of the downscaled image
+
+    Returns:
+        ndarray: RGB image no larger than max_size
+    """
+    if image_bytes is not None:
+        img = load_image_bytes(image_bytes, target_size=max_size)
+    else:
+        img = load_image(image_path, target_size=max_size)
+
+    return downscale(img, max_size)
+
+
+def downscale(image, max_size):
+    """Downscale RGB array so its longest side is at most max_size"""
+    height, width = image.shape[:2]
+
+    if max(height, width) <= max_size:
+        return image
+
+    scale = max_size / max(height, width)
+    return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def render_style(style, image):
+    """
+    Apply a single style to an already-decoded RGB image
+
+    Args:
+        style: One of PREVIEW_STYLES
+        image: RGB array (shared between threads - filters never modify it in place)
+
+    Returns:
+        ndarray: Stylized RGB image
+    """
+    if style == 'pet':
+        return PetCartoonFilter(image=image).apply_pet_cartoon()
+
+    if style == 'neural':
+        # Previews always use the local preprocessing path
+        return NeuralCartoonProcessor(image=image).process(use_neural=False)
+
+    stylizer = ImageStylizer(image=image)
+
+    # Same filter settings as StylizedCanvasGenerator.process
+    if style == 'cartoon':
+        return stylizer.cartoon_filter()
+    elif style == 'posterize':
+        return stylizer.posterize_filter(levels=8)
+    elif style == 'oil':
+        return stylizer.oil_painting_filter(size=7)
+    elif style == 'watercolor':
+        return stylizer.watercolor_filter()
+    elif style == 'edge':
+        return stylizer.edge_preserve_filter()
+    elif style == 'simple':
+        return stylizer.super_simple_filter()
+
+    raise ValueError(f"Unknown style: {style}")
+
+
+def _render_preview(style, image, image_format, quality):
+    """Render and encode one preview (runs on the thread pool)"""
+    started = time.perf_counter()
+
+    stylized = render_style(style, image)
+
+    ext = '.png' if image_format == 'png' else '.jpg'
+    params = [] if image_format == 'png' else [cv2.IMWRITE_JPEG_QUALITY, quality]
+    ok, encoded = cv2.imencode(ext, cv2.cvtColor(stylized, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"Could not encode {style} preview")
+
+    return {
+        'data': encoded.tobytes(),
+        'mime_type': 'image/png' if image_format == 'png' else 'image/jpeg',
+        'elapsed_ms': int((time.perf_counter() - started) * 1000)
+    }
+
+
+def generate_style_previews(image_path=None, image=None, image_bytes=None, styles=None,
+                            max_size=STYLE_PREVIEW_SIZE, image_format='jpeg', quality=80, timeout=None):
+    """
+    Generate previews of all styles from a single decode
+
+    Args:
+        image_path: Path to input photo
+        image: Already-decoded RGB array (used instead of image_path)
+        image_bytes: Encoded image data, e.g. an upload (used instead of image_path)
+        styles: Styles to render (default: all PREVIEW_STYLES)
+        max_size: Longest side of the previews
+        image_format: 'jpeg' or 'png'
+        quality: JPEG quality
+        timeout: Seconds to wait for all previews (None = no limit)
+
+    Returns:
+        dict: {
+            'width': int, 'height': int,
+            'styles': {style: {'data': bytes, 'mime_type': str, 'elapsed_ms': int}},
+            'errors': {style: str},
+            'elapsed_ms': int
+        }
+    """
+    started = time.perf_counter()
+    styles = list(styles or PREVIEW_STYLES)
+
+    unknown = [s for s in styles if s not in PREVIEW_STYLES]
+    if unknown:
+        raise ValueError(f"Unknown style(s): {', '.join(unknown)}")
+
+    if image is None:
+        source = load_preview_source(image_path, image_bytes, max_size)
+    else:
+        source = downscale(image, max_size)
+
+    futures = {
+        style: _executor.submit(_render_preview, style, source, image_format, quality)
+        for style in styles
+    }
+
+    previews = {}
+    errors = {}
+    for style, future in futures.items():
+        remaining = None
+        if timeout is not None:
+            remaining = max(0, timeout - (time.perf_counter() - started))
+        try:
+            previews[style] = future.result(timeout=remaining)
+        except Exception as e:
+            # One broken filter (e.g. oil needs opencv-contrib) shouldn't sink the picker
+            future.cancel()
+            errors[style] = str(e) or e.__class__.__name__
+
+    height, width = source.shape[:2]
+
+    return {
+        'width': int(width),
+        'height': int(height),
+        'styles': previews,
+        'errors': errors,
+        'elapsed_ms': int((time.perf_counter() - started) * 1000)
+    }
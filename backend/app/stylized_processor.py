@@ -13,6 +13,12 @@ import numpy as np
 from pathlib import Path
 import sys
 
+try:
+    from app.image_loader import load_image
+except ImportError:
+    # Running as a standalone script (python app/<module>.py)
+    from image_loader import load_image
+
 
 class ImageStylizer:
     """
@@ -20,20 +26,22 @@ class ImageStylizer:
     Creates cleaner, more defined regions for coloring.
     """
     
-    def __init__(self, image_path):
+    def __init__(self, image_path=None, image=None, max_size=None):
         """
         Initialize stylizer
         
         Args:
             image_path: Path to input photo
+            image: Already-decoded RGB array (skips loading from image_path)
+            max_size: Longest side needed downstream; large JPEGs are decoded
+                      at reduced scale but never below it (None = full size)
         """
         self.image_path = image_path
-        self.original = cv2.imread(image_path)
-        if self.original is None:
-            raise ValueError(f"Could not load image: {image_path}")
         
-        # Convert BGR to RGB
-        self.original = cv2.cvtColor(self.original, cv2.COLOR_BGR2RGB)
+        if image is not None:
+            self.original = image
+        else:
+            self.original = load_image(image_path, target_size=max_size)
         self.stylized = None
     
     def cartoon_filter(self, blur_value=9, edge_threshold1=100, edge_threshold2=200):
@@ -226,7 +234,7 @@ class StylizedCanvasGenerator:
     Complete pipeline: Stylize photo → Generate canvas data
     """
     
-    def __init__(self, image_path, num_colors=15, style='cartoon', min_region_size=50):
+    def __init__(self, image_path, num_colors=15, style='cartoon', min_region_size=50, max_size=800):
         """
         Initialize stylized canvas generator
         
@@ -235,12 +243,15 @@ class StylizedCanvasGenerator:
             num_colors: Number of colors for canvas (fewer = easier)
             style: Filter to apply ('cartoon', 'posterize', 'oil', 'watercolor', 'edge', 'simple')
             min_region_size: Minimum pixels per region (smaller get merged for UX)
+            max_size: Maximum canvas dimension (pixels)
         """
         self.image_path = image_path
         self.num_colors = num_colors
         self.style = style
         self.min_region_size = min_region_size
-        self.stylizer = ImageStylizer(image_path)
+        self.max_size = max_size
+        # Canvas never exceeds max_size, so don't decode beyond it
+        self.stylizer = ImageStylizer(image_path, max_size=max_size)
         self.stylized_path = None
     
     def process(self, output_dir='output'):
@@ -295,7 +306,7 @@ class StylizedCanvasGenerator:
         generator = InteractiveCanvasGenerator(
             str(self.stylized_path), 
             num_colors=self.num_colors,
-            max_size=800,
+            max_size=self.max_size,
             min_region_size=self.min_region_size
         )
         
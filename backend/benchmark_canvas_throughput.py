@@ -0,0 +1,110 @@
+"""
+Benchmark canvas generation throughput (jobs/minute) at 1, 2, 4 and 8 concurrent jobs
+
+Runs the real pipeline (app.canvas_pool.run_canvas_pipeline) with and without
+the CPU thread budget (app.cpu_budget), pinned to a fixed number of cores so
+results are comparable between machines.
+
+Usage:
+    python benchmark_canvas_throughput.py [--cores 4] [--executor process|thread]
+                                          [--concurrency 1,2,4,8] [--jobs-per-worker 2]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Only the pipeline is used - no job workers, throwaway database
+os.environ['JOB_WORKERS'] = '0'
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.gettempdir()}/benchmark_canvas.db")
+
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+PHOTOS = [backend_dir.parent / 'test-photos' / name for name in ('boba.jpg', 'ldn.jpg')]
+
+
+def run_level(concurrency, num_jobs, budget, output_dir, num_colors, max_size):
+    """Run num_jobs canvas jobs, concurrency at a time; returns elapsed seconds"""
+    from app import canvas_pool
+    from app.cpu_budget import apply_process_budget, reset_thread_budget
+
+    os.environ['CANVAS_THREAD_BUDGET'] = 'auto' if budget else '0'
+    os.environ['CANVAS_PROCESSES'] = str(concurrency)
+
+    # Fresh worker processes (no limits left over from the previous run) and,
+    # for inline jobs, library defaults (all cores) restored in this process
+    canvas_pool.shutdown_canvas_pool()
+    reset_thread_budget()
+    if canvas_pool.use_process_pool():
+        canvas_pool.get_canvas_pool()
+    else:
+        apply_process_budget(concurrency)
+
+    def job(i):
+        canvas_pool.run_canvas_pipeline(
+            f"bench_{concurrency}_{i}",
+            str(PHOTOS[i % len(PHOTOS)]),
+            num_colors,
+            output_dir,
+            max_size=max_size,
+            min_region_size=200
+        )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(job, range(num_jobs)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cores', type=int, default=min(4, os.cpu_count() or 1),
+                        help='Pin the benchmark to this many cores')
+    parser.add_argument('--executor', choices=('process', 'thread'), default='process')
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--jobs-per-worker', type=int, default=2)
+    parser.add_argument('--num-colors', type=int, default=15)
+    parser.add_argument('--max-size', type=int, default=600)
+    args = parser.parse_args()
+
+    # Fixed core count - worker processes inherit the affinity
+    if hasattr(os, 'sched_setaffinity'):
+        available = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, available[:args.cores])
+    os.environ['CANVAS_EXECUTOR'] = args.executor
+
+    from app import canvas_pool
+    from app.cpu_budget import cpu_count
+
+    output_dir = tempfile.mkdtemp(prefix='canvas_bench_')
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    print(f"Canvas throughput: {cpu_count()} cores, executor={args.executor}, "
+          f"{args.num_colors} colors, max size {args.max_size}")
+    print()
+
+    results = []
+    for concurrency in levels:
+        num_jobs = concurrency * args.jobs_per_worker
+        row = [concurrency, num_jobs]
+        for budget in (False, True):
+            elapsed = run_level(concurrency, num_jobs, budget, output_dir, args.num_colors, args.max_size)
+            row.append(num_jobs * 60 / elapsed)
+            print(f"  {concurrency} concurrent, budget {'on ' if budget else 'off'}: "
+                  f"{num_jobs} jobs in {elapsed:.1f}s")
+        results.append(row)
+
+    canvas_pool.shutdown_canvas_pool()
+
+    print()
+    print(f"{'Concurrent':>10} {'Jobs':>5} {'jobs/min (no budget)':>21} {'jobs/min (budget)':>18}")
+    for concurrency, num_jobs, unlimited, budgeted in results:
+        print(f"{concurrency:>10} {num_jobs:>5} {unlimited:>21.1f} {budgeted:>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
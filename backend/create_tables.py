@@ -12,6 +12,10 @@ def create_tables():
             db.create_all()
             print("✓ Database tables created successfully")
             
+            # Add columns and indexes that create_all doesn't add to existing tables
+            from app.schema import upgrade_schema
+            upgrade_schema()
+            
             # List tables
             from sqlalchemy import inspect
             inspector = inspect(db.engine)
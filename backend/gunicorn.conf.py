@@ -0,0 +1,14 @@
+"""
+Gunicorn configuration (picked up automatically from the working directory)
+
+Background job workers start here, in each serving worker once the app is
+loaded - never on import of the app package, so scripts that only import it
+(create_tables.py, test scripts) don't claim jobs.
+"""
+
+
+def post_worker_init(worker):
+    """Start this worker's job worker pool (JOB_WORKERS=0 disables)"""
+    from app import app
+    from app.jobs import start_worker_pool
+    start_worker_pool(app)
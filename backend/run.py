@@ -8,9 +8,14 @@ import sys
 sys.path.insert(0, os.path.dirname(__file__))
 
 from app import app
+from app.jobs import start_worker_pool
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
     print(f"Starting Flask server on http://0.0.0.0:{port}")
+    
+    # Background job workers run in the serving process, not the reloader's watcher
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_worker_pool(app)
     app.run(host='0.0.0.0', port=port, debug=True)
 
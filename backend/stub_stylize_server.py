@@ -0,0 +1,90 @@
+"""
+Local stub of the remote stylization service
+
+Accepts a PNG body (POST /stylize?style=cartoon) and returns a posterized PNG,
+so the remote stylization path (pooling, deadlines, cache, fallback) can be
+exercised completely offline.
+
+Usage:
+    python stub_stylize_server.py [port] [--delay SECONDS] [--fail]
+
+Then point the backend at it:
+    REMOTE_STYLIZE_BACKEND=http
+    REMOTE_STYLIZE_URL=http://localhost:8765/stylize
+"""
+import sys
+import time
+import threading
+import cv2
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(delay=0.0, fail=False):
+    """Build a request handler with the given artificial latency/failure"""
+
+    class StubStylizeHandler(BaseHTTPRequestHandler):
+        requests_served = 0
+
+        def do_POST(self):
+            StubStylizeHandler.requests_served += 1
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            if delay:
+                time.sleep(delay)
+
+            if fail:
+                self.send_error(503, 'Stub configured to fail')
+                return
+
+            image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                self.send_error(400, 'Body is not an image')
+                return
+
+            # Cheap "cartoon": smooth + posterize to 4 levels per channel
+            image = cv2.bilateralFilter(image, d=9, sigmaColor=75, sigmaSpace=75)
+            step = 256 // 4
+            image = (image // step) * step
+
+            ok, encoded = cv2.imencode('.png', image)
+            data = encoded.tobytes()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            print(f"   [stub] {format % args}")
+
+    return StubStylizeHandler
+
+
+def start_stub_server(port=0, delay=0.0, fail=False):
+    """
+    Start the stub server on a background thread
+
+    Returns:
+        tuple: (server, url) - call server.shutdown() when done
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(delay, fail))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/stylize"
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    delay = 0.0
+    fail = '--fail' in args
+    if '--delay' in args:
+        delay = float(args[args.index('--delay') + 1])
+    positional = [a for i, a in enumerate(args)
+                  if not a.startswith('--') and (i == 0 or args[i - 1] != '--delay')]
+    port = int(positional[0]) if positional else 8765
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), make_handler(delay, fail))
+    print(f"Stub stylize server on http://localhost:{port}/stylize (delay={delay}s, fail={fail})")
+    server.serve_forever()
@@ -0,0 +1,136 @@
+"""
+Test the canvas result cache end to end against SQLite and the local storage backend
+Covers: identical uploads joining an in-flight job, cache hits for later
+uploads, and cancelling a project while other uploads wait on its job
+"""
+import io
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Throwaway database, storage and scratch - must be set before the app is imported
+TEMP_DIR = tempfile.mkdtemp(prefix='canvas_cache_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TEMP_DIR, 'cache.db')}"
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['STORAGE_LOCAL_ROOT'] = os.path.join(TEMP_DIR, 'storage')
+os.environ['SCRATCH_DIR'] = os.path.join(TEMP_DIR, 'scratch')
+os.environ['CANVAS_EXECUTOR'] = 'thread'
+os.environ['MAX_CANVAS_SIZE'] = '300'
+os.environ['JOB_WORKERS'] = '0'
+
+# Add backend to path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import app.auth
+
+
+def verify_test_token(token):
+    """Tokens are just the user id"""
+    return {'uid': token, 'email': f'{token}@example.com', 'name': token}
+
+
+app.auth.verify_firebase_token = verify_test_token
+
+from app import app, db
+from app.models import CanvasResult, ColoringProject, Job
+from app.jobs import claim_job, JobWorkerPool
+
+PHOTOS = backend_dir.parent / 'test-photos'
+
+client = app.test_client()
+
+# Runs as a script or under pytest - either way inside the app context
+app.app_context().push()
+
+
+def reset():
+    Job.query.delete()
+    CanvasResult.query.delete()
+    ColoringProject.query.delete()
+    db.session.commit()
+
+
+def upload(user_id, photo='boba.jpg', num_colors=8):
+    """Create a project from a test photo; returns the response JSON"""
+    data = {'file': (io.BytesIO((PHOTOS / photo).read_bytes()), photo), 'num_colors': str(num_colors)}
+    response = client.post('/api/projects/create', data=data, content_type='multipart/form-data',
+                           headers={'Authorization': f'Bearer {user_id}'})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+
+def project(project_id):
+    db.session.expire_all()
+    return db.session.get(ColoringProject, project_id)
+
+
+def run_next_job():
+    """Claim and run one queued job the way a pool worker does"""
+    job_id = claim_job('w1', 600)
+    assert job_id is not None
+    JobWorkerPool(app, num_workers=0)._run('w1', job_id)
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def test_join_and_hit():
+    reset()
+
+    # Same photo twice before the first job ran -> one job, both projects wait on it
+    leader = upload('u1')
+    follower = upload('u2')
+    assert Job.query.filter_by(kind='canvas', status='queued').count() == 1
+    assert project(follower['project_id']).result_key == project(leader['project_id']).result_key
+    print("✅ Identical upload joined the in-flight job")
+
+    job = run_next_job()
+    assert job.status == 'completed'
+    for response in (leader, follower):
+        assert project(response['project_id']).status == 'completed'
+    assert project(leader['project_id']).template_data == project(follower['project_id']).template_data
+    print("✅ One run completed both projects")
+
+    # Later upload -> served from the cache, no job
+    hit = upload('u3')
+    assert hit['status'] == 'completed' and hit.get('cached')
+    assert claim_job('w1', 600) is None
+    result = db.session.get(CanvasResult, project(hit['project_id']).result_key)
+    assert result.status == 'ready' and result.hit_count == 1
+    print("✅ Third upload was a cache hit")
+
+
+def test_cancel_with_followers():
+    reset()
+
+    # The leader is cancelled while another upload waits -> its job keeps running
+    leader = upload('u1', photo='ldn.jpg')
+    follower = upload('u2', photo='ldn.jpg')
+
+    response = client.post(f"/api/projects/{leader['project_id']}/cancel", headers={'Authorization': 'Bearer u1'})
+    assert response.status_code == 200
+    job = Job.query.filter_by(project_id=leader['project_id']).one()
+    assert job.status == 'queued' and job.cancel_requested_at is None
+    print("✅ Cancelling the leader left the job for the waiting upload")
+
+    job = run_next_job()
+    assert job.status == 'completed'
+    assert project(follower['project_id']).status == 'completed'
+    assert project(leader['project_id']).status == 'cancelled'
+    print("✅ Waiting upload completed, cancelled project stayed cancelled")
+
+    # Nobody else waiting -> cancelling stops the job
+    alone = upload('u1', photo='ldn.jpg', num_colors=12)
+    response = client.post(f"/api/projects/{alone['project_id']}/cancel", headers={'Authorization': 'Bearer u1'})
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert Job.query.filter_by(project_id=alone['project_id']).one().status == 'cancelled'
+    assert claim_job('w1', 600) is None
+    print("✅ Cancelling the only waiting project cancelled its job")
+
+
+if __name__ == '__main__':
+    test_join_and_hit()
+    test_cancel_with_followers()
+    print("\n✅ All canvas cache checks passed")
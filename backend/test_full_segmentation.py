@@ -41,10 +41,7 @@ def test_full_pipeline(image_path, output_dir="output"):
     # Step 1: Cartoon preprocessing with Gemini-enhanced method
     print("\n--- STEP 1: Cartoon Preprocessing ---\n")
     
-    processor = NeuralCartoonProcessor(
-        image_path=str(input_path),
-        model_name='gemini-2.5-flash'
-    )
+    processor = NeuralCartoonProcessor(image_path=str(input_path))
     
     # Process (will use enhanced preprocessing since Gemini doesn't return images)
     processor.process(use_neural=True)
@@ -0,0 +1,250 @@
+"""
+Test the durable job queue against SQLite (no Postgres or workers needed)
+Covers: claiming, claim races, lease expiry and requeue, retry with backoff
+after handler errors, giving up after max_attempts, cancelling queued vs
+running jobs and fair scheduling
+"""
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Throwaway database - must be set before the app is imported
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='job_queue_'), 'jobs.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['JOB_MAX_QUEUE_WAIT'] = '300'
+os.environ['JOB_BULK_THRESHOLD'] = '3'
+
+# Add backend to path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+from app import app, db
+from app.models import Job
+from app.jobs import (enqueue_job, claim_job, requeue_expired_jobs, request_cancel,
+                      register_job_handler, JobWorkerPool)
+
+given_up = []
+cancelled = []
+register_job_handler('test', lambda job: None,
+                     on_give_up=lambda job, error: given_up.append(job.id),
+                     on_cancel=lambda job: cancelled.append(job.id))
+
+# Fails until its payload's 'failures' are used up
+flaky_runs = []
+
+
+def flaky_handler(job):
+    flaky_runs.append(job.attempts)
+    if len(flaky_runs) <= job.payload['failures']:
+        raise IOError('storage returned 503')
+
+
+register_job_handler('flaky', flaky_handler, on_give_up=lambda job, error: given_up.append(job.id))
+
+# Runs as a script or under pytest - either way inside the app context
+app.app_context().push()
+
+
+def reset():
+    Job.query.delete()
+    db.session.commit()
+    given_up.clear()
+    cancelled.clear()
+    flaky_runs.clear()
+
+
+def expire_lease(job_id):
+    """Pretend the worker holding a job died"""
+    Job.query.filter_by(id=job_id).update({'lease_expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_claim():
+    reset()
+    job = enqueue_job('test', {'n': 1}, user_id='u1')
+
+    assert claim_job('w1', 60) == job.id
+    assert claim_job('w2', 60) is None  # Nothing left
+
+    job = db.session.get(Job, job.id)
+    db.session.refresh(job)
+    assert job.status == 'running' and job.worker_id == 'w1' and job.attempts == 1
+    assert job.lease_expires_at > datetime.utcnow()
+    print("✅ Claim marks the job running with a lease")
+
+
+def test_claim_race():
+    reset()
+    job_ids = [enqueue_job('test', user_id=f'u{i % 4}').id for i in range(20)]
+    claims = []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        with app.app_context():
+            while True:
+                job_id = claim_job(worker_id, 60)
+                if job_id is None:
+                    return
+                with lock:
+                    claims.append(job_id)
+
+    threads = [threading.Thread(target=worker, args=(f'w{i}',)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claims) == sorted(job_ids), 'every job claimed exactly once'
+    print(f"✅ 6 racing workers claimed {len(claims)} jobs, none twice")
+
+
+def test_lease_expiry():
+    reset()
+    job = enqueue_job('test', max_attempts=2)
+    job_id = job.id
+
+    # Attempt 1: worker dies -> requeued
+    claim_job('w1', 60)
+    expire_lease(job_id)
+    assert requeue_expired_jobs() == 1
+    job = db.session.get(Job, job_id)
+    db.session.refresh(job)
+    assert job.status == 'queued' and job.worker_id is None
+    print("✅ Expired lease requeues the job")
+
+    # Attempt 2: worker dies again -> out of attempts
+    assert claim_job('w2', 60) == job_id
+    expire_lease(job_id)
+    requeue_expired_jobs()
+    db.session.refresh(job)
+    assert job.status == 'failed' and job.attempts == 2, (job.status, job.attempts)
+    assert given_up == [job_id]
+    assert claim_job('w3', 60) is None
+    print(f"✅ Gave up after {job.attempts} attempts: {job.error_message}")
+
+    # A live lease is left alone
+    live = enqueue_job('test')
+    claim_job('w1', 60)
+    assert requeue_expired_jobs() == 0
+    assert db.session.get(Job, live.id).status == 'running'
+    print("✅ Live lease not requeued")
+
+
+def run_claimed(worker_id='w1'):
+    """Claim and run one job the way a pool worker does"""
+    job_id = claim_job(worker_id, 60)
+    assert job_id is not None
+    JobWorkerPool(app, num_workers=0)._run(worker_id, job_id)
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def make_due(job_id):
+    """Skip a job's retry backoff"""
+    Job.query.filter_by(id=job_id).update({'run_after': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_retry():
+    reset()
+    job = enqueue_job('flaky', {'failures': 1})
+
+    # Attempt 1 fails -> back in the queue, but not claimable during the backoff
+    job = run_claimed()
+    assert job.status == 'queued' and job.attempts == 1 and job.run_after > datetime.utcnow()
+    assert claim_job('w2', 60) is None
+    print(f"✅ Failed job requeued with backoff: {job.error_message}")
+
+    # Attempt 2 succeeds
+    make_due(job.id)
+    job = run_claimed()
+    assert job.status == 'completed' and job.attempts == 2 and given_up == []
+    print("✅ Transient failure recovered on retry")
+
+    # Failing every time -> given up after max_attempts
+    reset()
+    job = enqueue_job('flaky', {'failures': 99}, max_attempts=3)
+    for _ in range(3):
+        make_due(job.id)
+        job = run_claimed()
+    assert job.status == 'failed' and job.attempts == 3 and given_up == [job.id]
+    assert flaky_runs == [1, 2, 3]
+    print(f"✅ Gave up after {job.attempts} failed attempts")
+
+
+def test_cancel():
+    reset()
+    running = enqueue_job('test', project_id='proj_a')
+    claim_job('w1', 60)
+    queued = enqueue_job('test', project_id='proj_a')
+
+    request_cancel('proj_a')
+    db.session.commit()
+
+    queued = db.session.get(Job, queued.id)
+    running = db.session.get(Job, running.id)
+    assert queued.status == 'cancelled' and cancelled == [queued.id]
+    assert running.status == 'running' and running.cancel_requested_at is not None
+    print("✅ Queued job cancelled at once, running job asked to stop")
+
+    # Its worker dies before noticing -> cancelled, not requeued
+    expire_lease(running.id)
+    requeue_expired_jobs()
+    db.session.refresh(running)
+    assert running.status == 'cancelled'
+    assert claim_job('w2', 60) is None
+    print("✅ Cancel-requested job with an expired lease is not retried")
+
+
+def test_fair_scheduling():
+    reset()
+
+    # u1 already has two jobs running and more queued; u2 queues one later
+    for _ in range(2):
+        enqueue_job('test', user_id='u1')
+        claim_job('w1', 60)
+    enqueue_job('test', user_id='u1')
+    late = enqueue_job('test', user_id='u2')
+    assert claim_job('w2', 60) == late.id
+    print("✅ Idle user served before a user with running jobs")
+
+    # Within a user's queue the cheapest job goes first
+    reset()
+    expensive = enqueue_job('test', user_id='u1', cost=100)
+    cheap = enqueue_job('test', user_id='u1', cost=1)
+    assert claim_job('w1', 60) == cheap.id
+    assert claim_job('w1', 60) == expensive.id
+    print("✅ Cheaper job of a user runs first")
+
+    # ...unless the expensive one has waited past JOB_MAX_QUEUE_WAIT
+    reset()
+    aged = enqueue_job('test', user_id='u1', cost=100)
+    aged.created_at = datetime.utcnow() - timedelta(seconds=600)
+    db.session.commit()
+    for _ in range(3):
+        enqueue_job('test', user_id='u1', cost=1)
+    enqueue_job('test', user_id='u2', cost=1)
+    assert claim_job('w1', 60) == aged.id
+    print("✅ Overdue expensive job not starved by cheaper ones")
+
+    # A user with a backlog is classed bulk and yields to a newcomer
+    reset()
+    bulk = [enqueue_job('test', user_id='u1') for _ in range(4)]
+    assert bulk[-1].user_class == 'bulk'
+    claim_job('w1', 60)  # u1's first (interactive) job
+    interactive = enqueue_job('test', user_id='u2')
+    assert claim_job('w2', 60) == interactive.id
+    print("✅ New user served before a user with a bulk backlog")
+
+
+if __name__ == '__main__':
+    test_claim()
+    test_claim_race()
+    test_lease_expiry()
+    test_retry()
+    test_cancel()
+    test_fair_scheduling()
+    print("\n✅ All job queue checks passed")
@@ -25,10 +25,8 @@ def test_neural_cartoon(image_path, output_dir="output"):
     
     try:
         # Initialize processor
-        processor = NeuralCartoonProcessor(
-            image_path=image_path,
-            model_name='gemini-3-flash-preview'
-        )
+        # Model comes from GEMINI_IMAGE_MODEL (see app/remote_stylizer.py)
+        processor = NeuralCartoonProcessor(image_path=image_path)
         
         # Process image
         processor.process(use_neural=True)
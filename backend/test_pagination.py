@@ -0,0 +1,134 @@
+"""
+Test listing pagination against SQLite and the local storage backend
+Covers: walking a listing with next_cursor, the legacy ?page= parameters
+and malformed cursor/limit/page values (400, not 500)
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Throwaway database and storage - must be set before the app is imported
+TEMP_DIR = tempfile.mkdtemp(prefix='pagination_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TEMP_DIR, 'pagination.db')}"
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['STORAGE_LOCAL_ROOT'] = os.path.join(TEMP_DIR, 'storage')
+os.environ['JOB_WORKERS'] = '0'
+
+# Add backend to path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+
+import app.auth
+
+
+def verify_test_token(token):
+    """Tokens are just the user id"""
+    return {'uid': token, 'email': f'{token}@example.com', 'name': token}
+
+
+app.auth.verify_firebase_token = verify_test_token
+
+from app import app, db, counters
+from app.models import ColoringProject
+from app.pagination import encode_cursor
+
+USER = 'pager'
+HEADERS = {'Authorization': f'Bearer {USER}'}
+
+client = app.test_client()
+
+# Runs as a script or under pytest - either way inside the app context
+app.app_context().push()
+
+
+def setup_projects(n=7):
+    """n projects of one user, two of them created at the same instant"""
+    for project in ColoringProject.query.filter_by(user_id=USER).all():
+        counters.project_removed(project)
+        db.session.delete(project)
+    db.session.commit()
+
+    start = datetime(2024, 1, 1)
+    ids = []
+    for i in range(n):
+        created_at = start + timedelta(minutes=min(i, n - 2))  # Last two share a timestamp
+        project = ColoringProject(id=f'proj_page_{i}', user_id=USER, title=f'Project {i}',
+                                  original_image_url=f'coloring/{USER}/originals/{i}.jpg',
+                                  status='completed', created_at=created_at)
+        db.session.add(project)
+        counters.project_added(project)
+        ids.append(project.id)
+    db.session.commit()
+    return ids
+
+
+def get_projects(query):
+    response = client.get(f'/api/projects?{query}', headers=HEADERS)
+    return response.status_code, response.get_json()
+
+
+def test_cursor_round_trip():
+    ids = setup_projects()
+    newest_first = sorted(ids, key=lambda pid: (db.session.get(ColoringProject, pid).created_at, pid), reverse=True)
+
+    seen = []
+    query = 'limit=3'
+    while True:
+        status, body = get_projects(query)
+        assert status == 200, body
+        seen += [p['id'] for p in body['projects']]
+        assert 'total' not in body['pagination']
+        if not body['pagination']['has_more']:
+            assert body['pagination']['next_cursor'] is None
+            break
+        query = f"limit=3&cursor={body['pagination']['next_cursor']}"
+
+    assert seen == newest_first, seen
+    print(f"✅ Cursor walk returned all {len(seen)} projects once, in order (equal timestamps included)")
+
+    status, body = get_projects('limit=3&include_total=true')
+    assert body['pagination']['total'] == len(ids)
+    print("✅ include_total adds the total")
+
+
+def test_legacy_page():
+    ids = setup_projects()
+
+    status, body = get_projects('page=2&limit=3')
+    assert status == 200, body
+    assert body['pagination']['page'] == 2 and body['pagination']['pages'] == 3
+    assert body['pagination']['total'] == len(ids)
+    assert len(body['projects']) == 3 and body['pagination']['has_more']
+
+    status, last = get_projects('page=3&limit=3')
+    assert len(last['projects']) == 1 and not last['pagination']['has_more']
+    print("✅ Legacy ?page= still pages with total and pages")
+
+
+def test_invalid_input():
+    setup_projects()
+
+    bad_cursors = ['not-a-cursor', 'e30', encode_cursor(datetime.utcnow(), 'x')[:-4] + '!!!!', '%FF%FE']
+    for cursor in bad_cursors:
+        status, body = get_projects(f'cursor={cursor}')
+        assert status == 400, (cursor, status, body)
+    print(f"✅ {len(bad_cursors)} malformed cursors rejected with 400")
+
+    for query in ('limit=abc', 'page=two', 'limit=1.5'):
+        status, body = get_projects(query)
+        assert status == 400, (query, status, body)
+    print("✅ Non-numeric limit/page rejected with 400")
+
+    # Public listing goes through the same code
+    response = client.get('/api/gallery?cursor=garbage')
+    assert response.status_code == 400, response.get_json()
+    print("✅ Gallery rejects a malformed cursor with 400")
+
+
+if __name__ == '__main__':
+    test_cursor_round_trip()
+    test_legacy_page()
+    test_invalid_input()
+    print("\n✅ All pagination checks passed")
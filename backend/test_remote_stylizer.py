@@ -0,0 +1,76 @@
+"""
+Test the remote stylization path offline against the local stub server
+Covers: result cache, per-call deadline, concurrency limit and local fallback
+"""
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+# Add backend to path
+backend_dir = Path(__file__).parent
+sys.path.insert(0, str(backend_dir))
+sys.path.insert(0, str(backend_dir / 'app'))
+
+from image_loader import load_image
+from remote_stylizer import RemoteStylizer, RemoteStylizeError
+from stub_stylize_server import start_stub_server
+
+IMAGE_PATH = backend_dir.parent / 'test-photos' / 'boba.jpg'
+
+
+def test_remote_stylizer():
+    image = load_image(IMAGE_PATH, target_size=400)
+    cache_dir = tempfile.mkdtemp(prefix='stylize_cache_')
+
+    # 1. Normal call, then cache hit
+    server, url = start_stub_server()
+    stylizer = RemoteStylizer(backend='http', url=url, timeout=10, cache_dir=cache_dir)
+
+    t0 = time.perf_counter()
+    first = stylizer.stylize(image)
+    t1 = time.perf_counter()
+    second = stylizer.stylize(image)
+    t2 = time.perf_counter()
+
+    assert first.shape == second.shape
+    assert stylizer.stats['calls'] == 1 and stylizer.stats['cache_hits'] == 1
+    print(f"✅ Remote call {1000 * (t1 - t0):.0f}ms, cache hit {1000 * (t2 - t1):.0f}ms")
+    server.shutdown()
+
+    # 2. Slow service -> deadline enforced
+    server, url = start_stub_server(delay=2.0)
+    slow = RemoteStylizer(backend='http', url=url, timeout=5, max_concurrency=1)
+
+    t0 = time.perf_counter()
+    try:
+        slow.stylize(image, timeout=0.5)
+        raise AssertionError("Expected timeout")
+    except RemoteStylizeError as e:
+        elapsed = time.perf_counter() - t0
+        assert elapsed < 1.0, elapsed
+        print(f"✅ Timed out after {1000 * elapsed:.0f}ms: {e}")
+
+    # 3. Slot still held by the hung call -> next caller rejected at its deadline
+    try:
+        slow.stylize(image, timeout=0.2)
+        raise AssertionError("Expected rejection")
+    except RemoteStylizeError as e:
+        assert slow.stats['rejected'] == 1
+        print(f"✅ Concurrency limit enforced: {e}")
+    server.shutdown()
+
+    # 4. Failing service -> error surfaces as RemoteStylizeError
+    server, url = start_stub_server(fail=True)
+    failing = RemoteStylizer(backend='http', url=url, timeout=5)
+    try:
+        failing.stylize(image)
+        raise AssertionError("Expected failure")
+    except RemoteStylizeError as e:
+        print(f"✅ Failure reported for fallback: {e}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    test_remote_stylizer()
+    print("\n✅ All remote stylizer checks passed")